@@ -1,50 +1,123 @@
 from flask import Flask, render_template, request, redirect, url_for, session, Response, make_response, flash, jsonify
-from xhtml2pdf import pisa
 import mysql.connector
-import csv
 import random
 import string
 import sys
-from io import StringIO, BytesIO
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import wraps
 import base64 # Import base64 for image encoding
 import re # Import re for regex matching
+import os
+import time
+import hmac
+from db_pool import ConnectionPool, DB_BACKGROUND_POOL_SIZE, DB_CONFIG, DB_SESSION_POOL_SIZE
+from stock_service import StockService
+from order_sequence import OrderSequence
+from bin_counters import BinCounters
+from stats_cache import StatsCache
+from catalog import ProductCatalog
+from barcode_index import BarcodeIndex
+from server_session import ServerSessionInterface, create_session_store, regenerate_session
+from csv_export import CsvExport
+from report_cache import ReportCache
+import ean13
+from barcode_images import BarcodeImages, MIMETYPES as BARCODE_MIMETYPES, create_barcode_images
+import barcode_codec
+from escpos_receipt import build_receipt
+from print_spooler import SpoolerFull, create_print_spooler
+from coin_dispenser import COINS_PER_PACKAGE, PayoutLedger, create_dispense_worker
+from offline_journal import OFFLINE_STORE_ID, OfflineRejected, OfflineSyncer, create_offline_journal
+from live_events import LiveEvents, TooManySubscribers, parse_last_event_id
+from request_metrics import METRICS_TOKEN, RequestMetrics
+from query_profiler import create_query_profiler
+
+# --- Profiles ---
+# แต่ละ process ลงทะเบียนเฉพาะกลุ่ม route ของ profile ตัวเอง (APP_PROFILE) ดู create_app() ท้ายไฟล์
+#   kiosk      ตู้ (Raspberry Pi): cart, bin, ใบเสร็จ
+#   admin      หลังร้าน: จัดการข้อมูล สินค้า บาร์โค้ด และรายงาน
+#   reporting  เฉพาะรายงาน CSV/PDF
+#   full       ทุก route (ค่าเริ่มต้น)
+PROFILES = {
+    'kiosk': ('core', 'kiosk'),
+    'admin': ('core', 'admin', 'reporting'),
+    'reporting': ('core', 'reporting'),
+    'full': ('core', 'kiosk', 'admin', 'reporting'),
+}
+APP_PROFILE = os.environ.get('APP_PROFILE', 'full')
+_routes = []  # (group, rule, options, view_func) ตามลำดับที่ประกาศ
+
+def route(group, rule, **options):
+    """Declares a view in a route group; create_app() registers it when the profile includes the group."""
+    def decorator(view_func):
+        _routes.append((group, rule, options, view_func))
+        return view_func
+    return decorator
 
-app = Flask(__name__)
-# โปรดเปลี่ยนเป็นคีย์ลับที่ปลอดภัยและไม่ซ้ำกันสำหรับแอปพลิเคชันของคุณ
-app.secret_key = 'your_strong_and_secret_key_here' 
-
-# --- Barcode Encoding/Decoding Functions ---
-def encode(x: int) -> int:
-    a = 982451653
-    b = 1234567891234
-    m = 10000000000039 # จำนวนเฉพาะที่ใกล้เคียง 10^13
-    return (a * x + b) % m
 
-def decode(y: int) -> int:
-    a = 982451653
-    b = 1234567891234
-    m = 10000000000039 # ต้องเป็นค่าเดียวกับ m ใน encode
-    a_inv = pow(a, m - 2, m) # หา inverse ของ a mod m โดยใช้ Fermat's Little Theorem
-    # ตรวจสอบให้แน่ใจว่าผลลัพธ์ของ (y - b) เป็นบวกก่อนการ modulo
-    return (a_inv * (y - b + m)) % m
+# --- Metrics ---
+# เวลาต่อ endpoint, จำนวน/เวลา query ต่อ request และเวลาเรนเดอร์ ส่งออกแบบ Prometheus ที่ /metrics
+request_metrics = RequestMetrics()
+# development/staging: บันทึกทุก SQL ต่อ request และหา N+1, query ช้า, full scan (QUERY_PROFILER ว่าง = ปิด)
+query_profiler = create_query_profiler()
 
+def wrap_cursor(cursor):
+    """Cursor wrapper of the pool: query metrics, plus the query profiler when it is enabled."""
+    cursor = request_metrics.wrap_cursor(cursor)
+    return query_profiler.wrap_cursor(cursor) if query_profiler else cursor
 
 # --- Database Connection ---
+db_pool = ConnectionPool(cursor_wrapper=wrap_cursor, **DB_CONFIG)
+# pool แยกสำหรับงานเบื้องหลังและงานนอก request ไม่ใช้ slot ของ request
+background_pool = ConnectionPool(pool_size=DB_BACKGROUND_POOL_SIZE, pool_name='project_bin_background',
+                                 cursor_wrapper=wrap_cursor, **DB_CONFIG)
+order_sequence = OrderSequence(background_pool.acquire, block_size=int(os.environ.get('ORDER_ID_BLOCK_SIZE', '20')))
+
+# --- Sessions ---
+# ข้อมูล session (รวม receipt_data) เก็บฝั่งเซิร์ฟเวอร์ cookie มีเพียงรหัส session (ดู server_session.py)
+# SESSION_BACKEND=mysql ใช้ pool ของตัวเอง (สร้างการเชื่อมต่อเมื่อใช้ครั้งแรก) ไม่แย่ง slot กับ request ที่ยังถือการเชื่อมต่ออยู่
+session_pool = ConnectionPool(pool_size=DB_SESSION_POOL_SIZE, pool_name='project_bin_session', **DB_CONFIG)
+session_store = create_session_store(connect=session_pool.acquire)
+
+CART_SCAN_BATCH_MAX = int(os.environ.get('CART_SCAN_BATCH_MAX', '500'))  # จำนวนรายการสูงสุดต่อ /api/cart/scan/batch
+
+# --- Caches ---
+# root_admin และ administrator เห็นสถิติรวมทุกร้าน จึงต้องล้างแคชเมื่อมีการเขียนข้อมูลในร้านใดก็ตาม
+stats_cache = StatsCache(ttl=float(os.environ.get('STATS_CACHE_TTL', '30')), global_scopes=('root_admin', 'administrator'))
+barcode_index = BarcodeIndex(max_entries=int(os.environ.get('BARCODE_INDEX_MAX_ENTRIES', '200000')),
+                             ttl=float(os.environ.get('BARCODE_INDEX_TTL', '300')))
+# รายงาน PDF เก็บบนดิสก์ ใช้ร่วมกันทุก worker (REPORT_CACHE_DIR, REPORT_CACHE_MAX_MB)
+report_cache = ReportCache()
+# ภาพบาร์โค้ด: LRU ในหน่วยความจำ + ไฟล์บนดิสก์ (BARCODE_CACHE_DIR, BARCODE_CACHE_MAX_MB)
+barcode_images = create_barcode_images()
+
+# --- Receipt printer ---
+# ใบเสร็จ ESC/POS ถูกส่งเข้าคิวพิมพ์เบื้องหลัง (RECEIPT_PRINTER ว่าง = ปิดการพิมพ์)
+# เริ่มโดย start_kiosk_services() เฉพาะ profile ที่มีกลุ่ม kiosk
+print_spooler = None
+
+# --- Live events ---
+# การเปลี่ยนแปลงที่ commit แล้ว (ธง bin, รายการในตะกร้า, การจ่ายเหรียญ) ถูก push ไปยังอุปกรณ์ผ่าน /events/<store_id>
+live_events = LiveEvents()
+
+def publish_payout(payout, status, coins_paid, error):
+    live_events.publish(payout['store_id'], 'payout', {'payout_id': payout['payout_id'], 'order_line_id': payout['order_line_id'],
+                                                       'status': status, 'coins': payout['coins'],
+                                                       'coins_paid': coins_paid, 'error': error})
+
+# --- Coin dispenser ---
+# การคืนบรรจุภัณฑ์บันทึกงานจ่ายเหรียญลง tbl_payout แล้ว thread เบื้องหลังสั่งเครื่องจ่าย (COIN_DISPENSER ว่าง = ปิด)
+# เริ่มโดย start_kiosk_services() เฉพาะ profile ที่มีกลุ่ม kiosk
+dispense_worker = None
+
 def get_db_connection():
     """
-    Establishes a connection to the MySQL database.
-    Returns the connection object or None if connection fails.
+    Returns the pooled MySQL connection lent to the current request.
+    The same connection is reused for every call within a request and is handed
+    back to the pool at teardown, so calling close() on it is harmless.
+    Returns None if no connection could be obtained.
     """
     try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="project2"
-        )
-        return conn
+        return db_pool.request_connection()
     except mysql.connector.Error as err:
         print(f"Error connecting to database: {err}")
         return None
@@ -72,18 +145,26 @@ def role_required(allowed_roles):
         return decorated_function
     return decorator
 
+def apply_bin_counter(cursor, store_id, category_id, delta):
+    """BinCounters.apply() that also stages a 'bin_flag' live event when the bin flag flips."""
+    flag = BinCounters.apply(cursor, store_id, category_id, delta)
+    if flag is not None:
+        live_events.stage(store_id, 'bin_flag', {'category_id': category_id, 'value': flag})
+    return flag
+
 # --- Routes ---
 
-@app.route("/")
+@route('core', "/")
 def root_redirect():
     """Redirects the root URL to the index page."""
     return redirect(url_for("index"))
 
-@app.route("/index", methods=["GET", "POST"])
+@route('core', "/index", methods=["GET", "POST"])
 def index():
     """
     Home page of the Trash For Coin system, displaying usage statistics.
     Statistics are only fetched and displayed if a user is logged in.
+    Counts are cached per (role, store_id) and invalidated by the write routes.
     """
     stats = {
         'total_products': 0,
@@ -95,53 +176,58 @@ def index():
     cursor = None
     try:
         if session.get('loggedin'):
-            conn = get_db_connection()
-            if conn:
-                cursor = conn.cursor()
-                
-                user_role = session.get('role')
-                user_store_id = session.get('store_id')
-
-                # Fetch total products (Moderator and Member see only their store's products)
-                if user_role in ['moderator', 'member', 'viewer'] and user_store_id:
-                    cursor.execute("SELECT COUNT(*) FROM tbl_products WHERE store_id = %s", (user_store_id,))
-                else: # root_admin, administrator, or roles without store_id see all
-                    cursor.execute("SELECT COUNT(*) FROM tbl_products")
-                stats['total_products'] = cursor.fetchone()[0]
+            user_role = session.get('role')
+            user_store_id = session.get('store_id')
+            cache_key = (user_role, user_store_id)
+            cached_stats = stats_cache.get(cache_key)
+            if cached_stats is not None:
+                stats = dict(cached_stats)
+            else:
+                conn = get_db_connection()
+                if conn:
+                    cursor = conn.cursor()
+
+                    # Fetch total products (Moderator and Member see only their store's products)
+                    if user_role in ['moderator', 'member', 'viewer'] and user_store_id:
+                        cursor.execute("SELECT COUNT(*) FROM tbl_products WHERE store_id = %s", (user_store_id,))
+                    else: # root_admin, administrator, or roles without store_id see all
+                        cursor.execute("SELECT COUNT(*) FROM tbl_products")
+                    stats['total_products'] = cursor.fetchone()[0]
                 
-                # Fetch total orders (Moderator and Member see only their store's orders)
-                if user_role in ['moderator', 'member', 'viewer'] and user_store_id:
-                    cursor.execute("""
-                        SELECT COUNT(id) FROM tbl_order
-                        WHERE store_id = %s
-                    """, (user_store_id,))
-                else: # root_admin, administrator, or roles without store_id see all
-                    cursor.execute("SELECT COUNT(*) FROM tbl_order")
-                stats['total_orders'] = cursor.fetchone()[0]
+                    # Fetch total orders (Moderator and Member see only their store's orders)
+                    if user_role in ['moderator', 'member', 'viewer'] and user_store_id:
+                        cursor.execute("""
+                            SELECT COUNT(id) FROM tbl_order
+                            WHERE store_id = %s
+                        """, (user_store_id,))
+                    else: # root_admin, administrator, or roles without store_id see all
+                        cursor.execute("SELECT COUNT(*) FROM tbl_order")
+                    stats['total_orders'] = cursor.fetchone()[0]
                 
-                # Fetch total categories (Moderator and Member see only their store's categories)
-                if user_role in ['moderator', 'member', 'viewer'] and user_store_id:
-                     cursor.execute("SELECT COUNT(*) FROM tbl_category WHERE store_id = %s", (user_store_id,))
-                else: # root_admin, administrator, or roles without store_id see all
-                    cursor.execute("SELECT COUNT(*) FROM tbl_category")
-                stats['total_categories'] = cursor.fetchone()[0]
-
-                # Fetch total users (Moderator and Admin see users from their store; root_admin sees all)
-                # Members and Viewers typically don't manage other users, so their stats here might be 0 or just themselves
-                if user_role == 'root_admin':
-                    cursor.execute("SELECT COUNT(*) FROM tbl_users")
-                    stats['total_users'] = cursor.fetchone()[0]
-                elif user_role in ['administrator', 'moderator']:
-                    if user_store_id:
-                        cursor.execute("SELECT COUNT(*) FROM tbl_users WHERE store_id = %s", (user_store_id,))
+                    # Fetch total categories (Moderator and Member see only their store's categories)
+                    if user_role in ['moderator', 'member', 'viewer'] and user_store_id:
+                         cursor.execute("SELECT COUNT(*) FROM tbl_category WHERE store_id = %s", (user_store_id,))
+                    else: # root_admin, administrator, or roles without store_id see all
+                        cursor.execute("SELECT COUNT(*) FROM tbl_category")
+                    stats['total_categories'] = cursor.fetchone()[0]
+
+                    # Fetch total users (Moderator and Admin see users from their store; root_admin sees all)
+                    # Members and Viewers typically don't manage other users, so their stats here might be 0 or just themselves
+                    if user_role == 'root_admin':
+                        cursor.execute("SELECT COUNT(*) FROM tbl_users")
                         stats['total_users'] = cursor.fetchone()[0]
-                    else: # Admin/Mod with no store_id might imply they can't manage users, or see all if root_admin style
-                        stats['total_users'] = 0 # Or handle as an error case/restricted view
-                elif user_role in ['member', 'viewer']: # Members/Viewers only count themselves if applicable
-                    if session.get('id'):
-                        stats['total_users'] = 1
-                    else:
-                        stats['total_users'] = 0 # Not logged in as a specific user
+                    elif user_role in ['administrator', 'moderator']:
+                        if user_store_id:
+                            cursor.execute("SELECT COUNT(*) FROM tbl_users WHERE store_id = %s", (user_store_id,))
+                            stats['total_users'] = cursor.fetchone()[0]
+                        else: # Admin/Mod with no store_id might imply they can't manage users, or see all if root_admin style
+                            stats['total_users'] = 0 # Or handle as an error case/restricted view
+                    elif user_role in ['member', 'viewer']: # Members/Viewers only count themselves if applicable
+                        if session.get('id'):
+                            stats['total_users'] = 1
+                        else:
+                            stats['total_users'] = 0 # Not logged in as a specific user
+                    stats_cache.set(cache_key, dict(stats))
     except mysql.connector.Error as err:
         print(f"Error fetching stats: {err}")
         flash(f"เกิดข้อผิดพลาดในการดึงสถิติ: {err}", 'danger')
@@ -156,7 +242,7 @@ def index():
     
     return render_template("index.html", stats=stats)
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('core', '/login', methods=['GET', 'POST'])
 def login():
     """
     Handles user login.
@@ -183,6 +269,7 @@ def login():
                 account = cursor.fetchone()
                 
                 if account:
+                    regenerate_session(session)  # ไม่ใช้รหัส session เดิมที่มีก่อนเข้าสู่ระบบ
                     session['loggedin'] = True
                     session['id'] = account['id']
                     session['email'] = account['email']
@@ -211,7 +298,7 @@ def login():
             conn.close()
     return render_template('login.html', msg=msg)
 
-@app.route('/logout')
+@route('core', '/logout')
 def logout():
     """
     Logs out the user by clearing the session.
@@ -227,10 +314,11 @@ def logout():
     session.pop('current_order_id', None)
     # session.pop('current_order_barcode', None) # No longer used as a session-wide barcode
     session.pop('receipt_data', None)
+    regenerate_session(session)
     flash('ออกจากระบบสำเร็จแล้ว!', 'success')
     return redirect(url_for('login'))
 
-@app.route('/register', methods=['GET', 'POST'])
+@route('core', '/register', methods=['GET', 'POST'])
 def register():
     """
     Handles new user registration.
@@ -268,6 +356,7 @@ def register():
                     cursor.execute('INSERT INTO tbl_users (firstname, lastname, email, password, role, store_id) VALUES (%s, %s, %s, %s, %s, %s)', 
                                (firstname, lastname, email, password, 'member', None)) # Explicitly set store_id to None
                     conn.commit()
+                    stats_cache.invalidate(None)
                     flash('คุณสมัครสมาชิกสำเร็จแล้ว! โปรดให้ผู้ดูแลระบบกำหนดร้านค้าให้คุณหากจำเป็น', 'success') # Inform user
                     return redirect(url_for('login'))
         
@@ -284,7 +373,7 @@ def register():
             conn.close()
     return render_template('register.html', msg=msg)
 
-@app.route('/profile', methods=['GET', 'POST'])
+@route('core', '/profile', methods=['GET', 'POST'])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
 def profile():
     """
@@ -350,12 +439,12 @@ def profile():
             conn.close()
     return render_template('profile.html', msg=msg, session=session)
 
-@app.route('/about')
+@route('core', '/about')
 def about():
     """Displays the 'About Us' page."""
     return render_template('about.html')
 
-@app.route('/contact', methods=['GET', 'POST'])
+@route('core', '/contact', methods=['GET', 'POST'])
 def contact():
     """
     Handles the 'Contact Us' form submission.
@@ -378,7 +467,7 @@ def contact():
     return render_template('contact.html', msg=msg)
 
 # --- Category Management ---
-@app.route("/tbl_category", methods=["GET", "POST"])
+@route('admin', "/tbl_category", methods=["GET", "POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer']) # Allow members and viewers
 def tbl_category():
     """
@@ -447,6 +536,7 @@ def tbl_category():
 
                 cursor.execute("INSERT INTO tbl_category (category_name, store_id) VALUES (%s, %s)", (category_name, store_id))
                 conn.commit()
+                stats_cache.invalidate(store_id)
                 flash('เพิ่มหมวดหมู่สำเร็จ!', 'success')
                 return redirect(url_for('tbl_category')) # Redirect after action
 
@@ -485,6 +575,7 @@ def tbl_category():
 
                 cursor.execute("UPDATE tbl_category SET category_name = %s, store_id = %s WHERE id = %s", (category_name, store_id, cat_id))
                 conn.commit()
+                stats_cache.invalidate()
                 flash('อัปเดตหมวดหมู่สำเร็จ!', 'success')
                 return redirect(url_for('tbl_category')) # Redirect after action
 
@@ -505,6 +596,7 @@ def tbl_category():
 
                 cursor.execute("DELETE FROM tbl_category WHERE id = %s", (cat_id,))
                 conn.commit()
+                stats_cache.invalidate()
                 flash('ลบหมวดหมู่สำเร็จ!', 'success')
                 return redirect(url_for('tbl_category')) # Redirect after action
             
@@ -557,7 +649,7 @@ def tbl_category():
     return render_template('tbl_category.html', categories=categories, search=search_query, msg=msg, session=session, stores=stores)
 
 
-@app.route("/tbl_products", methods=["GET", "POST"])
+@route('admin', "/tbl_products", methods=["GET", "POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer']) # Allow members and viewers
 def tbl_products():
     """
@@ -649,6 +741,8 @@ def tbl_products():
                 cursor.execute("INSERT INTO tbl_products (products_name, price, stock_quantity, category_id, barcode_id, store_id) VALUES (%s, %s, %s, %s, %s, %s)",
                                (products_name, price, stock_quantity, category_id, barcode_id, store_id))
                 conn.commit()
+                stats_cache.invalidate(store_id)
+                barcode_index.invalidate(store_id)
                 flash('เพิ่มสินค้าสำเร็จ!', 'success')
                 return redirect(url_for('tbl_products')) # Redirect after action
 
@@ -677,9 +771,10 @@ def tbl_products():
                     conn.rollback()
                     return redirect(url_for('tbl_products'))
 
+                cursor.execute("SELECT store_id FROM tbl_products WHERE products_id = %s", (products_id,))
+                product_data = cursor.fetchone()
+
                 if current_user_role == 'administrator' and current_user_store_id:
-                    cursor.execute("SELECT store_id FROM tbl_products WHERE products_id = %s", (products_id,))
-                    product_data = cursor.fetchone()
                     if product_data and product_data['store_id'] != current_user_store_id:
                         flash('คุณไม่มีสิทธิ์แก้ไขสินค้านี้', 'danger')
                         conn.rollback()
@@ -699,7 +794,12 @@ def tbl_products():
 
                 cursor.execute("UPDATE tbl_products SET products_name = %s, price = %s, stock_quantity = %s, category_id = %s, barcode_id = %s, store_id = %s WHERE products_id = %s",
                                (products_name, price, stock_quantity, category_id, barcode_id, store_id, products_id))
+                if product_data and product_data['store_id'] != store_id:
+                    # สินค้าย้ายร้าน: แจ้งแคตตาล็อกของร้านเดิมให้ลบออก
+                    ProductCatalog.record_deletion(cursor, products_id, product_data['store_id'])
                 conn.commit()
+                stats_cache.invalidate()
+                barcode_index.invalidate(product_data['store_id'] if product_data else None, store_id)
                 flash('อัปเดตสินค้าสำเร็จ!', 'success')
                 return redirect(url_for('tbl_products')) # Redirect after action
 
@@ -716,16 +816,21 @@ def tbl_products():
                     flash('รหัสสินค้าไม่ถูกต้อง!', 'danger')
                     return redirect(url_for('tbl_products'))
 
+                cursor.execute("SELECT store_id FROM tbl_products WHERE products_id = %s", (products_id,))
+                product_data = cursor.fetchone()
+
                 if current_user_role == 'administrator' and current_user_store_id:
-                    cursor.execute("SELECT store_id FROM tbl_products WHERE products_id = %s", (products_id,))
-                    product_data = cursor.fetchone()
                     if product_data and product_data['store_id'] != current_user_store_id:
                         flash('คุณไม่มีสิทธิ์ลบสินค้านี้', 'danger')
                         conn.rollback()
                         return redirect(url_for('tbl_products'))
 
                 cursor.execute("DELETE FROM tbl_products WHERE products_id = %s", (products_id,))
+                if product_data:
+                    ProductCatalog.record_deletion(cursor, products_id, product_data['store_id'])
                 conn.commit()
+                stats_cache.invalidate()
+                barcode_index.invalidate(product_data['store_id'] if product_data else None)
                 flash('ลบสินค้าสำเร็จ!', 'success')
                 return redirect(url_for('tbl_products')) # Redirect after action
 
@@ -791,7 +896,7 @@ def tbl_products():
    
 # --- Order Management ---
 
-@app.route("/tbl_order", methods=["GET", "POST"])
+@route('admin', "/tbl_order", methods=["GET", "POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
 def tbl_order():
     """
@@ -883,10 +988,6 @@ def tbl_order():
                     flash("ไม่พบสินค้าที่เลือกหรือสินค้าไม่ได้อยู่ในร้านค้าของคุณ!", 'danger')
                     return redirect(url_for('tbl_order'))
                 
-                if quantity > product_info['stock_quantity']:
-                    flash(f"สินค้า {product_info['products_name']} มีสต็อกไม่พอ. มีในสต็อก: {product_info['stock_quantity']}", 'danger')
-                    return redirect(url_for('tbl_order'))
-                
                 product_store_id = product_info['store_id'] if product_info['store_id'] is not None else current_user_store_id 
 
                 cursor.execute("SELECT id FROM tbl_order WHERE order_id = %s AND products_id = %s AND store_id = %s", (order_id, products_id, product_store_id))
@@ -896,19 +997,22 @@ def tbl_order():
                     conn.rollback()
                     return redirect(url_for('tbl_order'))
 
+                if not StockService.reserve(cursor, products_id, quantity):
+                    flash(f"สินค้า {product_info['products_name']} มีสต็อกไม่พอ. มีในสต็อก: {StockService.current(cursor, products_id)}", 'danger')
+                    conn.rollback()
+                    return redirect(url_for('tbl_order'))
+
                 insert_query = """
                     INSERT INTO tbl_order (order_id, email, products_id, quantity, disquantity, store_id, order_date, price_per_unit, barcode_id)
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """
                 cursor.execute(insert_query, (order_id, email, products_id, quantity, disquantity, product_store_id, datetime.now(), product_info['price'], barcode_id))
                 
-                update_stock_query = "UPDATE tbl_products SET stock_quantity = stock_quantity - %s WHERE products_id = %s"
-                cursor.execute(update_stock_query, (quantity, products_id))
-                
-                if disquantity > 0:
-                    cursor.execute("UPDATE tbl_bin SET value = 1 WHERE category_id = %s AND store_id = %s", (product_info['category_id'], product_store_id))
+                apply_bin_counter(cursor, product_store_id, product_info['category_id'], disquantity)
 
                 conn.commit()
+                live_events.commit()
+                stats_cache.invalidate(product_store_id)
                 flash('เพิ่มคำสั่งซื้อสำเร็จและอัปเดตสต็อกสินค้าแล้ว!', 'success')
                 return redirect(url_for('tbl_order')) 
             
@@ -970,44 +1074,36 @@ def tbl_order():
                     return redirect(url_for('tbl_order'))
                 
                 products_name = new_product_info['products_name']
-                current_stock_of_new_product = new_product_info['stock_quantity']
                 category_id_of_new_product = new_product_info['category_id']
 
 
-                if products_id != old_products_id:
-                    cursor.execute("UPDATE tbl_products SET stock_quantity = stock_quantity + %s WHERE products_id = %s", (old_quantity, old_products_id))
+                if str(products_id) != str(old_products_id):
+                    StockService.release(cursor, old_products_id, old_quantity)
                     
-                    if quantity > current_stock_of_new_product:
-                        flash(f"สินค้า {products_name} มีสต็อกไม่พอสำหรับการสั่งซื้อใหม่. มีในสต็อก: {current_stock_of_new_product}", 'danger')
+                    if not StockService.reserve(cursor, products_id, quantity):
+                        flash(f"สินค้า {products_name} มีสต็อกไม่พอสำหรับการสั่งซื้อใหม่. มีในสต็อก: {StockService.current(cursor, products_id)}", 'danger')
                         conn.rollback()
                         return redirect(url_for('tbl_order'))
-                    cursor.execute("UPDATE tbl_products SET stock_quantity = stock_quantity - %s WHERE products_id = %s", (quantity, products_id))
                 else:
                     quantity_difference = quantity - old_quantity
-                    if current_stock_of_new_product - quantity_difference < 0:
-                        flash(f"สินค้า {products_name} มีสต็อกไม่พอสำหรับการเปลี่ยนแปลงจำนวน. มีในสต็อก: {current_stock_of_new_product}", 'danger')
+                    if not StockService.adjust(cursor, products_id, -quantity_difference):
+                        flash(f"สินค้า {products_name} มีสต็อกไม่พอสำหรับการเปลี่ยนแปลงจำนวน. มีในสต็อก: {StockService.current(cursor, products_id)}", 'danger')
                         conn.rollback()
                         return redirect(url_for('tbl_order'))
-                    cursor.execute("UPDATE tbl_products SET stock_quantity = stock_quantity - %s WHERE products_id = %s", (quantity_difference, products_id))
                 
                 cursor.execute("""
                     UPDATE tbl_order SET order_id = %s, products_id = %s, products_name = %s, quantity = %s, disquantity = %s, email = %s, barcode_id = %s
                     WHERE id = %s
                 """, (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, ord_id))
 
-                if disquantity > 0: 
-                    cursor.execute("UPDATE tbl_bin SET value = 1 WHERE category_id = %s AND store_id = %s", (category_id_of_new_product, order_item_store_id))
-                elif disquantity == 0 and old_disquantity > 0: 
-                    cursor.execute("""
-                        SELECT COUNT(*) FROM tbl_order o 
-                        JOIN tbl_products p ON o.products_id = p.products_id 
-                        WHERE p.category_id = %s AND o.disquantity > 0 AND o.store_id = %s AND o.id != %s
-                    """, (category_id_of_new_product, order_item_store_id, ord_id))
-                    remaining_disposed_in_category_in_store = cursor.fetchone()[0]
-                    if remaining_disposed_in_category_in_store == 0:
-                        cursor.execute("UPDATE tbl_bin SET value = 0 WHERE category_id = %s AND store_id = %s", (category_id_of_new_product, order_item_store_id))
+                if str(products_id) != str(old_products_id):
+                    apply_bin_counter(cursor, order_item_store_id, BinCounters.category_of(cursor, old_products_id), -old_disquantity)
+                    apply_bin_counter(cursor, order_item_store_id, category_id_of_new_product, disquantity)
+                else:
+                    apply_bin_counter(cursor, order_item_store_id, category_id_of_new_product, disquantity - old_disquantity)
 
                 conn.commit()
+                live_events.commit()
                 flash('อัปเดตคำสั่งซื้อสำเร็จและอัปเดตสต็อกสินค้าแล้ว!', 'success')
                 return redirect(url_for('tbl_order')) 
 
@@ -1018,7 +1114,7 @@ def tbl_order():
                     conn.rollback()
                     return redirect(url_for('tbl_order'))
                 
-                order_to_delete_query = "SELECT products_id, quantity, store_id, email FROM tbl_order WHERE id = %s"
+                order_to_delete_query = "SELECT products_id, quantity, disquantity, store_id, email FROM tbl_order WHERE id = %s"
                 order_to_delete_params = [ord_id]
 
                 if current_user_role in ['moderator', 'member'] and current_user_store_id:
@@ -1041,19 +1137,13 @@ def tbl_order():
 
                 cursor.execute("DELETE FROM tbl_order WHERE id = %s", (ord_id,))
 
-                cursor.execute("UPDATE tbl_products SET stock_quantity = stock_quantity + %s WHERE products_id = %s", (quantity_to_restore, product_id_to_restore))
+                StockService.release(cursor, product_id_to_restore, quantity_to_restore)
 
-                cursor.execute("""
-                    SELECT COUNT(*) FROM tbl_order o 
-                    JOIN tbl_products p ON o.products_id = p.products_id 
-                    WHERE o.disquantity > 0 AND p.category_id = (SELECT category_id FROM tbl_products WHERE products_id = %s) AND o.store_id = %s
-                """, (product_id_to_restore, order_item_store_id))
-                remaining_disposed_for_category = cursor.fetchone()[0]
-
-                if remaining_disposed_for_category == 0:
-                    cursor.execute("UPDATE tbl_bin SET value = 0 WHERE category_id = (SELECT category_id FROM tbl_products WHERE products_id = %s) AND store_id = %s", (product_id_to_restore, order_item_store_id))
+                apply_bin_counter(cursor, order_item_store_id, BinCounters.category_of(cursor, product_id_to_restore), -order_to_delete['disquantity'])
 
                 conn.commit()
+                live_events.commit()
+                stats_cache.invalidate(order_item_store_id)
                 flash('ลบคำสั่งซื้อสำเร็จและคืนสต็อกสินค้าแล้ว!', 'success')
                 return redirect(url_for('tbl_order')) 
 
@@ -1129,7 +1219,7 @@ def tbl_order():
 
 
 # --- User Management ---
-@app.route("/tbl_users", methods=["GET", "POST"])
+@route('admin', "/tbl_users", methods=["GET", "POST"])
 @role_required(['root_admin', 'administrator', 'moderator']) 
 def tbl_users():
     """
@@ -1244,6 +1334,7 @@ def tbl_users():
                 sql_insert = 'INSERT INTO tbl_users (firstname, lastname, email, password, role, store_id) VALUES (%s, %s, %s, %s, %s, %s)'
                 cursor.execute(sql_insert, (firstname, lastname, email, password, new_user_role, new_user_store_id))
                 conn.commit()
+                stats_cache.invalidate(new_user_store_id)
                 flash('เพิ่มผู้ใช้งานสำเร็จ!', 'success')
                 return redirect(url_for('tbl_users')) # Redirect after action
 
@@ -1360,6 +1451,7 @@ def tbl_users():
                     cursor.execute(sql_update, (firstname, lastname, email, effective_role, effective_store_id, user_id))
                 
                 conn.commit()
+                stats_cache.invalidate(target_user_store_id, effective_store_id)
                 flash('อัปเดตผู้ใช้งานสำเร็จ!', 'success')
                 return redirect(url_for('tbl_users')) # Redirect after action
 
@@ -1417,6 +1509,7 @@ def tbl_users():
 
                 cursor.execute("DELETE FROM tbl_users WHERE id = %s", (user_id,))
                 conn.commit()
+                stats_cache.invalidate(target_user_store_id)
                 flash('ลบผู้ใช้งานสำเร็จ!', 'success')
                 return redirect(url_for('tbl_users')) # Redirect after action
             
@@ -1476,7 +1569,7 @@ def tbl_users():
 
     return render_template("tbl_users.html", users=users, search=search_query, stores=stores, session=session)
 
-@app.route("/assign_store", methods=["POST"])
+@route('admin', "/assign_store", methods=["POST"])
 @role_required(['root_admin', 'administrator'])
 def assign_store():
     """
@@ -1561,6 +1654,7 @@ def assign_store():
         else:
             cursor.execute("UPDATE tbl_users SET store_id = %s WHERE id = %s", (store_id, user_id))
         conn.commit()
+        stats_cache.invalidate(target_user_store_id, store_id)
         flash(f"User ID {user_id} assigned to store ID {store_id if store_id is not None else 'NULL'} successfully.", 'success')
     except mysql.connector.Error as err:
         print(f"Error assigning store: {err}") 
@@ -1578,19 +1672,45 @@ def assign_store():
     return redirect(url_for('tbl_users'))
 
 # --- Barcode Scanner Route ---
-@app.route("/barcode_scanner")
+@route('kiosk', "/barcode_scanner")
 def barcode_scanner():
    return render_template("barcode_scanner.html")
 
-@app.route("/generate_barcode", methods=['POST'])
+BARCODE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+def barcode_image_response(code, fmt='png'):
+    """
+    Serves an EAN-13 image from the barcode image caches. The image depends only
+    on the code, so it carries a strong ETag and a long-lived Cache-Control, and a
+    matching If-None-Match is answered with 304 without rendering.
+    """
+    etag = BarcodeImages.etag(code, fmt)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        with request_metrics.timer('image', f'barcode_{fmt}'):
+            data, etag = barcode_images.get(code, fmt)
+        response = make_response(data)
+        response.headers['Content-Type'] = BARCODE_MIMETYPES[fmt]
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = BARCODE_CACHE_CONTROL
+    return response
+
+@route('admin', "/generate_barcode", methods=['POST'])
 @role_required(['root_admin', 'administrator', 'moderator'])
 def generate_barcode():
+    """Returns the EAN-13 label (PNG, or SVG with format=svg) of a product's barcode_id."""
     conn = None
     cursor = None
     try:
-        if not session.get('loggedin'):
-            flash("กรุณาเข้าสู่ระบบ", 'danger')
-            return redirect(url_for('login'))
+        product_id = request.form.get('product_id')
+        if not product_id:
+            flash("รหัสสินค้าไม่ถูกต้อง.", 'danger')
+            return redirect(url_for('tbl_products')) 
+        product_id = int(product_id)
+        fmt = request.form.get('format', 'png')
+        if fmt not in BARCODE_MIMETYPES:
+            fmt = 'png'
 
         conn = get_db_connection()
         if not conn:
@@ -1598,147 +1718,232 @@ def generate_barcode():
             return redirect(url_for('index')) 
 
         cursor = conn.cursor(dictionary=True)
-        product_id = request.form.get('product_id')
-        if not product_id:
-            flash("รหัสสินค้าไม่ถูกต้อง.", 'danger')
-            return redirect(url_for('tbl_products')) 
-
         current_user_store_id = session.get('store_id')
-        product_check_query = "SELECT products_name FROM tbl_products WHERE products_id = %s"
+        product_check_query = "SELECT products_name, barcode_id FROM tbl_products WHERE products_id = %s"
         product_check_params = [product_id]
         if current_user_store_id: 
             product_check_query += " AND (store_id = %s OR store_id IS NULL)" 
             product_check_params.append(current_user_store_id)
         
         cursor.execute(product_check_query, tuple(product_check_params))
-        product_exists = cursor.fetchone()
-        if not product_exists:
+        product = cursor.fetchone()
+        if not product:
             flash("ไม่พบรหัสสินค้านี้ในร้านค้าของคุณ หรือคุณไม่มีสิทธิ์สร้างบาร์โค้ดสำหรับสินค้านี้.", 'danger')
             return redirect(url_for('tbl_products'))
+        if not product['barcode_id']:
+            flash(f"สินค้า {product['products_name']} ยังไม่มีรหัสบาร์โค้ด.", 'danger')
+            return redirect(url_for('tbl_products'))
+    except ValueError:
+        flash("รหัสสินค้าไม่ถูกต้อง (ต้องเป็นตัวเลข).", 'danger')
+        return redirect(url_for('tbl_products')) 
+    except mysql.connector.Error as err:
+        flash(f"เกิดข้อผิดพลาดจากฐานข้อมูล: {err}", 'danger')
+        return redirect(url_for('tbl_products')) 
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
 
-        encoded_id = encode(int(product_id))
-        barcode_value = str(encoded_id).zfill(13) 
-
-
-        width, height = 300, 100
-        image = Image.new('RGB', (width, height), 'white')
-        draw = ImageDraw.Draw(image)
+    # ป้ายต้องเป็น EAN-13 ที่ถูกต้อง (check digit) เครื่องสแกนจึงจะอ่านได้
+    try:
+        code = ean13.normalize(product['barcode_id'])
+    except ValueError as e:
+        flash(f"รหัสบาร์โค้ดของสินค้า {product['products_name']} ไม่ใช่ EAN-13 ที่ถูกต้อง: {e}", 'danger')
+        return redirect(url_for('tbl_products'))
+    try:
+        return barcode_image_response(code, fmt)
+    except Exception as e:
+        flash(f"เกิดข้อผิดพลาดในการสร้างบาร์โค้ด: {e}", 'danger')
+        return redirect(url_for('tbl_products')) 
 
-        try:
-            font_path = "arial.ttf" 
-            font_size = 20 
-            font = ImageFont.truetype(font_path, font_size)
-        except IOError:
-            font = ImageFont.load_default()
-            print("Warning: Custom font not found. Using default font.")
-
-        bar_width = 2
-        bar_height = 50
-        total_bar_width = len(barcode_value) * bar_width * 2 
-        start_x = (width - total_bar_width) / 2
-        if start_x < 0: start_x = 0 
-
-        for i, digit_char in enumerate(barcode_value):
-            x0 = start_x + i * bar_width * 2
-            x1 = x0 + bar_width
-            if digit_char == '0':
-                pass 
-            else: 
-                draw.rectangle([(x0, 10), (x1, 10 + bar_height)], fill='black')
-        
-        text_display = f"ID: {product_id} | Barcode: {barcode_value}"
-        
-        text_bbox = draw.textbbox((0,0), text_display, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
+@route('admin', "/barcode/<code>.<fmt>")
+@role_required(['root_admin', 'administrator', 'moderator'])
+def barcode_image(code, fmt):
+    """Cacheable EAN-13 image (png or svg) for label printing; 12 digits get their check digit."""
+    if fmt not in BARCODE_MIMETYPES:
+        return make_response("Unsupported format", 404)
+    try:
+        code = ean13.normalize(code)
+    except ValueError as e:
+        return make_response(str(e), 400)
+    return barcode_image_response(code, fmt)
 
-        text_x = (width - text_width) / 2
-        text_y = 10 + bar_height + 5 
+@route('admin', "/barcode_labels")
+@role_required(['root_admin', 'administrator', 'moderator'])
+def barcode_labels():
+    """
+    Returns a label sheet for many products at once. Filters: store_id
+    (users bound to a store always get their own), category_id and ids
+    (comma-separated product ids). layout=a4|roll58, format=pdf|png (png is one
+    page; page=N selects which).
+    """
+    import label_sheet  # PIL และ reportlab โหลดเมื่อใช้งานครั้งแรกเท่านั้น
 
-        draw.text((text_x, text_y), text_display, fill='black', font=font)
+    layout = request.args.get('layout', 'a4')
+    fmt = request.args.get('format', 'pdf')
+    if layout not in label_sheet.LAYOUTS or fmt not in ('pdf', 'png'):
+        flash("รูปแบบป้ายไม่ถูกต้อง.", 'danger')
+        return redirect(url_for('tbl_products'))
 
-        img_io = BytesIO()
-        image.save(img_io, 'PNG')
-        img_io.seek(0)
+    conn = None
+    cursor = None
+    try:
+        store_id = session.get('store_id') or request.args.get('store_id', type=int)
+        category_id = request.args.get('category_id', type=int)
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
 
-        response = make_response(img_io.getvalue())
-        response.headers['Content-Type'] = 'image/png'
-        return response
+        conn = get_db_connection()
+        if not conn:
+            flash("ไม่สามารถเชื่อมต่อฐานข้อมูลได้.", 'danger')
+            return redirect(url_for('tbl_products'))
 
+        cursor = conn.cursor(dictionary=True)
+        query = "SELECT products_name, price, barcode_id FROM tbl_products"
+        where_clauses = []
+        params = []
+        if store_id:
+            where_clauses.append("(store_id = %s OR store_id IS NULL)")
+            params.append(store_id)
+        if category_id:
+            where_clauses.append("category_id = %s")
+            params.append(category_id)
+        if ids:
+            where_clauses.append(f"products_id IN ({', '.join(['%s'] * len(ids))})")
+            params.extend(ids)
+        if where_clauses:
+            query += " WHERE " + " AND ".join(where_clauses)
+        query += " ORDER BY products_id LIMIT %s"
+        params.append(label_sheet.LABEL_SHEET_MAX)
+        cursor.execute(query, tuple(params))
+        products = cursor.fetchall()
     except ValueError:
         flash("รหัสสินค้าไม่ถูกต้อง (ต้องเป็นตัวเลข).", 'danger')
-        return redirect(url_for('tbl_products')) 
+        return redirect(url_for('tbl_products'))
     except mysql.connector.Error as err:
         flash(f"เกิดข้อผิดพลาดจากฐานข้อมูล: {err}", 'danger')
-        return redirect(url_for('tbl_products')) 
-    except Exception as e:
-        flash(f"เกิดข้อผิดพลาดในการสร้างบาร์โค้ด: {e}", 'danger')
-        return redirect(url_for('tbl_products')) 
+        return redirect(url_for('tbl_products'))
     finally:
         if cursor:
             cursor.close()
         if conn:
             conn.close()
 
+    labels, skipped = label_sheet.printable_labels(products)
+    if not labels:
+        flash("ไม่พบสินค้าที่มีรหัสบาร์โค้ด EAN-13 ที่ถูกต้องตามเงื่อนไขนี้.", 'danger')
+        return redirect(url_for('tbl_products'))
+
+    try:
+        with request_metrics.timer('image' if fmt == 'png' else 'pdf', f'label_sheet_{layout}'):
+            if fmt == 'png':
+                per_page = label_sheet.labels_per_page(layout)
+                page = max(request.args.get('page', 1, type=int), 1)
+                labels = labels[(page - 1) * per_page:page * per_page]
+                sheet = label_sheet.build_png(label_sheet.render_labels(labels), layout)
+                mimetype = 'image/png'
+            else:
+                sheet = label_sheet.build_pdf(label_sheet.render_labels(labels), layout)
+                mimetype = 'application/pdf'
+    except Exception as e:
+        print(f"Error building label sheet: {e}")
+        flash(f"เกิดข้อผิดพลาดในการสร้างป้ายบาร์โค้ด: {e}", 'danger')
+        return redirect(url_for('tbl_products'))
+
+    response = make_response(sheet)
+    response.headers['Content-Type'] = mimetype
+    response.headers['Content-Disposition'] = f"inline; filename=barcode_labels_{layout}.{fmt}"
+    # จำนวนสินค้าที่ข้ามไปเพราะไม่มีบาร์โค้ดหรือ check digit ไม่ถูกต้อง
+    response.headers['X-Labels-Skipped'] = str(len(skipped))
+    return response
+
 # --- Report Generation ---
-@app.route("/export_products_csv")
+def export_filters():
+    """
+    Reads the optional export filters from the query string: date_from / date_to
+    (YYYY-MM-DD, both inclusive) and store_id. Users bound to a store always get
+    their own store. Raises ValueError on a malformed date.
+    """
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    date_from = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+    date_to = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+    store_id = session.get('store_id') or request.args.get('store_id', type=int)
+    return date_from, date_to, store_id
+
+def csv_stream_response(query, params, filename, header=None):
+    """
+    Starts a streaming CSV export. The first chunk is pulled here so database
+    errors are still raised inside the calling route's try block.
+    """
+    chunks = CsvExport.stream(query, params, header=header, cursor_wrapper=wrap_cursor)
+    first_chunk = next(chunks)
+
+    def generate():
+        yield first_chunk
+        yield from chunks
+
+    response = Response(generate(), mimetype="text/csv")
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+@route('reporting', "/export_products_csv")
 @role_required(['root_admin', 'administrator', 'moderator'])
 def export_products_csv():
-    """Exports product data to a CSV file. Filters by store_id for relevant roles."""
-    conn = None
-    cursor = None
+    """
+    Streams product data as CSV. Filters by store_id for relevant roles;
+    date_from / date_to filter on the last update time.
+    """
     try:
-        conn = get_db_connection()
-        if not conn:
-            flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
-            return redirect(url_for('tbl_products'))
-        
-        cursor = conn.cursor(dictionary=True)
-        
-        current_user_role = session.get('role')
-        current_user_store_id = session.get('store_id')
+        date_from, date_to, store_id = export_filters()
+    except ValueError:
+        flash("รูปแบบวันที่ไม่ถูกต้อง (ต้องเป็น YYYY-MM-DD).", 'danger')
+        return redirect(url_for('tbl_products'))
 
+    try:
         product_query = "SELECT products_id, products_name, stock_quantity, price, category_id, barcode_id, store_id FROM tbl_products"
+        where_clauses = []
         product_params = []
-        if current_user_store_id: 
-            product_query += " WHERE store_id = %s"
-            product_params.append(current_user_store_id)
+        if store_id:
+            where_clauses.append("store_id = %s")
+            product_params.append(store_id)
+        if date_from:
+            where_clauses.append("updated_at >= %s")
+            product_params.append(date_from)
+        if date_to:
+            where_clauses.append("updated_at < %s")
+            product_params.append(date_to)
+        if where_clauses:
+            product_query += " WHERE " + " AND ".join(where_clauses)
 
-        cursor.execute(product_query, tuple(product_params))
-        products = cursor.fetchall()
-        
-        si = StringIO()
-        cw = csv.writer(si)
-        
-        cw.writerow(['Product ID', 'Product Name', 'Stock Quantity', 'Price', 'Category ID', 'Barcode ID', 'Store ID'])
-        
-        for product in products:
-            cw.writerow([product['products_id'], product['products_name'], product['stock_quantity'], product['price'], product['category_id'], product['barcode_id'], product['store_id']])
-        
-        output = make_response(si.getvalue())
-        output.headers["Content-Disposition"] = "attachment; filename=products_report.csv"
-        output.headers["Content-type"] = "text/csv"
-        return output
+        return csv_stream_response(product_query, product_params, "products_report.csv",
+                                   header=['Product ID', 'Product Name', 'Stock Quantity', 'Price', 'Category ID', 'Barcode ID', 'Store ID'])
     except mysql.connector.Error as err:
         print(f"Error exporting products CSV: {err}") 
         flash(f"เกิดข้อผิดพลาดในการส่งออกข้อมูลสินค้า: {err}", 'danger')
-        if conn: conn.rollback()
         return redirect(url_for('tbl_products'))
     except Exception as e:
         print(f"An unexpected error occurred during CSV export: {e}") 
         flash(f"เกิดข้อผิดพลาดที่ไม่คาดคิด: {e}", 'danger')
-        if conn: conn.rollback()
         return redirect(url_for('tbl_products'))
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
-@app.route("/export_orders_pdf")
+@route('reporting', "/export_orders_pdf")
 @role_required(['root_admin', 'administrator', 'moderator', 'member'])
 def export_orders_pdf():
-    """Exports order data to a PDF file. Filters by store_id for relevant roles."""
+    """
+    Exports order data to a PDF file. Filters by store_id for relevant roles and
+    optionally by date_from / date_to. Rendered reports are cached on disk under
+    the scope, the filters and the orders' watermark, so an unchanged dataset is
+    served without re-rendering.
+    """
+    from pdf_render import PdfRenderError, render_orders_pdf  # xhtml2pdf/pypdf/reportlab โหลดเมื่อใช้งานครั้งแรกเท่านั้น
+
+    try:
+        date_from, date_to, store_id = export_filters()
+    except ValueError:
+        flash("รูปแบบวันที่ไม่ถูกต้อง (ต้องเป็น YYYY-MM-DD).", 'danger')
+        return redirect(url_for('tbl_order'))
+
     conn = None
     cursor = None
     try:
@@ -1768,7 +1973,6 @@ def export_orders_pdf():
                 s.store_name
             FROM tbl_order o
             LEFT JOIN tbl_products p ON o.products_id = p.products_id
-            LEFT JOIN tbl_users u ON o.email = u.email
             LEFT JOIN tbl_stores s ON o.store_id = s.store_id
         """
         query_params = []
@@ -1781,29 +1985,40 @@ def export_orders_pdf():
             elif current_user_role in ['administrator', 'moderator', 'viewer']:
                 where_clauses.append("o.store_id = %s")
                 query_params.append(current_user_store_id)
-        elif current_user_role == 'root_admin':
-            pass 
-
-        if where_clauses:
-            base_query += " WHERE " + " AND ".join(where_clauses)
-        
-        base_query += " ORDER BY o.order_date DESC"
-        
-        cursor.execute(base_query, tuple(query_params))
-        orders = cursor.fetchall()
-
-        html = render_template("pdf_template_orders.html", orders=orders)
-        
-        pdf_buffer = BytesIO()
-        pisa_status = pisa.CreatePDF(html, dest=pdf_buffer)
-
-        if pisa_status.err:
-            flash(f"เกิดข้อผิดพลาดในการสร้าง PDF: {pisa_status.err}", 'danger')
-            return redirect(url_for('tbl_order'))
-
-        pdf_buffer.seek(0)
-        
-        response = make_response(pdf_buffer.getvalue())
+        elif store_id:
+            where_clauses.append("o.store_id = %s")
+            query_params.append(store_id)
+        if date_from:
+            where_clauses.append("o.order_date >= %s")
+            query_params.append(date_from)
+        if date_to:
+            where_clauses.append("o.order_date < %s")
+            query_params.append(date_to)
+
+        where_sql = " WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+
+        # watermark: เปลี่ยนทุกครั้งที่มีการเพิ่ม แก้ไข หรือลบคำสั่งซื้อในขอบเขตนี้
+        cursor.execute(f"SELECT COUNT(*) AS row_count, MAX(o.id) AS max_id, MAX(o.updated_at) AS max_updated FROM tbl_order o{where_sql}",
+                       tuple(query_params))
+        watermark = cursor.fetchone()
+        cache_key = ReportCache.make_key('orders_pdf', where_sql, [str(p) for p in query_params],
+                                         watermark['row_count'], watermark['max_id'], str(watermark['max_updated']))
+        pdf_data = report_cache.get(cache_key)
+
+        if pdf_data is None:
+            cursor.execute(base_query + where_sql + " ORDER BY o.order_date DESC", tuple(query_params))
+            orders = cursor.fetchall()
+
+            # รายงานใหญ่ถูกแบ่งเรนเดอร์ขนานกันหลาย process (ดู pdf_render.py)
+            try:
+                with request_metrics.timer('pdf', 'orders_report'):
+                    pdf_data = render_orders_pdf(orders, datetime.now().strftime('%d/%m/%Y %H:%M'))
+            except PdfRenderError as e:
+                flash(f"เกิดข้อผิดพลาดในการสร้าง PDF: {e}", 'danger')
+                return redirect(url_for('tbl_order'))
+            report_cache.put(cache_key, pdf_data)
+
+        response = make_response(pdf_data)
         response.headers["Content-Disposition"] = "attachment; filename=orders_report.pdf"
         response.headers["Content-type"] = "application/pdf"
         return response
@@ -1823,19 +2038,20 @@ def export_orders_pdf():
         if conn:
             conn.close()
 
-@app.route("/export_orders_csv")
+@route('reporting', "/export_orders_csv")
 @role_required(['root_admin', 'administrator', 'moderator', 'member'])
 def export_orders_csv():
-    """Exports order data to a CSV file. Filters by store_id for relevant roles."""
-    conn = None
-    cursor = None
+    """
+    Streams order data as CSV. Filters by store_id for relevant roles and
+    optionally by date_from / date_to on the order date.
+    """
     try:
-        conn = get_db_connection()
-        if not conn:
-            flash("ไม่สามารถเชื่อมต่อฐานข้อมูล.", 'danger')
-            return redirect(url_for('tbl_order'))
+        date_from, date_to, store_id = export_filters()
+    except ValueError:
+        flash("รูปแบบวันที่ไม่ถูกต้อง (ต้องเป็น YYYY-MM-DD).", 'danger')
+        return redirect(url_for('tbl_order'))
 
-        cursor = conn.cursor(dictionary=True)
+    try:
         current_user_role = session.get('role')
         current_user_store_id = session.get('store_id')
 
@@ -1856,7 +2072,6 @@ def export_orders_csv():
                 s.store_name
             FROM tbl_order o
             LEFT JOIN tbl_products p ON o.products_id = p.products_id
-            LEFT JOIN tbl_users u ON o.email = u.email
             LEFT JOIN tbl_stores s ON o.store_id = s.store_id
         """
         query_params = []
@@ -1869,50 +2084,158 @@ def export_orders_csv():
             elif current_user_role in ['administrator', 'moderator', 'viewer']:
                 where_clauses.append("o.store_id = %s")
                 query_params.append(current_user_store_id)
-        elif current_user_role == 'root_admin':
-            pass 
+        elif store_id:
+            where_clauses.append("o.store_id = %s")
+            query_params.append(store_id)
+        if date_from:
+            where_clauses.append("o.order_date >= %s")
+            query_params.append(date_from)
+        if date_to:
+            where_clauses.append("o.order_date < %s")
+            query_params.append(date_to)
 
         if where_clauses:
             base_query += " WHERE " + " AND ".join(where_clauses)
         
         base_query += " ORDER BY o.order_date DESC"
-        
-        cursor.execute(base_query, tuple(query_params))
-        orders = cursor.fetchall()
-
-        si = StringIO()
-        cw = csv.writer(si)
-
-        if orders:
-            header = orders[0].keys()
-            cw.writerow(header)
-        
-        for order in orders:
-            cw.writerow(order.values())
-        
-        output = si.getvalue()
-        response = make_response(output)
-        response.headers["Content-Disposition"] = "attachment; filename=orders_report.csv"
-        response.headers["Content-type"] = "text/csv"
-        return response
 
+        return csv_stream_response(base_query, query_params, "orders_report.csv")
     except mysql.connector.Error as err:
         print(f"Error exporting orders CSV: {err}") 
         flash(f"เกิดข้อผิดพลาดในการส่งออกรายงานคำสั่งซื้อ: {err}", 'danger')
-        if conn: conn.rollback()
     except Exception as e:
         print(f"An unexpected error occurred during CSV export: {e}") 
         flash(f"เกิดข้อผิดพลาดที่ไม่คาดคิดในการส่งออก CSV: {e}", 'danger')
-        if conn: conn.rollback()
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
     return redirect(url_for('tbl_order'))
 
 # --- Route จัดการคำสั่งซื้อ (cart) ---
-@app.route("/cart", methods=["GET", "POST"])
+def stage_cart_line(store_id, order_id, products_id, products_name, added=None, quantity=None):
+    """Stages a 'cart_line' live event: `added` units for a scan, or the new `quantity` (0 = removed) for an edit."""
+    data = {'order_id': order_id, 'products_id': str(products_id), 'products_name': products_name}
+    if added is not None:
+        data['added'] = added
+    if quantity is not None:
+        data['quantity'] = quantity
+    live_events.stage(store_id, 'cart_line', data)
+
+def apply_cart_scan(cursor, barcode, order_id, email, store_id, quantity=1):
+    """
+    Adds `quantity` units of the product behind `barcode` to an open cart order.
+    Returns (result, None) on success, where result holds the product, the store
+    the line belongs to and whether a new line was created, or (None, (message, http_status))
+    on failure. The caller commits or rolls back.
+    """
+    product_info = barcode_index.lookup(cursor, barcode, store_id)
+    if not product_info:
+        return None, ("ไม่พบสินค้าด้วยรหัสบาร์โค้ดนี้ในร้านค้าของคุณ!", 404)
+
+    item_store_id = product_info['store_id'] if product_info['store_id'] is not None else store_id
+    if item_store_id is None:
+        return None, ("ไม่สามารถระบุร้านค้าสำหรับรายการสั่งซื้อนี้ได้. โปรดติดต่อผู้ดูแลระบบ.", 409)
+
+    products_id = product_info['products_id']
+    if not StockService.reserve(cursor, products_id, quantity):
+        return None, (f"สินค้า {product_info['products_name']} มีสต็อกไม่พอ. มีในสต็อก: {StockService.current(cursor, products_id)} ชิ้น", 409)
+
+    cursor.execute("""
+        UPDATE tbl_order SET quantity = quantity + %s
+        WHERE products_id = %s AND order_id = %s AND email = %s AND store_id = %s
+    """, (quantity, products_id, order_id, email, item_store_id))
+    created = cursor.rowcount == 0
+    if created:
+        # ราคาอ่านจาก tbl_products ในคำสั่งเขียนเอง ไม่ใช้ราคาใน barcode_index ที่อาจค้างใน worker อื่น
+        cursor.execute("""
+            INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, store_id, price_per_unit)
+            SELECT %s, p.products_id, p.products_name, %s, 0, %s, %s, %s, p.price
+            FROM tbl_products p WHERE p.products_id = %s
+        """, (order_id, quantity, email, barcode, item_store_id, products_id))
+    stage_cart_line(item_store_id, order_id, products_id, product_info['products_name'], added=quantity)
+    return {'product': product_info, 'store_id': item_store_id, 'created': created}, None
+
+
+def apply_cart_scans(cursor, scans, order_id, email, store_id):
+    """
+    Batch version of apply_cart_scan(). `scans` is a list of (barcode, count).
+    Scans are grouped by product so each product costs one stock UPDATE and one
+    order-line write, all in one transaction and one commit. Existing lines are
+    updated with one executemany() UPDATE; new lines use INSERT ... SELECT (to take
+    the current price from tbl_products), which executemany() still sends as one
+    statement per line. Returns one result dict per input scan (in input order) and the set
+    of store ids that got new lines. Products that are unknown or short on stock
+    are reported and skipped; the rest is applied. The caller commits or rolls back.
+    """
+    results = []
+    groups = {}  # (products_id, item_store_id) -> {'product', 'barcode', 'quantity', 'results'}
+    for barcode, count in scans:
+        result = {'barcode': barcode, 'count': count, 'ok': False}
+        results.append(result)
+        product_info = barcode_index.lookup(cursor, barcode, store_id)
+        if not product_info:
+            result.update(error="ไม่พบสินค้าด้วยรหัสบาร์โค้ดนี้ในร้านค้าของคุณ!", status=404)
+            continue
+        item_store_id = product_info['store_id'] if product_info['store_id'] is not None else store_id
+        if item_store_id is None:
+            result.update(error="ไม่สามารถระบุร้านค้าสำหรับรายการสั่งซื้อนี้ได้. โปรดติดต่อผู้ดูแลระบบ.", status=409)
+            continue
+        group = groups.setdefault((product_info['products_id'], item_store_id),
+                                  {'product': product_info, 'barcode': barcode, 'quantity': 0, 'results': []})
+        group['quantity'] += count
+        group['results'].append(result)
+
+    if not groups:
+        return results, set()
+
+    # ตัดสต็อกครั้งเดียวต่อสินค้าด้วยจำนวนรวมของทุกการสแกน
+    reserved = {}
+    for key, group in groups.items():
+        products_id = key[0]
+        product_info = group['product']
+        if StockService.reserve(cursor, products_id, group['quantity']):
+            reserved[key] = group
+            for result in group['results']:
+                result.update(ok=True, products_id=str(products_id), products_name=product_info['products_name'],
+                              store_id=key[1])
+        else:
+            error = f"สินค้า {product_info['products_name']} มีสต็อกไม่พอ. มีในสต็อก: {StockService.current(cursor, products_id)} ชิ้น"
+            for result in group['results']:
+                result.update(error=error, status=409, products_id=str(products_id))
+
+    if not reserved:
+        return results, set()
+
+    placeholders = ', '.join(['%s'] * len(reserved))
+    cursor.execute(f"""
+        SELECT products_id, store_id FROM tbl_order
+        WHERE order_id = %s AND email = %s AND products_id IN ({placeholders})
+    """, (order_id, email, *[key[0] for key in reserved]))
+    # tbl_order.products_id เป็น varchar ส่วน products_id จาก barcode_index เป็น int เทียบกันเป็น str
+    existing = {(str(row['products_id']), row['store_id']) for row in cursor.fetchall()}
+
+    updates = []
+    inserts = []
+    for (products_id, item_store_id), group in reserved.items():
+        if (str(products_id), item_store_id) in existing:
+            updates.append((group['quantity'], products_id, order_id, email, item_store_id))
+        else:
+            inserts.append((order_id, group['quantity'], email, group['barcode'], item_store_id, products_id))
+    if updates:
+        cursor.executemany("""
+            UPDATE tbl_order SET quantity = quantity + %s
+            WHERE products_id = %s AND order_id = %s AND email = %s AND store_id = %s
+        """, updates)
+    if inserts:
+        # ราคาและชื่ออ่านจาก tbl_products ในคำสั่งเขียนเอง (ดู apply_cart_scan)
+        cursor.executemany("""
+            INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, store_id, price_per_unit)
+            SELECT %s, p.products_id, p.products_name, %s, 0, %s, %s, %s, p.price
+            FROM tbl_products p WHERE p.products_id = %s
+        """, inserts)
+    for (products_id, item_store_id), group in reserved.items():
+        stage_cart_line(item_store_id, order_id, products_id, group['product']['products_name'], added=group['quantity'])
+    return results, {row[4] for row in inserts}
+
+
+@route('kiosk', "/cart", methods=["GET", "POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member'])
 def cart():
     """ 
@@ -1922,11 +2245,11 @@ def cart():
     conn = None
     cursor = None
     orders_data = []
-    products_data = []
     users_data = []
     msg = ''
     pre_filled_products_id_input = ''
     current_auto_order_id = session.get('current_order_id') 
+    current_order_id = current_auto_order_id
     
     selected_product_details_display = 'จะแสดงที่นี่หลังจากระบุรหัสสินค้า'
     request_form_data = {}
@@ -1937,34 +2260,20 @@ def cart():
     try:
         conn = get_db_connection()
         if not conn:
+            if offline_journal:
+                return offline_cart(current_user_role, current_user_store_id)
             flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
-            return render_template("cart.html", orders=[], products_data_string='', users=[], search='',
+            return render_template("cart.html", orders=[], users=[], search='',
                                    current_auto_order_id='', selected_product_details_display='เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล',
                                    pre_filled_products_id_input='', session=session)
 
         cursor = conn.cursor(dictionary=True)
 
-        if not current_auto_order_id:
-            if current_user_store_id:
-                cursor.execute("SELECT MAX(CAST(order_id AS UNSIGNED)) AS max_order_id FROM tbl_order WHERE order_id REGEXP '^[0-9]+$' AND store_id = %s", (current_user_store_id,))
-            else: 
-                cursor.execute("SELECT MAX(CAST(order_id AS UNSIGNED)) AS max_order_id FROM tbl_order WHERE order_id REGEXP '^[0-9]+$'")
-            
-            result = cursor.fetchone()
-            current_order_id = str(int(result['max_order_id']) + 1) if result and result['max_order_id'] is not None else '100001'
+        if not current_order_id:
+            current_order_id = order_sequence.next_id(current_user_store_id)
             session['current_order_id'] = current_order_id
         
-        product_query_for_frontend = "SELECT products_id, products_name, stock_quantity as stock, price, barcode_id FROM tbl_products"
-        product_frontend_params = []
-        if current_user_store_id:
-            product_query_for_frontend += " WHERE store_id = %s OR store_id IS NULL" 
-            product_frontend_params.append(current_user_store_id)
-        product_query_for_frontend += " ORDER BY products_id"
-
-        cursor.execute(product_query_for_frontend, tuple(product_frontend_params))
-        products_data = cursor.fetchall()
-        products_data_parts = [f"{p['products_id']}|{str(p['products_name']).replace('|', ' ').replace('///', ' ')}|{p['stock']}|{p['price']}|{str(p.get('barcode_id') or '').replace('|', ' ').replace('///', ' ')}" for p in products_data]
-        products_data_string = "///".join(products_data_parts)
+        # รายการสินค้าไม่ถูกฝังในหน้าอีกต่อไป หน้า cart ดึงจาก /api/catalog และเก็บแคชไว้ฝั่ง browser
         
         if current_user_role in ['root_admin', 'administrator', 'moderator']:
             user_query_for_frontend = "SELECT email, CONCAT(firstname, ' ', lastname) as fullname FROM tbl_users"
@@ -1997,7 +2306,8 @@ def cart():
                 total_quantity = sum(item['quantity'] for item in orders_to_complete)
                 total_price = sum(item['quantity'] * item['price_per_unit'] for item in orders_to_complete) 
                 
-                receipt_barcode = ''.join(random.choices(string.digits, k=13)) 
+                # EAN-13 ที่มี check digit ถูกต้อง เพื่อให้สแกนจากใบเสร็จที่พิมพ์ได้
+                receipt_barcode = ean13.normalize(''.join(random.choices(string.digits, k=12)))
                 
                 session['receipt_data'] = {
                     'orders': orders_to_complete,
@@ -2007,6 +2317,12 @@ def cart():
                     'current_order_id': current_order_id
                 }
                 session.pop('current_order_id', None)
+
+                if print_spooler:
+                    try:
+                        print_spooler.submit(build_receipt(session['receipt_data']))
+                    except SpoolerFull:
+                        flash('เครื่องพิมพ์ใบเสร็จไม่ว่าง ไม่ได้พิมพ์ใบเสร็จ.', 'warning')
                 
                 flash('คำสั่งซื้อเสร็จสมบูรณ์แล้ว!', 'success')
                 return redirect(url_for('receipt_display'))
@@ -2023,21 +2339,6 @@ def cart():
                     flash("รหัสบาร์โค้ดไม่ถูกต้อง (ควรเป็นตัวเลข 13 หลัก)!", 'danger')
                     return redirect(url_for('cart'))
 
-                product_info_query = "SELECT products_id, products_name, stock_quantity, price FROM tbl_products WHERE barcode_id = %s"
-                product_info_params = [scanned_barcode_input]
-                if current_user_store_id:
-                    product_info_query += " AND (store_id = %s OR store_id IS NULL)" 
-                    product_info_params.append(current_user_store_id)
-
-                cursor.execute(product_info_query, tuple(product_info_params))
-                product_info = cursor.fetchone()
-                
-                if not product_info:
-                    flash("ไม่พบสินค้าด้วยรหัสบาร์โค้ดนี้ในร้านค้าของคุณ!", 'danger')
-                    return redirect(url_for('cart'))
-
-                order_id_to_use = session.get('current_order_id')
-
                 email = request.form.get('email')
                 if current_user_role == 'member':
                     email = session['email']
@@ -2045,48 +2346,22 @@ def cart():
                     flash("กรุณาระบุอีเมลลูกค้า.", 'danger')
                     return redirect(url_for('cart'))
 
-                quantity = 1 
-                disquantity = 0 
-
-                if quantity > product_info['stock_quantity']:
-                    flash(f"สินค้า {product_info['products_name']} มีสต็อกไม่พอ. มีในสต็อก: {product_info['stock_quantity']} ชิ้น", 'danger')
-                    return redirect(url_for('cart'))
-                
-                products_name_from_db = product_info['products_name']
-                products_id_to_use = product_info['products_id']
-                price_per_unit = product_info['price']
-                
-                item_store_id = product_info.get('store_id') if product_info.get('store_id') is not None else current_user_store_id
-                if item_store_id is None: 
-                    flash("ไม่สามารถระบุร้านค้าสำหรับรายการสั่งซื้อนี้ได้. โปรดติดต่อผู้ดูแลระบบ.", 'danger')
+                scan_result, scan_error = apply_cart_scan(cursor, scanned_barcode_input, session.get('current_order_id'), email, current_user_store_id)
+                if scan_error:
+                    conn.rollback()
+                    flash(scan_error[0], 'danger')
                     return redirect(url_for('cart'))
 
-
-                cursor.execute("""
-                    SELECT id, quantity FROM tbl_order 
-                    WHERE products_id = %s AND order_id = %s AND email = %s AND store_id = %s
-                """, (products_id_to_use, order_id_to_use, email, item_store_id))
-                existing_order_item = cursor.fetchone()
-
-                if existing_order_item:
-                    new_qty = existing_order_item['quantity'] + quantity
-                    if new_qty > product_info['stock_quantity']:
-                        flash(f"ไม่สามารถเพิ่มได้ สินค้า {products_name_from_db} มีสต็อกไม่พอสำหรับยอดรวม. มีในสต็อก: {product_info['stock_quantity']} ชิ้น", 'danger')
-                    else:
-                        cursor.execute("UPDATE tbl_order SET quantity = %s WHERE id = %s", (new_qty, existing_order_item['id']))
-                        cursor.execute("UPDATE tbl_products SET stock_quantity = stock_quantity - %s WHERE products_id = %s", (quantity, products_id_to_use))
-                        conn.commit()
-                        flash(f'เพิ่มจำนวนสินค้า {products_name_from_db} ในรายการสั่งซื้อ {order_id_to_use} สำเร็จ และอัปเดตสต็อกแล้ว!', 'success')
-                else:
-                    cursor.execute("""
-                        INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, store_id, price_per_unit)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """, (order_id_to_use, products_id_to_use, products_name_from_db, quantity, disquantity, email, scanned_barcode_input, item_store_id, price_per_unit))
-                    cursor.execute("UPDATE tbl_products SET stock_quantity = stock_quantity - %s WHERE products_id = %s", (quantity, products_id_to_use))
-                    conn.commit()
+                conn.commit()
+                live_events.commit()
+                product_info = scan_result['product']
+                if scan_result['created']:
+                    stats_cache.invalidate(scan_result['store_id'])
                     flash('เพิ่มคำสั่งซื้อสำเร็จและอัปเดตสต็อกสินค้าแล้ว!', 'success')
+                else:
+                    flash(f"เพิ่มจำนวนสินค้า {product_info['products_name']} ในรายการสั่งซื้อ {session.get('current_order_id')} สำเร็จ และอัปเดตสต็อกแล้ว!", 'success')
                 
-                selected_product_details_display = f"{product_info['products_name']} | สต็อก: {product_info['stock_quantity'] - quantity} | ราคา: {product_info['price']} บาท"
+                selected_product_details_display = f"{product_info['products_name']} | ราคา: {product_info['price']} บาท"
 
                 return redirect(url_for('cart', pre_filled_products_id_input=pre_filled_products_id_input, 
                                          selected_product_details_display=selected_product_details_display))
@@ -2127,7 +2402,6 @@ def cart():
 
     return render_template("cart.html",
                            orders=orders_data,
-                           products_data_string=products_data_string,
                            users=users_data,
                            search='',
                            msg=msg,
@@ -2137,8 +2411,342 @@ def cart():
                            pre_filled_products_id_input=pre_filled_products_id_input,
                            session=session)
 
+def cart_line_payload(cursor, order_id, products_id, email, store_id):
+    """Returns the JSON-ready cart line for a product plus the order totals and remaining stock."""
+    cursor.execute("""
+        SELECT o.id, o.order_id, o.products_id, o.products_name, o.quantity, o.disquantity,
+               o.barcode_id, o.email, o.order_date, o.price_per_unit, p.stock_quantity
+        FROM tbl_order o
+        JOIN tbl_products p ON o.products_id = p.products_id
+        WHERE o.products_id = %s AND o.order_id = %s AND o.email = %s AND o.store_id = %s
+    """, (products_id, order_id, email, store_id))
+    line = cursor.fetchone()
+    cursor.execute("""
+        SELECT COUNT(*) AS lines, COALESCE(SUM(quantity), 0) AS total_quantity,
+               COALESCE(SUM(quantity * price_per_unit), 0) AS total_price
+        FROM tbl_order
+        WHERE order_id = %s AND email = %s AND store_id = %s
+    """, (order_id, email, store_id))
+    totals = cursor.fetchone()
+    item = None
+    if line:
+        item = {
+            'id': line['id'],
+            'order_id': line['order_id'],
+            'products_id': str(line['products_id']),
+            'products_name': line['products_name'],
+            'price': str(line['price_per_unit']) if line['price_per_unit'] is not None else None,
+            'line_total': str(line['price_per_unit'] * line['quantity']) if line['price_per_unit'] is not None else None,
+            'quantity': line['quantity'],
+            'disquantity': line['disquantity'],
+            'barcode_id': line['barcode_id'],
+            'email': line['email'],
+            'order_date': line['order_date'].strftime('%Y-%m-%d %H:%M') if line['order_date'] else '',
+        }
+    return {
+        'item': item,
+        'stock': line['stock_quantity'] if line else None,
+        'totals': {
+            'lines': totals['lines'],
+            'quantity': int(totals['total_quantity']),
+            'price': str(totals['total_price']),
+        },
+    }
+
+
+@route('kiosk', "/api/cart/scan", methods=["POST"])
+@role_required(['root_admin', 'administrator', 'moderator', 'member'])
+def api_cart_scan():
+    """
+    Adds one scanned barcode to the current order and returns only the changed
+    line, the order totals and the remaining stock, so the cart page can update
+    in place instead of reloading.
+    Accepts JSON or form data with `barcode` and (for staff) `email`.
+    """
+    data = request.get_json(silent=True) or request.form
+    barcode = str(data.get('barcode') or '').strip()
+    if not barcode.isdigit() or len(barcode) != 13:
+        return jsonify({'ok': False, 'error': "รหัสบาร์โค้ดไม่ถูกต้อง (ควรเป็นตัวเลข 13 หลัก)!"}), 400
+
+    email = session['email'] if session.get('role') == 'member' else data.get('email')
+    if not email:
+        return jsonify({'ok': False, 'error': "กรุณาระบุอีเมลลูกค้า."}), 400
+
+    store_id = session.get('store_id')
+    conn = None
+    cursor = None
+    response = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            if offline_journal:
+                product, error = offline_cart_scan(barcode, email, store_id)
+                if error:
+                    return jsonify({'ok': False, 'error': error}), 409
+                return jsonify({'ok': True, 'offline': True, 'order_id': session['current_order_id'],
+                                'products_id': product['products_id'], 'products_name': product['products_name'],
+                                'stock': product['stock']}), 202
+            return jsonify({'ok': False, 'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+
+        order_id = session.get('current_order_id')
+        if not order_id:
+            order_id = order_sequence.next_id(store_id)
+            session['current_order_id'] = order_id
+
+        cursor = conn.cursor(dictionary=True)
+        scan_result, scan_error = apply_cart_scan(cursor, barcode, order_id, email, store_id)
+        if scan_error:
+            conn.rollback()
+            return jsonify({'ok': False, 'error': scan_error[0]}), scan_error[1]
+        conn.commit()
+        response = {'ok': True, 'created': scan_result['created'], 'order_id': order_id}
+        live_events.commit()
+        if scan_result['created']:
+            stats_cache.invalidate(scan_result['store_id'])
+
+        response.update(cart_line_payload(cursor, order_id, scan_result['product']['products_id'], email, scan_result['store_id']))
+        return jsonify(response)
+    except mysql.connector.Error as err:
+        print(f"Error in api_cart_scan: {err}")
+        if response is not None:
+            # สแกนถูก commit แล้ว อ่านผลลัพธ์ไม่สำเร็จอย่างเดียว: ห้ามตอบว่าล้มเหลว (ตู้จะสแกนซ้ำ) ให้โหลดหน้าใหม่แทน
+            response.update({'item': None, 'reload': True})
+            return jsonify(response)
+        if conn: conn.rollback()
+        return jsonify({'ok': False, 'error': f"เกิดข้อผิดพลาดในฐานข้อมูล: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@route('kiosk', "/api/cart/scan/batch", methods=["POST"])
+@role_required(['root_admin', 'administrator', 'moderator', 'member'])
+def api_cart_scan_batch():
+    """
+    Applies a buffered list of scans to the current order in one transaction.
+    Body: {"email": ..., "scans": [{"barcode": "...", "count": 2}, ...]}
+    (a plain barcode string counts as 1). Returns a result per scan, the
+    resulting quantity and stock per product, and the order totals.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('scans'), list):
+        return jsonify({'ok': False, 'error': 'ต้องส่งข้อมูล JSON ที่มีรายการ scans'}), 400
+    if not data['scans'] or len(data['scans']) > CART_SCAN_BATCH_MAX:
+        return jsonify({'ok': False, 'error': f'จำนวนรายการต้องอยู่ระหว่าง 1 ถึง {CART_SCAN_BATCH_MAX}'}), 400
+
+    scans = []
+    for entry in data['scans']:
+        if isinstance(entry, dict):
+            barcode, count = str(entry.get('barcode') or '').strip(), entry.get('count', 1)
+        else:
+            barcode, count = str(entry).strip(), 1
+        if not barcode.isdigit() or len(barcode) != 13 or not isinstance(count, int) or count < 1:
+            return jsonify({'ok': False, 'error': f'รายการไม่ถูกต้อง: {entry}'}), 400
+        scans.append((barcode, count))
+
+    email = session['email'] if session.get('role') == 'member' else data.get('email')
+    if not email:
+        return jsonify({'ok': False, 'error': "กรุณาระบุอีเมลลูกค้า."}), 400
+
+    store_id = session.get('store_id')
+    conn = None
+    cursor = None
+    response = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'ok': False, 'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+
+        order_id = session.get('current_order_id')
+        if not order_id:
+            order_id = order_sequence.next_id(store_id)
+            session['current_order_id'] = order_id
+
+        cursor = conn.cursor(dictionary=True)
+        results, new_line_stores = apply_cart_scans(cursor, scans, order_id, email, store_id)
+        conn.commit()
+        response = {'ok': all(r['ok'] for r in results), 'order_id': order_id, 'results': results}
+        live_events.commit()
+        if new_line_stores:
+            stats_cache.invalidate(*new_line_stores)
+
+        products = {}
+        applied_ids = sorted({r['products_id'] for r in results if r['ok']})
+        if applied_ids:
+            placeholders = ', '.join(['%s'] * len(applied_ids))
+            cursor.execute(f"""
+                SELECT o.products_id, o.quantity, p.stock_quantity
+                FROM tbl_order o
+                JOIN tbl_products p ON o.products_id = p.products_id
+                WHERE o.order_id = %s AND o.email = %s AND o.products_id IN ({placeholders})
+            """, (order_id, email, *applied_ids))
+            for row in cursor.fetchall():
+                products[str(row['products_id'])] = {'quantity': row['quantity'], 'stock': row['stock_quantity']}
+
+        # เหมือน cart_line_payload: รวมเฉพาะรายการของร้านที่รายการถูกบันทึก
+        line_stores = sorted({r['store_id'] for r in results if r['ok']} or {store_id})
+        cursor.execute(f"""
+            SELECT COUNT(*) AS lines, COALESCE(SUM(quantity), 0) AS total_quantity,
+                   COALESCE(SUM(quantity * price_per_unit), 0) AS total_price
+            FROM tbl_order
+            WHERE order_id = %s AND email = %s AND store_id IN ({', '.join(['%s'] * len(line_stores))})
+        """, (order_id, email, *line_stores))
+        totals = cursor.fetchone()
+        response.update({
+            'products': products,
+            'totals': {
+                'lines': totals['lines'],
+                'quantity': int(totals['total_quantity']),
+                'price': str(totals['total_price']),
+            },
+        })
+        return jsonify(response)
+    except mysql.connector.Error as err:
+        print(f"Error in api_cart_scan_batch: {err}")
+        if response is not None:
+            # รายการถูก commit แล้ว ห้ามตอบว่าล้มเหลวเพราะผู้เรียกจะส่งชุดเดิมซ้ำ
+            response['reload'] = True
+            return jsonify(response)
+        if conn: conn.rollback()
+        return jsonify({'ok': False, 'error': f"เกิดข้อผิดพลาดในฐานข้อมูล: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+# --- Scan log verification API ---
+SCAN_LOG_MAX_BYTES = int(os.environ.get('SCAN_LOG_MAX_MB', '64')) * 1024 * 1024
+
+@route('admin', "/api/barcodes/verify", methods=["POST"])
+@role_required(['root_admin', 'administrator'])
+def api_barcodes_verify():
+    """
+    Checks a kiosk scan log and reports which barcodes map to products.
+    Scanned values are matched against tbl_products.barcode_id first; the
+    rest are decoded as legacy encode(products_id) labels.
+    Accepts an uploaded `scan_log` file (one scan per line, the first 13-digit
+    value on a line is the barcode) or JSON {"barcodes": [...]}. Products are
+    limited to the user's store, or `store_id` for unbound users.
+    """
+    upload = request.files.get('scan_log')
+    if upload:
+        content = upload.read(SCAN_LOG_MAX_BYTES + 1)
+        if len(content) > SCAN_LOG_MAX_BYTES:
+            return jsonify({'ok': False, 'error': 'ไฟล์ log มีขนาดใหญ่เกินไป'}), 413
+        lines = content.splitlines()
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('barcodes'), list):
+            return jsonify({'ok': False, 'error': 'ต้องส่งไฟล์ scan_log หรือ JSON ที่มีรายการ barcodes'}), 400
+        # บาร์โค้ดที่ส่งเป็นตัวเลข JSON เสียเลข 0 นำหน้า เติมกลับให้ครบ 13 หลัก
+        lines = [str(barcode).zfill(13) if isinstance(barcode, int) and not isinstance(barcode, bool) else str(barcode)
+                 for barcode in data['barcodes']]
+
+    store_id = session.get('store_id') or request.args.get('store_id', type=int)
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'ok': False, 'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+
+        cursor = conn.cursor(dictionary=True)
+        store_filter = " AND (store_id = %s OR store_id IS NULL)" if store_id else ""  # สินค้ากลางใช้ได้ทุกร้าน เหมือนตอนสแกน
+
+        # ป้ายปัจจุบันพิมพ์ barcode_id ของสินค้า (เหมือนที่หน้า cart ค้นหา) จับคู่ค่าที่สแกนกับ barcode_id ก่อน
+        scanned = sorted({barcode for _, barcode in barcode_codec.barcodes_in_log(lines) if barcode})
+        barcode_products = {}
+        products = {}
+        for i in range(0, len(scanned), 1000):
+            chunk = scanned[i:i + 1000]
+            query = (f"SELECT products_id, products_name, barcode_id FROM tbl_products "
+                     f"WHERE barcode_id IN ({', '.join(['%s'] * len(chunk))}){store_filter} ORDER BY store_id IS NULL DESC")
+            cursor.execute(query, [*chunk, store_id] if store_id else chunk)
+            for row in cursor.fetchall():
+                # สินค้าของร้านมาทีหลังสินค้ากลางที่ barcode ซ้ำกัน จึงถูกเลือก
+                barcode_products[row['barcode_id']] = int(row['products_id'])
+                products[int(row['products_id'])] = row['products_name']
+
+        # ค่าที่ไม่ตรง barcode_id: ถอดรหัสเป็นป้ายเก่าแบบ encode(products_id) แล้วตรวจว่ามีสินค้านั้นจริง
+        legacy = [barcode for barcode in scanned if barcode not in barcode_products]
+        candidate_ids = sorted({product_id for _, product_id in barcode_codec.verify_many(legacy)
+                                if product_id is not None and product_id not in products})
+        known_ids = set(products)
+        for i in range(0, len(candidate_ids), 1000):
+            chunk = candidate_ids[i:i + 1000]
+            query = f"SELECT products_id, products_name FROM tbl_products WHERE products_id IN ({', '.join(['%s'] * len(chunk))}){store_filter}"
+            cursor.execute(query, [*chunk, store_id] if store_id else chunk)
+            for row in cursor.fetchall():
+                products[int(row['products_id'])] = row['products_name']
+                known_ids.add(int(row['products_id']))
+
+        started = time.perf_counter()
+        report = barcode_codec.verify_log(lines, known_ids=known_ids, barcode_products=barcode_products)
+        decode_seconds = time.perf_counter() - started
+
+        return jsonify({
+            'ok': not report['unknown'] and not report['malformed_lines'],
+            'lines': report['lines'],
+            'valid': report['valid'],
+            'products': [
+                {'products_id': product_id, 'products_name': products[product_id], 'scans': count}
+                for product_id, count in sorted(report['products'].items())
+            ],
+            'unknown': report['unknown'],
+            'malformed_lines': report['malformed_lines'],
+            'decode_seconds': round(decode_seconds, 6),
+            'lines_per_second': round(report['lines'] / decode_seconds) if decode_seconds else None,
+        })
+    except mysql.connector.Error as err:
+        print(f"Error in api_barcodes_verify: {err}")
+        return jsonify({'ok': False, 'error': f"เกิดข้อผิดพลาดในฐานข้อมูล: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+# --- Product catalog API (ใช้โดยหน้า cart) ---
+@route('kiosk', "/api/catalog")
+@role_required(['root_admin', 'administrator', 'moderator', 'member'])
+def api_catalog():
+    """
+    Returns the store's product catalog as JSON.
+    `since=<version>` returns only products changed after that version plus
+    deleted ids. Responds 304 when If-None-Match carries the current version.
+    """
+    store_id = session.get('store_id')
+    since = request.args.get('since', type=int)
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+
+        cursor = conn.cursor(dictionary=True)
+        version = ProductCatalog.version(cursor, store_id)
+        etag = ProductCatalog.etag(store_id, version)
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = jsonify(ProductCatalog.snapshot(cursor, store_id, since=since, version=version))
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    except mysql.connector.Error as err:
+        print(f"Error in api_catalog: {err}")
+        return jsonify({'error': f"เกิดข้อผิดพลาดในฐานข้อมูล: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
 # --- New route to display the PNG receipt ---
-@app.route("/receipt_display")
+@route('kiosk', "/receipt_display")
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
 def receipt_display():
     """
@@ -2160,7 +2768,7 @@ def receipt_display():
 
 # --- Routes สำหรับแก้ไขและลบรายการในตะกร้า (ย้ายมาอยู่นอกฟังก์ชัน cart()) ---
 # แก้ไขรายการในตะกร้า
-@app.route("/cart/edit/<int:item_id>", methods=["POST"])
+@route('kiosk', "/cart/edit/<int:item_id>", methods=["POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member'])
 def edit_cart_item(item_id):
     conn_edit = None
@@ -2206,7 +2814,6 @@ def edit_cart_item(item_id):
             flash(f"ไม่พบสินค้า ID {products_id_from_form} หรือสินค้าไม่ได้อยู่ในร้านค้าของคุณสำหรับแก้ไข.", 'danger')
             return redirect(url_for('cart'))
 
-        current_stock_in_db = product_info['stock_quantity']
         category_id_for_bin_update = product_info['category_id']
 
         current_order_item_query = "SELECT quantity, disquantity, email, store_id FROM tbl_order WHERE id = %s AND order_id = %s AND products_id = %s"
@@ -2244,8 +2851,9 @@ def edit_cart_item(item_id):
 
         stock_to_restore = current_order_qty - new_quantity 
         
-        if current_stock_in_db + stock_to_restore < 0:
-            flash(f"ไม่สามารถแก้ไขได้: สินค้า {product_info['products_name']} มีสต็อกไม่พอ. สต็อกปัจจุบัน: {current_stock_in_db}, ต้องการปรับ: {stock_to_restore}.", 'danger')
+        if not StockService.adjust(cursor_edit, products_id_from_form, stock_to_restore):
+            flash(f"ไม่สามารถแก้ไขได้: สินค้า {product_info['products_name']} มีสต็อกไม่พอ. สต็อกปัจจุบัน: {StockService.current(cursor_edit, products_id_from_form)}, ต้องการปรับ: {stock_to_restore}.", 'danger')
+            conn_edit.rollback()
             return redirect(url_for('cart'))
 
         cursor_edit.execute("""
@@ -2254,22 +2862,11 @@ def edit_cart_item(item_id):
             WHERE id = %s AND order_id = %s AND products_id = %s AND email = %s AND store_id = %s
         """, (new_quantity, new_disquantity, item_id, order_id_from_form, products_id_from_form, current_user_email, current_user_store_id)) 
 
-        cursor_edit.execute("UPDATE tbl_products SET stock_quantity = stock_quantity + %s WHERE products_id = %s", (stock_to_restore, products_id_from_form))
-
-        if new_disquantity > 0:
-            cursor_edit.execute("UPDATE tbl_bin SET value = 1 WHERE category_id = %s AND store_id = %s", (category_id_for_bin_update, order_item_store_id))
-        elif new_disquantity == 0 and current_order_disqty > 0: 
-            cursor_edit.execute("""
-                SELECT COUNT(*) FROM tbl_order o 
-                JOIN tbl_products p ON o.products_id = p.products_id 
-                WHERE p.category_id = %s AND o.disquantity > 0 AND o.store_id = %s AND o.id != %s
-            """, (category_id_for_bin_update, order_item_store_id, item_id))
-            remaining_disposed_in_category_in_store = cursor_edit.fetchone()[0]
-            if remaining_disposed_in_category_in_store == 0:
-                cursor_edit.execute("UPDATE tbl_bin SET value = 0 WHERE category_id = %s AND store_id = %s", (category_id_for_bin_update, order_item_store_id))
-
+        apply_bin_counter(cursor_edit, order_item_store_id, category_id_for_bin_update, new_disquantity - current_order_disqty)
+        stage_cart_line(order_item_store_id, order_id_from_form, products_id_from_form, product_info['products_name'], quantity=new_quantity)
 
         conn_edit.commit()
+        live_events.commit()
         flash(f'แก้ไขรายการ ID {item_id} ในคำสั่งซื้อ {order_id_from_form} สำเร็จแล้ว!', 'success')
 
     except ValueError:
@@ -2290,7 +2887,7 @@ def edit_cart_item(item_id):
     return redirect(url_for('cart'))
 
 # ลบรายการในตะกร้า
-@app.route("/cart/delete/<int:item_id>", methods=["POST"])
+@route('kiosk', "/cart/delete/<int:item_id>", methods=["POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member'])
 def delete_cart_item(item_id):
     conn_del = None
@@ -2306,7 +2903,7 @@ def delete_cart_item(item_id):
 
         cursor_del = conn_del.cursor(dictionary=True)
         item_to_delete_query = """
-            SELECT o.id, o.products_id, o.quantity, o.disquantity, o.order_id, p.category_id, o.store_id, o.email
+            SELECT o.id, o.products_id, o.products_name, o.quantity, o.disquantity, o.order_id, p.category_id, o.store_id, o.email
             FROM tbl_order o
             JOIN tbl_products p ON o.products_id = p.products_id
             WHERE o.id = %s AND o.email = %s AND o.store_id = %s
@@ -2323,21 +2920,16 @@ def delete_cart_item(item_id):
         category_id_of_deleted_item = item_to_delete['category_id']
         order_store_id = item_to_delete['store_id']
 
-        cursor_del.execute("UPDATE tbl_products SET stock_quantity = stock_quantity + %s WHERE products_id = %s",
-                           (quantity_to_return, product_id))
+        StockService.release(cursor_del, product_id, quantity_to_return)
         
         cursor_del.execute("DELETE FROM tbl_order WHERE id = %s", (item_id,))
         
-        cursor_del.execute("""
-            SELECT COUNT(*) FROM tbl_order o 
-            JOIN tbl_products p ON o.products_id = p.products_id 
-            WHERE p.category_id = %s AND o.disquantity > 0 AND o.store_id = %s
-        """, (category_id_of_deleted_item, order_store_id))
-        remaining_disposed_in_category_in_store = cursor_del.fetchone()[0]
-        if remaining_disposed_in_category_in_store == 0:
-            cursor_del.execute("UPDATE tbl_bin SET value = 0 WHERE category_id = %s AND store_id = %s", (category_id_of_deleted_item, order_store_id))
+        apply_bin_counter(cursor_del, order_store_id, category_id_of_deleted_item, -item_to_delete['disquantity'])
+        stage_cart_line(order_store_id, item_to_delete['order_id'], product_id, item_to_delete['products_name'], quantity=0)
             
         conn_del.commit()
+        live_events.commit()
+        stats_cache.invalidate(order_store_id)
         flash(f'ลบรายการ ID {item_id} ออกจากคำสั่งซื้อ {item_to_delete["order_id"]} สำเร็จแล้ว! สต็อกสินค้าได้รับการคืนแล้ว.', 'success')
 
     except mysql.connector.Error as err:
@@ -2356,8 +2948,116 @@ def delete_cart_item(item_id):
     return redirect(url_for('cart'))
 
 
+# --- Package returns ---
+def enqueue_payout(cursor, store_id, order_line_id, email, packages):
+    """PayoutLedger.enqueue() that also stages a pending 'payout' live event."""
+    payout_id = PayoutLedger.enqueue(cursor, store_id, order_line_id, email, packages)
+    if payout_id is not None:
+        live_events.stage(store_id, 'payout', {'payout_id': payout_id, 'order_line_id': order_line_id, 'status': 'pending',
+                                               'coins': packages * COINS_PER_PACKAGE, 'coins_paid': 0, 'error': None})
+    return payout_id
+
+def apply_bin_return(cursor, barcode_id, products_id, store_id, email=None):
+    """
+    Records one returned package against the order line with `barcode_id` and
+    `products_id` in the store: disquantity + 1, the bin counters and, when the
+    coin dispenser is enabled, a payout. `email` limits the match to a member's
+    own orders. Returns (order_line, None) or (None, message). The caller
+    commits or rolls back.
+    """
+    query = """
+        SELECT o.id, o.quantity, o.disquantity, o.products_name, o.products_id, p.stock_quantity as stock, p.category_id, o.email, o.store_id
+        FROM tbl_order o
+        JOIN tbl_products p ON o.products_id = p.products_id
+        WHERE o.barcode_id = %s AND o.products_id = %s AND o.store_id = %s
+    """
+    params = [barcode_id, products_id, store_id]
+    if email:
+        query += " AND o.email = %s"
+        params.append(email)
+    cursor.execute(query, tuple(params))
+    item = cursor.fetchone()
+    if not item:
+        return None, "ไม่พบรายการสินค้าที่ตรงกันสำหรับรหัสบาร์โค้ดและรหัสสินค้าที่ระบุในร้านค้าของคุณ."
+    if item['category_id'] is None:
+        return None, f"ไม่พบ category_id สำหรับสินค้า '{item['products_name']}'. ไม่สามารถอัปเดต bin ได้."
+    if item['disquantity'] + 1 > item['quantity']:
+        return None, f"ไม่สามารถเพิ่มจำนวนทิ้งได้เกินจำนวนสินค้าที่สั่งซื้อ ({item['quantity']} ชิ้น) สำหรับสินค้า '{item['products_name']}'"
+
+    cursor.execute("UPDATE tbl_order SET disquantity = %s WHERE id = %s", (item['disquantity'] + 1, item['id']))
+    apply_bin_counter(cursor, item['store_id'], item['category_id'], 1)
+    if dispense_worker:
+        enqueue_payout(cursor, item['store_id'], item['id'], item['email'], 1)
+    return item, None
+
+
+# --- Offline kiosk mode ---
+# เมื่อเชื่อมต่อฐานข้อมูลไม่ได้ การสแกนใน cart และการคืนใน bin ถูกบันทึกลง journal ในเครื่อง (OFFLINE_JOURNAL ว่าง = ปิด)
+def sync_cart_scan(cursor, payload):
+    """Journal handler: replays an offline cart scan. Returns an error message for a conflict."""
+    scan_result, scan_error = apply_cart_scan(cursor, payload['barcode'], payload['order_id'], payload['email'],
+                                              payload['store_id'], payload['quantity'])
+    return scan_error[0] if scan_error else None
+
+def sync_bin_return(cursor, payload):
+    """Journal handler: replays an offline package return. Returns an error message for a conflict."""
+    returned_item, return_error = apply_bin_return(cursor, payload['barcode_id'], payload['products_id'],
+                                                   payload['store_id'], payload.get('email'))
+    return return_error
+
+def after_offline_sync(outcomes):
+    live_events.commit()
+    if any(status == 'synced' for _, status, _ in outcomes):
+        stats_cache.invalidate()
+        if dispense_worker:
+            dispense_worker.notify()
+
+offline_journal = create_offline_journal()
+offline_syncer = None  # เริ่มโดย start_kiosk_services()
+
+def offline_cart_scan(barcode, email, store_id):
+    """Journals a cart scan while the database is unreachable. Returns (product, None) or (None, message)."""
+    order_id = session.get('current_order_id')
+    if not order_id:
+        order_id = offline_journal.provisional_order_id()
+        session['current_order_id'] = order_id
+    try:
+        product = offline_journal.record_cart_scan(barcode, order_id, email, store_id)
+    except OfflineRejected as e:
+        return None, str(e)
+    offline_syncer.notify()
+    return product, None
+
+def offline_cart(current_user_role, current_user_store_id):
+    """cart() while the database is unreachable: scans go to the offline journal, the order list is not shown."""
+    if request.method == "POST" and 'products_id_input' in request.form:
+        if current_user_role not in ['root_admin', 'administrator', 'moderator', 'member']:
+            flash("คุณไม่มีสิทธิ์เพิ่มคำสั่งซื้อ", 'danger')
+            return redirect(url_for('cart'))
+        barcode = request.form.get('products_id_input', '').strip()
+        if not barcode.isdigit() or len(barcode) != 13:
+            flash("รหัสบาร์โค้ดไม่ถูกต้อง (ควรเป็นตัวเลข 13 หลัก)!", 'danger')
+            return redirect(url_for('cart'))
+        email = session['email'] if current_user_role == 'member' else request.form.get('email')
+        if not email:
+            flash("กรุณาระบุอีเมลลูกค้า.", 'danger')
+            return redirect(url_for('cart'))
+        product, error = offline_cart_scan(barcode, email, current_user_store_id)
+        if error:
+            flash(error, 'danger')
+        else:
+            flash(f"บันทึก {product['products_name']} แบบออฟไลน์แล้ว จะส่งเข้าระบบเมื่อเชื่อมต่อได้.", 'warning')
+        return redirect(url_for('cart'))
+
+    flash("โหมดออฟไลน์: เชื่อมต่อฐานข้อมูลไม่ได้ การสแกนจะถูกบันทึกในตู้และส่งเข้าระบบภายหลัง.", 'warning')
+    return render_template("cart.html", orders=[], users=[], search='',
+                           current_auto_order_id=session.get('current_order_id', ''),
+                           selected_product_details_display='โหมดออฟไลน์',
+                           pre_filled_products_id_input='', session=session)
+
+
 # --- Route to manage package returns (bin) ---
-@app.route("/bin", methods=["GET", "POST"])
+@route('kiosk', "/bin", methods=["GET", "POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
 def bin():
     conn = None
@@ -2372,6 +3072,15 @@ def bin():
     try:
         conn = get_db_connection()
         if not conn:
+            if offline_journal and request.method == "POST" and request.form.get('action') == 'add_disquantity':
+                barcode_id_to_search = request.form.get('barcode_id_for_disquantity')
+                products_id_to_disquantity = request.form.get('products_id_to_disquantity')
+                if barcode_id_to_search and products_id_to_disquantity:
+                    offline_journal.record_bin_return(barcode_id_to_search, products_id_to_disquantity, current_user_store_id,
+                                                      session['email'] if current_user_role == 'member' else None)
+                    offline_syncer.notify()
+                    flash("บันทึกการคืนบรรจุภัณฑ์แบบออฟไลน์แล้ว จะตรวจสอบและจ่ายเหรียญเมื่อเชื่อมต่อได้.", 'warning')
+                    return redirect(url_for('bin', barcode_id_filter=barcode_id_to_search))
             flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
             return render_template("bin.html", orders=[], barcode_id_filter='', request_form_data={}, session=session)
 
@@ -2392,45 +3101,18 @@ def bin():
                 flash("กรุณาระบุรหัสบาร์โค้ดและรหัสสินค้าที่ต้องการเพิ่มจำนวนทิ้ง.", 'danger')
                 return redirect(url_for('bin', barcode_id_filter=barcode_id_filter))
 
-            base_query_item = """
-                SELECT o.id, o.quantity, o.disquantity, o.products_name, o.products_id, p.stock_quantity as stock, p.category_id, o.email, o.store_id
-                FROM tbl_order o
-                JOIN tbl_products p ON o.products_id = p.products_id
-                WHERE o.barcode_id = %s AND o.products_id = %s AND o.store_id = %s
-            """
-            query_params_item = [barcode_id_to_search, products_id_to_disquantity, current_user_store_id]
-
-            if current_user_role == 'member':
-                base_query_item += " AND o.email = %s"
-                query_params_item.append(session['email'])
-            
-            cursor.execute(base_query_item, tuple(query_params_item))
-            order_item_to_update = cursor.fetchone()
-
-            if order_item_to_update:
-                current_quantity = order_item_to_update['quantity']
-                current_disquantity = order_item_to_update['disquantity']
-                category_id_for_bin = order_item_to_update.get('category_id')
-                item_store_id = order_item_to_update['store_id']
-
-                if category_id_for_bin is None:
-                    flash(f"ไม่พบ category_id สำหรับสินค้า '{order_item_to_update['products_name']}'. ไม่สามารถอัปเดต bin ได้.", 'danger')
-                    return redirect(url_for('bin', barcode_id_filter=barcode_id_filter))
-
-                proposed_disquantity = current_disquantity + 1
-
-                if proposed_disquantity <= current_quantity:
-                    cursor.execute("UPDATE tbl_order SET disquantity = %s WHERE id = %s",
-                                   (proposed_disquantity, order_item_to_update['id']))
-
-                    cursor.execute("UPDATE tbl_bin SET value = 1 WHERE category_id = %s AND store_id = %s", (category_id_for_bin, item_store_id))
-
-                    conn.commit()
-                    flash(f"เพิ่มจำนวนทิ้งสินค้า '{order_item_to_update['products_name']}' (รหัสสินค้า: {products_id_to_disquantity}) สำเร็จ. สถานะ bin (category_id: {category_id_for_bin}, store_id: {item_store_id}) ได้รับการอัปเดตแล้ว.", 'success')
-                else:
-                    flash(f"ไม่สามารถเพิ่มจำนวนทิ้งได้เกินจำนวนสินค้าที่สั่งซื้อ ({current_quantity} ชิ้น) สำหรับสินค้า '{order_item_to_update['products_name']}'", 'danger')
+            member_email = session['email'] if current_user_role == 'member' else None
+            returned_item, return_error = apply_bin_return(cursor, barcode_id_to_search, products_id_to_disquantity,
+                                                           current_user_store_id, member_email)
+            if return_error:
+                conn.rollback()
+                flash(return_error, 'danger')
             else:
-                flash("ไม่พบรายการสินค้าที่ตรงกันสำหรับรหัสบาร์โค้ดและรหัสสินค้าที่ระบุในร้านค้าของคุณ.", 'danger')
+                conn.commit()
+                live_events.commit()
+                if dispense_worker:
+                    dispense_worker.notify()
+                flash(f"เพิ่มจำนวนทิ้งสินค้า '{returned_item['products_name']}' (รหัสสินค้า: {products_id_to_disquantity}) สำเร็จ. สถานะ bin (category_id: {returned_item['category_id']}, store_id: {returned_item['store_id']}) ได้รับการอัปเดตแล้ว.", 'success')
             return redirect(url_for('bin', barcode_id_filter=barcode_id_filter))
 
         base_query = """
@@ -2476,7 +3158,7 @@ def bin():
 
 # --- Routes สำหรับแก้ไขและลบรายการในระบบคืนบรรจุภัณฑ์ ---
 
-@app.route("/bin/edit/<int:item_id>", methods=["POST"])
+@route('kiosk', "/bin/edit/<int:item_id>", methods=["POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member'])
 def edit_bin_item(item_id):
     conn_edit = None
@@ -2535,7 +3217,6 @@ def edit_bin_item(item_id):
             flash(f"ไม่พบข้อมูลสินค้า ID {products_id_from_form} ในร้านค้าของคุณ.", 'danger')
             return redirect(url_for('bin', barcode_id_filter=barcode_id_for_redirect))
 
-        current_stock = product_info['stock_quantity']
         category_id_for_bin_update = product_info['category_id']
 
         if new_quantity <= 0:
@@ -2552,8 +3233,9 @@ def edit_bin_item(item_id):
 
         stock_change = (old_quantity - new_quantity) + (new_disquantity - old_disquantity)
         
-        if current_stock + stock_change < 0:
-            flash(f"ไม่สามารถแก้ไขได้: สินค้า '{product_info['products_name']}' มีสต็อกไม่พอสำหรับการเปลี่ยนแปลงนี้ (สต็อกปัจจุบัน: {current_stock}, ต้องการปรับ: {stock_change}).", 'danger')
+        if not StockService.adjust(cursor_edit, products_id_from_form, stock_change):
+            flash(f"ไม่สามารถแก้ไขได้: สินค้า '{product_info['products_name']}' มีสต็อกไม่พอสำหรับการเปลี่ยนแปลงนี้ (สต็อกปัจจุบัน: {StockService.current(cursor_edit, products_id_from_form)}, ต้องการปรับ: {stock_change}).", 'danger')
+            conn_edit.rollback()
             return redirect(url_for('bin', barcode_id_filter=barcode_id_for_redirect))
 
         cursor_edit.execute("""
@@ -2562,22 +3244,16 @@ def edit_bin_item(item_id):
             WHERE id = %s AND order_id = %s AND products_id = %s AND email = %s AND store_id = %s
         """, (new_quantity, new_disquantity, item_id, order_id_from_form, products_id_from_form, current_user_email, current_user_store_id))
 
-        cursor_edit.execute("UPDATE tbl_products SET stock_quantity = stock_quantity + %s WHERE products_id = %s",
-                            (stock_change, products_id_from_form))
-
-        if new_disquantity > 0:
-            cursor_edit.execute("UPDATE tbl_bin SET value = 1 WHERE category_id = %s AND store_id = %s", (category_id_for_bin_update, order_item_store_id))
-        elif new_disquantity == 0 and current_order_disqty > 0: 
-            cursor_edit.execute("""
-                SELECT COUNT(*) FROM tbl_order o 
-                JOIN tbl_products p ON o.products_id = p.products_id 
-                WHERE p.category_id = %s AND o.disquantity > 0 AND o.store_id = %s AND o.id != %s
-            """, (category_id_for_bin_update, order_item_store_id, item_id))
-            remaining_disposed_in_category_in_store = cursor_edit.fetchone()[0]
-            if remaining_disposed_in_category_in_store == 0:
-                cursor_edit.execute("UPDATE tbl_bin SET value = 0 WHERE category_id = %s AND store_id = %s", (category_id_for_bin_update, order_item_store_id))
+        apply_bin_counter(cursor_edit, order_item_store_id, category_id_for_bin_update, new_disquantity - old_disquantity)
+        # จ่ายเหรียญเฉพาะส่วนที่เพิ่มขึ้น การลด disquantity ไม่เรียกเหรียญคืน
+        payout_packages = new_disquantity - old_disquantity
+        if dispense_worker and payout_packages > 0:
+            enqueue_payout(cursor_edit, order_item_store_id, item_id, old_order_item['email'], payout_packages)
 
         conn_edit.commit()
+        live_events.commit()
+        if dispense_worker and payout_packages > 0:
+            dispense_worker.notify()
         flash(f'แก้ไขรายการ ID {item_id} (สินค้า: {product_info["products_name"]}) ในคำสั่งซื้อ {order_id_from_form} สำเร็จแล้ว!', 'success')
 
     except ValueError:
@@ -2597,7 +3273,7 @@ def edit_bin_item(item_id):
             conn_edit.close()
     return redirect(url_for('bin', barcode_id_filter=barcode_id_for_redirect))
 
-@app.route("/bin/delete/<int:item_id>", methods=["POST"])
+@route('kiosk', "/bin/delete/<int:item_id>", methods=["POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member'])
 def delete_bin_item(item_id):
     conn_del = None
@@ -2630,21 +3306,15 @@ def delete_bin_item(item_id):
         category_id_of_deleted_item = item_to_delete['category_id']
         order_store_id = item_to_delete['store_id']
 
-        cursor_del.execute("UPDATE tbl_products SET stock_quantity = stock_quantity + %s WHERE products_id = %s",
-                            (item_to_delete['quantity'], item_to_delete['products_id']))
+        StockService.release(cursor_del, item_to_delete['products_id'], item_to_delete['quantity'])
 
         cursor_del.execute("DELETE FROM tbl_order WHERE id = %s", (item_id,))
         
-        cursor_del.execute("""
-            SELECT COUNT(*) FROM tbl_order o 
-            JOIN tbl_products p ON o.products_id = p.products_id 
-            WHERE p.category_id = %s AND o.disquantity > 0 AND o.store_id = %s
-        """, (category_id_of_deleted_item, order_store_id))
-        remaining_disposed_in_category_in_store = cursor_del.fetchone()[0]
-        if remaining_disposed_in_category_in_store == 0:
-            cursor_del.execute("UPDATE tbl_bin SET value = 0 WHERE category_id = %s AND store_id = %s", (category_id_of_deleted_item, order_store_id))
+        apply_bin_counter(cursor_del, order_store_id, category_id_of_deleted_item, -item_to_delete['disquantity'])
             
         conn_del.commit()
+        live_events.commit()
+        stats_cache.invalidate(order_store_id)
         flash(f'ลบรายการ ID {item_id} ออกจากคำสั่งซื้อ {item_to_delete["order_id"]} สำเร็จแล้ว! สต็อกสินค้าได้รับการคืนแล้ว.', 'success')
 
     except mysql.connector.Error as err:
@@ -2662,6 +3332,233 @@ def delete_bin_item(item_id):
             conn_del.close()
     return redirect(url_for('bin', barcode_id_filter=item_barcode_id))
 
+# --- Ops / Monitoring ---
+@route('core', "/db_pool_stats")
+@role_required(['root_admin', 'administrator'])
+def db_pool_stats():
+    """Returns connection-pool statistics (in use, waits, wait time) as JSON."""
+    stats = db_pool.stats()
+    stats['background'] = background_pool.stats()
+    return jsonify(stats)
+
+@route('kiosk', "/printer_stats")
+@role_required(['root_admin', 'administrator'])
+def printer_stats():
+    """Returns receipt print-spooler statistics (queued, printed, errors) as JSON."""
+    if print_spooler is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(print_spooler.stats(), enabled=True))
+
+@route('kiosk', "/payout_stats")
+@role_required(['root_admin', 'administrator'])
+def payout_stats():
+    """Returns the coin payout ledger per status and the dispenser worker counters as JSON."""
+    if dispense_worker is None:
+        return jsonify({'enabled': False})
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+        cursor = conn.cursor(dictionary=True)
+        return jsonify({'enabled': True, 'ledger': PayoutLedger.summary(cursor, session.get('store_id')),
+                        'worker': dispense_worker.stats()})
+    except mysql.connector.Error as err:
+        print(f"Error in payout_stats: {err}")
+        return jsonify({'error': f"เกิดข้อผิดพลาดในฐานข้อมูล: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@route('kiosk', "/offline_status")
+@role_required(['root_admin', 'administrator'])
+def offline_status():
+    """Returns the offline journal counts, syncer state and recent sync conflicts as JSON."""
+    if offline_journal is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'kiosk_id': offline_journal.kiosk_id, 'syncer': offline_syncer.stats(),
+                    'conflicts': offline_journal.conflicts(limit=50)})
+
+@route('kiosk', "/events/<int:store_id>")
+@role_required(['root_admin', 'administrator', 'moderator'])
+def live_events_stream(store_id):
+    """
+    Server-sent events for one store, pushed as changes are committed:
+    'bin_flag' (category_id, value), 'cart_line' (added units or the new
+    quantity, 0 = removed) and 'payout' (status, coins, coins_paid).
+    A new connection first gets a 'bin_flags' snapshot; a reconnect with
+    Last-Event-ID gets the missed events instead. 'resync' means events were
+    lost and the device should reload its state.
+    """
+    if session.get('role') == 'moderator' and session.get('store_id') != store_id:
+        return jsonify({'ok': False, 'error': "คุณไม่มีสิทธิ์ดูข้อมูลของร้านค้านี้"}), 403
+    last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID'))
+    try:
+        subscription = live_events.subscribe(store_id, last_event_id)
+    except TooManySubscribers as e:
+        return jsonify({'ok': False, 'error': str(e)}), 503
+
+    # snapshot อ่านหลัง subscribe เหตุการณ์ที่เกิดระหว่างนั้นจึงไม่หาย (ค่าธงเป็นค่าสัมบูรณ์ ส่งซ้ำได้)
+    initial = []
+    if last_event_id is None:
+        conn = None
+        cursor = None
+        try:
+            conn = get_db_connection()
+            if conn:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute("SELECT category_id, value FROM tbl_bin WHERE store_id = %s ORDER BY category_id", (store_id,))
+                initial.append(live_events.frame('bin_flags', {'bins': cursor.fetchall()}))
+        except mysql.connector.Error as err:
+            print(f"Error in live_events_stream snapshot: {err}")
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    response = Response(live_events.stream(subscription, initial=initial), mimetype='text/event-stream')
+    response.call_on_close(lambda: live_events.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # ไม่ให้ reverse proxy (nginx) พักข้อมูลไว้
+    return response
+
+@route('kiosk', "/live_events_stats")
+@role_required(['root_admin', 'administrator'])
+def live_events_stats():
+    """Returns live event counters and the number of SSE subscribers per store as JSON."""
+    return jsonify(live_events.stats())
+
+# สถิติของ pool, คิวพิมพ์, เครื่องจ่ายเหรียญ, live events และ offline syncer ส่งออกที่ /metrics เป็น gauge ด้วย
+request_metrics.add_gauges('db_pool', 'Connection pool statistic', db_pool.stats)
+request_metrics.add_gauges('db_background_pool', 'Background connection pool statistic', background_pool.stats)
+request_metrics.add_gauges('live_events', 'Live event statistic', live_events.stats)
+
+_kiosk_services_started = False
+
+def start_kiosk_services():
+    """
+    Starts the kiosk's background services (print spooler, coin dispenser,
+    offline journal syncer) once per process. create_app() calls it only for
+    profiles with the kiosk group, so an admin or reporting process started
+    with the kiosk's environment never runs a second dispenser or syncer.
+    """
+    global _kiosk_services_started, print_spooler, dispense_worker, offline_syncer
+    if _kiosk_services_started:
+        return
+    _kiosk_services_started = True
+    print_spooler = create_print_spooler()
+    dispense_worker = create_dispense_worker(background_pool.acquire, after_record=publish_payout)
+    if offline_journal:
+        offline_syncer = OfflineSyncer(offline_journal, background_pool.acquire,
+                                       {'cart_scan': sync_cart_scan, 'bin_return': sync_bin_return},
+                                       store_id=int(OFFLINE_STORE_ID) if OFFLINE_STORE_ID else None,
+                                       after_batch=after_offline_sync, after_rollback=live_events.discard).start()
+    if print_spooler:
+        request_metrics.add_gauges('print_spooler', 'Receipt print spooler statistic', print_spooler.stats)
+    if dispense_worker:
+        request_metrics.add_gauges('dispense_worker', 'Coin dispenser worker statistic', dispense_worker.stats)
+    if offline_syncer:
+        request_metrics.add_gauges('offline_syncer', 'Offline journal syncer statistic', offline_syncer.stats)
+
+@route('core', "/metrics")
+def prometheus_metrics():
+    """
+    Request latency, DB queries per request, render times and service
+    statistics in the Prometheus text format. Needs `Authorization: Bearer
+    <METRICS_TOKEN>`; disabled while METRICS_TOKEN is unset.
+    """
+    # ไม่อนุญาตตาม remote_addr: หลัง reverse proxy ในเครื่องทุก request มาจาก 127.0.0.1
+    if not METRICS_TOKEN:
+        return Response("metrics disabled: METRICS_TOKEN is not set\n", status=403, mimetype='text/plain')
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+        return Response("forbidden\n", status=403, mimetype='text/plain')
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@route('core', "/query_profile")
+@route('core', "/query_profile/<report_id>")
+@role_required(['root_admin', 'administrator'])
+def query_profile(report_id=None):
+    """
+    Query profiler reports: the recent requests, or every statement of one
+    request with its findings (repeated, slow, full scan). `?format=json`
+    returns the same data as JSON.
+    """
+    if query_profiler is None:
+        if request.args.get('format') == 'json':
+            return jsonify({'enabled': False})
+        flash("Query profiler ปิดอยู่ (ตั้งค่า QUERY_PROFILER=1 เพื่อเปิด)", 'warning')
+        return redirect(url_for('index'))
+    if report_id is None:
+        reports = query_profiler.recent()
+        if request.args.get('format') == 'json':
+            return jsonify({'enabled': True, 'reports': reports})
+        return render_template("query_profile.html", reports=reports, report=None)
+    report = query_profiler.report(report_id)
+    if report is None:
+        flash("ไม่พบรายงานนี้ (อาจถูกแทนที่ด้วยรายงานใหม่แล้ว ดูได้จากไฟล์ log)", 'warning')
+        return redirect(url_for('query_profile'))
+    if request.args.get('format') == 'json':
+        return jsonify(report)
+    return render_template("query_profile.html", reports=None, report=report)
+
+@route('core', "/cache_stats")
+@role_required(['root_admin', 'administrator'])
+def cache_stats():
+    """Returns hit/miss counters of the in-process caches as JSON."""
+    return jsonify({
+        'dashboard_stats': stats_cache.stats(),
+        'barcode_index': barcode_index.stats(),
+        'report_cache': report_cache.stats(),
+        'barcode_images': barcode_images.stats(),
+    })
+
+
+# --- App factory ---
+def create_app(profile=None):
+    """
+    Builds the Flask app for a profile (see PROFILES; default APP_PROFILE).
+    Only the profile's route groups are registered. url_for() to an endpoint
+    of another group renders '#' so shared templates keep working.
+    """
+    profile = profile or APP_PROFILE
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown APP_PROFILE: {profile} (expected one of {', '.join(PROFILES)})")
+    groups = PROFILES[profile]
+
+    flask_app = Flask(__name__)
+    # โปรดเปลี่ยนเป็นคีย์ลับที่ปลอดภัยและไม่ซ้ำกันสำหรับแอปพลิเคชันของคุณ
+    flask_app.secret_key = 'your_strong_and_secret_key_here'
+    flask_app.config['APP_PROFILE'] = profile
+    if 'kiosk' in groups:
+        start_kiosk_services()
+    db_pool.init_app(flask_app)
+    request_metrics.init_app(flask_app)
+    if query_profiler:
+        query_profiler.init_app(flask_app, skip_endpoints=('static', 'query_profile'))
+    flask_app.teardown_appcontext(live_events.discard)  # เหตุการณ์ที่ไม่ได้ commit (rollback หรือ error) ถูกทิ้ง
+    if session_store is not None:
+        flask_app.session_interface = ServerSessionInterface(session_store)
+
+    disabled_endpoints = set()
+    for group, rule, options, view_func in _routes:
+        if group in groups:
+            flask_app.add_url_rule(rule, view_func=view_func, **options)
+        else:
+            disabled_endpoints.add(view_func.__name__)
+
+    def disabled_endpoint_url(error, endpoint, values):
+        if endpoint in disabled_endpoints:
+            return '#'
+        raise error
+    flask_app.url_build_error_handlers.append(disabled_endpoint_url)
+    return flask_app
+
+
+app = create_app()
 
 if __name__ == "__main__":
     app.run(debug=True)
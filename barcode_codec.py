@@ -0,0 +1,169 @@
+# Barcode Codec
+# Project Bin - เข้ารหัส/ถอดรหัส products_id <-> ค่าบาร์โค้ด 13 หลัก และตรวจสอบ log การสแกนจำนวนมาก
+#
+# y = (A * x + B) mod M  และ  x = A_INV * (y - B) mod M
+# A_INV (inverse ของ A mod M) คำนวณครั้งเดียวตอน import
+# หมายเหตุ: M = 7 * 691 * 2067397147 ไม่ใช่จำนวนเฉพาะ pow(A, M - 2, M) แบบเดิมจึงไม่ใช่ inverse
+# (decode(encode(x)) != x) ที่นี่ใช้ pow(A, -1, M) ซึ่งถูกต้องเพราะ gcd(A, M) = 1
+# เลขทั้งหมดเป็น int ของ Python จึงถูกต้องเสมอ (A * y มีขนาดราว 74 บิต เกิน int64 ของ NumPy)
+# ป้ายสินค้าปัจจุบันพิมพ์ tbl_products.barcode_id ของสินค้าเอง (ดู ean13.py) การตรวจ log จึงจับคู่กับ barcode_id
+# ก่อน แล้วถอดรหัสด้วย decode เฉพาะค่าที่ไม่ตรง (ป้ายเก่าที่พิมพ์จาก encode(products_id))
+#
+# การใช้งาน:
+#   python barcode_codec.py verify <scan_log> [--db]    รายงานบาร์โค้ดที่ตรงกับสินค้า (--db: barcode_id และ products_id จริง)
+#   python barcode_codec.py bench [n]                   วัดความเร็ว decode แบบเดิมเทียบกับแบบใหม่
+
+import re
+import sys
+import time
+
+A = 982451653
+B = 1234567891234
+M = 10000000000039
+A_INV = pow(A, -1, M)
+_B_INV = (M - B) * A_INV % M  # decode(y) = (A_INV * y + _B_INV) mod M
+
+MAX_PRODUCT_ID = 2 ** 31 - 1  # products_id เป็น int(11)
+_BARCODE_RE = re.compile(r'(?<!\d)\d{13,14}(?!\d)')
+
+
+def encode(x: int) -> int:
+    return (A * x + B) % M
+
+
+def decode(y: int) -> int:
+    return (A_INV * y + _B_INV) % M
+
+
+def decode_many(values):
+    """Decodes an iterable of barcode values (int or digit strings) into a list of product ids."""
+    a_inv, b_inv, m = A_INV, _B_INV, M
+    return [(a_inv * y + b_inv) % m for y in map(int, values)]
+
+
+def verify_many(values, known_ids=None):
+    """
+    Checks barcode values in bulk. A value is valid when it is below M and
+    decodes to a plausible products_id (<= MAX_PRODUCT_ID), and, when
+    `known_ids` is given, to one of those ids.
+    Returns a list of (value, product_id or None).
+    """
+    results = []
+    a_inv, b_inv, m = A_INV, _B_INV, M
+    for value in values:
+        y = int(value)
+        x = (a_inv * y + b_inv) % m if y < m else None
+        if x is not None and (x > MAX_PRODUCT_ID or (known_ids is not None and x not in known_ids)):
+            x = None
+        results.append((value, x))
+    return results
+
+
+def barcodes_in_log(lines):
+    """Yields (line_number, barcode) for the first 13/14-digit value on every line of a scan log."""
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        match = _BARCODE_RE.search(line)
+        yield number, match.group(0) if match else None
+
+
+def verify_log(lines, known_ids=None, barcode_products=None):
+    """
+    Verifies every scan in a log. Returns a summary dict with the per-product
+    scan counts and the lines that are malformed or do not map to a product.
+    `barcode_products` maps printed barcode values (tbl_products.barcode_id)
+    to product ids; those are matched first, and only the remaining values are
+    decoded as legacy encode() labels (checked against `known_ids`).
+    """
+    barcode_products = barcode_products or {}
+    scans = list(barcodes_in_log(lines))
+    legacy = [barcode for _, barcode in scans if barcode and barcode not in barcode_products]
+    decoded = iter(verify_many(legacy, known_ids))
+    products = {}
+    malformed = []
+    unknown = []
+    for number, barcode in scans:
+        if barcode is None:
+            malformed.append(number)
+            continue
+        product_id = barcode_products.get(barcode)
+        if product_id is None:
+            _, product_id = next(decoded)
+        if product_id is None:
+            unknown.append({'line': number, 'barcode': barcode})
+        else:
+            products[product_id] = products.get(product_id, 0) + 1
+    return {
+        'lines': len(scans),
+        'valid': sum(products.values()),
+        'malformed_lines': malformed,
+        'unknown': unknown,
+        'products': products,
+    }
+
+
+def _legacy_decode(y):
+    # แบบเดิมใน app.py: คำนวณ pow ใหม่ทุกครั้ง (ใช้วัดความเร็วเท่านั้น ผลลัพธ์ไม่ถูกต้อง)
+    a_inv = pow(A, M - 2, M)
+    return (a_inv * (y - B + M)) % M
+
+
+def bench(n=1000000):
+    values = [encode(x) for x in range(1, n + 1)]
+    legacy_n = min(n, 100000)
+    started = time.perf_counter()
+    for y in values[:legacy_n]:
+        _legacy_decode(y)
+    legacy = (time.perf_counter() - started) / legacy_n
+
+    started = time.perf_counter()
+    for y in values:
+        decode(y)
+    single = (time.perf_counter() - started) / n
+
+    started = time.perf_counter()
+    decoded = decode_many(values)
+    batch = (time.perf_counter() - started) / n
+
+    assert decoded == list(range(1, n + 1))
+    print(f"legacy decode : {1 / legacy:>14,.0f} decodes/s")
+    print(f"decode        : {1 / single:>14,.0f} decodes/s ({legacy / single:.0f}x)")
+    print(f"decode_many   : {1 / batch:>14,.0f} decodes/s ({legacy / batch:.0f}x)")
+
+
+def _catalog():
+    """(every products_id, {barcode_id: products_id}) from the database."""
+    import mysql.connector
+    from db_pool import DB_CONFIG
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT products_id, barcode_id FROM tbl_products")
+        rows = cursor.fetchall()
+        return {int(row[0]) for row in rows}, {str(row[1]): int(row[0]) for row in rows if row[1]}
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if command == 'bench':
+        bench(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif command == 'verify' and len(sys.argv) > 2:
+        known, barcode_products = _catalog() if '--db' in sys.argv[3:] else (None, None)
+        started = time.perf_counter()
+        with open(sys.argv[2], 'rb') as log_file:
+            report = verify_log(log_file, known, barcode_products)
+        elapsed = time.perf_counter() - started
+        print(f"{report['lines']} line(s), {report['valid']} valid scan(s) of {len(report['products'])} product(s), "
+              f"{len(report['unknown'])} unknown, {len(report['malformed_lines'])} malformed "
+              f"in {elapsed:.2f}s ({report['lines'] / elapsed if elapsed else 0:,.0f} lines/s)")
+        for item in report['unknown'][:20]:
+            print(f"  line {item['line']}: {item['barcode']} does not map to a product")
+        sys.exit(1 if report['unknown'] or report['malformed_lines'] else 0)
+    else:
+        print("Usage: python barcode_codec.py verify <scan_log> [--db] | bench [n]")
+        sys.exit(1)
@@ -0,0 +1,105 @@
+# Barcode Images
+# Project Bin - บริการสร้างภาพบาร์โค้ดสินค้า (EAN-13, PNG/SVG) พร้อมแคชในหน่วยความจำ (LRU) และแคชไฟล์บนดิสก์
+#
+# ภาพขึ้นกับค่าบาร์โค้ด รูปแบบไฟล์ และตัวเลือกการเรนเดอร์เท่านั้น จึงใช้ค่าเหล่านี้ (รวม RENDER_VERSION)
+# เป็น key ของแคชและเป็น ETag ได้โดยตรง เมื่อแก้ไขวิธีวาดให้เพิ่ม RENDER_VERSION เพื่อไม่ให้ใช้ภาพเก่า
+# ฟอนต์ถูกโหลดครั้งเดียวต่อ process และ PIL ถูก import เมื่อเรนเดอร์ PNG ครั้งแรกเท่านั้น
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import ean13
+from report_cache import ReportCache
+
+RENDER_VERSION = 2
+MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+BARCODE_FONT = os.environ.get('BARCODE_FONT', 'arial.ttf')
+BARCODE_CACHE_DIR = os.environ.get('BARCODE_CACHE_DIR',
+                                   os.path.join(os.path.dirname(os.path.abspath(__file__)), 'barcode_cache'))
+BARCODE_CACHE_MAX_MB = int(os.environ.get('BARCODE_CACHE_MAX_MB', '50'))
+BARCODE_MEMORY_ENTRIES = int(os.environ.get('BARCODE_MEMORY_ENTRIES', '2000'))
+
+
+@lru_cache(maxsize=None)
+def load_font(size):
+    """Loads the label font once per process and size."""
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.truetype(BARCODE_FONT, size)
+    except IOError:
+        print(f"Warning: font {BARCODE_FONT} not found. Using default font.")
+        return ImageFont.load_default()
+
+
+def render(code, fmt='png', module_width=2, bar_height=60, text=True):
+    """Renders an EAN-13 code as PNG or SVG bytes. Raises ValueError for an invalid code."""
+    if fmt == 'svg':
+        return ean13.render_svg(code, module_width, bar_height, text).encode('utf-8')
+    if fmt == 'png':
+        return ean13.render_png(code, module_width, bar_height, text, font=load_font(6 * module_width))
+    raise ValueError(f"Unsupported barcode format: {fmt}")
+
+
+class BarcodeImages:
+    """Renders barcode images through a per-process LRU and a shared on-disk cache."""
+
+    def __init__(self, memory_entries=BARCODE_MEMORY_ENTRIES, disk_cache=None):
+        self.memory_entries = memory_entries
+        self.disk_cache = disk_cache
+        self._memory = OrderedDict()  # key -> data bytes
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'renders': 0}
+
+    @staticmethod
+    def etag(code, fmt='png', **options):
+        """Strong ETag (also the cache key) for an image; needs no rendering or database access."""
+        parts = (RENDER_VERSION, code, fmt, sorted(options.items()))
+        return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+    def get(self, code, fmt='png', **options):
+        """Returns (image_bytes, etag) for a valid 13-digit EAN-13 `code`."""
+        key = self.etag(code, fmt, **options)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return data, key
+
+        disk_cache = self.disk_cache.get(fmt) if self.disk_cache else None
+        data = disk_cache.get(key) if disk_cache else None
+        if data is not None:
+            with self._lock:
+                self._stats['disk_hits'] += 1
+        else:
+            data = render(code, fmt, **options)
+            if disk_cache:
+                disk_cache.put(key, data)
+            with self._lock:
+                self._stats['renders'] += 1
+
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+        return data, key
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        if self.disk_cache:
+            stats['disk'] = {fmt: cache.stats() for fmt, cache in self.disk_cache.items()}
+        return stats
+
+
+def create_barcode_images():
+    max_bytes = BARCODE_CACHE_MAX_MB * 1024 * 1024
+    disk_cache = {fmt: ReportCache(directory=BARCODE_CACHE_DIR, max_bytes=max_bytes // len(MIMETYPES), suffix='.' + fmt)
+                  for fmt in MIMETYPES}
+    return BarcodeImages(disk_cache=disk_cache)
@@ -0,0 +1,138 @@
+# Barcode Index
+# Project Bin - ดัชนี barcode → สินค้า ในหน่วยความจำ แยกตามร้านค้า สำหรับการสแกนที่หน้า cart
+#
+# - โหลดสินค้าทั้งร้านครั้งเดียว แล้วการสแกนครั้งต่อไปเป็นเพียงการค้นใน dict
+# - จำกัดหน่วยความจำด้วยจำนวนรายการรวม (max_entries) และไล่ร้านที่ไม่ได้ใช้นานที่สุดออกก่อน (LRU)
+# - ไม่เก็บสต็อก (สต็อกตัดแบบ atomic ผ่าน StockService อยู่แล้ว)
+# - ถ้าหาไม่เจอในดัชนีจะถามฐานข้อมูลโดยตรงเสมอ และดัชนีของแต่ละร้านหมดอายุใน ttl วินาที
+#   เพื่อรับการแก้ไขสินค้าจาก worker อื่น
+
+import threading
+import time
+from collections import OrderedDict
+
+PRODUCT_COLUMNS = "products_id, products_name, price, category_id, barcode_id, store_id"
+
+
+class BarcodeIndex:
+    """Process-local, per-store barcode lookup with LRU eviction of cold stores."""
+
+    def __init__(self, max_entries=200000, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._stores = OrderedDict()  # store_id -> (expires_at, {barcode: product})
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'fallback_found': 0,
+            'loads': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    @staticmethod
+    def _store_filter(store_id):
+        if store_id:
+            return " WHERE (store_id = %s OR store_id IS NULL)", [store_id]
+        return "", []
+
+    def _load(self, cursor, store_id):
+        where, params = self._store_filter(store_id)
+        cursor.execute(f"SELECT {PRODUCT_COLUMNS} FROM tbl_products{where}", tuple(params))
+        products = {}
+        for row in cursor.fetchall():
+            barcode = row['barcode_id']
+            if not barcode:
+                continue
+            # สินค้าของร้านเองมาก่อนสินค้าที่ใช้ร่วมกัน (store_id IS NULL)
+            if barcode in products and row['store_id'] is None:
+                continue
+            products[barcode] = dict(row)
+        return products
+
+    def _store_products(self, cursor, store_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._stores.get(store_id)
+            if entry and entry[0] > now:
+                self._stores.move_to_end(store_id)
+                return entry[1]
+
+        products = self._load(cursor, store_id)
+        with self._lock:
+            self._stats['loads'] += 1
+            old = self._stores.pop(store_id, None)
+            if old:
+                self._size -= len(old[1])
+            if len(products) > self.max_entries:
+                return products  # ใหญ่เกินกว่าจะเก็บ ใช้ครั้งนี้ครั้งเดียว
+            while self._stores and self._size + len(products) > self.max_entries:
+                _, (_, evicted) = self._stores.popitem(last=False)
+                self._size -= len(evicted)
+                self._stats['evictions'] += 1
+            self._stores[store_id] = (now + self.ttl, products)
+            self._size += len(products)
+        return products
+
+    def lookup(self, cursor, barcode, store_id):
+        """
+        Resolves a scanned barcode for a store. `cursor` must be a dictionary
+        cursor; it is only used when the store is not loaded yet or on a miss.
+        Returns a product dict or None.
+        """
+        products = self._store_products(cursor, store_id)
+        product = products.get(barcode)
+        if product is not None:
+            with self._lock:
+                self._stats['hits'] += 1
+            return product
+
+        # ไม่พบในดัชนี: ถามฐานข้อมูลโดยตรงเผื่อสินค้าเพิ่งถูกเพิ่มจาก worker อื่น
+        with self._lock:
+            self._stats['misses'] += 1
+        where, params = self._store_filter(store_id)
+        where = (where + " AND" if where else " WHERE") + " barcode_id = %s"
+        cursor.execute(f"SELECT {PRODUCT_COLUMNS} FROM tbl_products{where} ORDER BY store_id IS NULL LIMIT 1",
+                       tuple(params + [barcode]))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        product = dict(row)
+        with self._lock:
+            self._stats['fallback_found'] += 1
+            entry = self._stores.get(store_id)
+            if entry is not None and barcode not in entry[1]:
+                entry[1][barcode] = product
+                self._size += 1
+        return product
+
+    def invalidate(self, *store_ids):
+        """
+        Drops the indexes of `store_ids`. Without arguments, or when a shared
+        product (store_id None) changed, every store is dropped.
+        """
+        with self._lock:
+            self._stats['invalidations'] += 1
+            if not store_ids or None in store_ids:
+                self._stores.clear()
+                self._size = 0
+                return
+            for store_id in store_ids:
+                entry = self._stores.pop(store_id, None)
+                if entry:
+                    self._size -= len(entry[1])
+            # ดัชนีของผู้ใช้ที่ไม่มีร้าน (None) รวมสินค้าทุกร้าน
+            entry = self._stores.pop(None, None)
+            if entry:
+                self._size -= len(entry[1])
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['stores'] = len(self._stores)
+            stats['entries'] = self._size
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
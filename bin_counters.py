@@ -0,0 +1,121 @@
+# Bin Disposal Counters
+# Project Bin - ตัวนับจำนวนบรรจุภัณฑ์ที่ทิ้งแล้วแยกตาม (ร้านค้า, หมวดหมู่)
+#
+# tbl_bin_counter.disposed_units = SUM(tbl_order.disquantity) ของร้านและหมวดหมู่นั้น
+# ทุกครั้งที่ disquantity เปลี่ยน ให้เรียก BinCounters.apply() ใน transaction เดียวกัน
+# แล้ว tbl_bin.value จะถูกคำนวณจากตัวนับโดยตรง (อ่านแถวเดียวผ่าน primary key)
+#
+# การใช้งาน:
+#   python bin_counters.py verify     เทียบตัวนับกับค่าที่คำนวณใหม่จาก tbl_order
+#   python bin_counters.py rebuild    คำนวณตัวนับและ tbl_bin.value ใหม่ทั้งหมด
+
+import sys
+
+
+class BinCounters:
+    """Incrementally maintained disposal counters that drive tbl_bin.value."""
+
+    @staticmethod
+    def apply(cursor, store_id, category_id, delta):
+        """
+        Adds `delta` disposed units to (store_id, category_id) and refreshes the
+        matching tbl_bin flag. Must run in the same transaction as the
+        tbl_order.disquantity change it mirrors.
+        Returns the new flag (0 or 1) when it flipped, otherwise None.
+        """
+        if not delta or store_id is None or category_id is None:
+            return None
+        cursor.execute("""
+            INSERT INTO tbl_bin_counter (store_id, category_id, disposed_units) VALUES (%s, %s, GREATEST(%s, 0))
+            ON DUPLICATE KEY UPDATE disposed_units = GREATEST(disposed_units + %s, 0)
+        """, (store_id, category_id, delta, delta))
+        # แถวตัวนับถูก lock แล้วโดย upsert ด้านบน อ่าน flag ปัจจุบันแบบ locking read แล้วเขียนเฉพาะเมื่อเปลี่ยน
+        cursor.execute("""
+            SELECT IF(disposed_units > 0, 1, 0) AS flag FROM tbl_bin_counter WHERE store_id = %s AND category_id = %s
+        """, (store_id, category_id))
+        row = cursor.fetchone()
+        flag = row['flag'] if isinstance(row, dict) else row[0]
+        cursor.execute("SELECT MAX(value) AS value FROM tbl_bin WHERE category_id = %s AND store_id = %s FOR UPDATE",
+                       (category_id, store_id))
+        row = cursor.fetchone()
+        current = row['value'] if isinstance(row, dict) else row[0]
+        if current is None or int(current) == flag:
+            return None
+        cursor.execute("UPDATE tbl_bin SET value = %s WHERE category_id = %s AND store_id = %s",
+                       (flag, category_id, store_id))
+        return flag
+
+    @staticmethod
+    def category_of(cursor, products_id):
+        """Returns the category_id of a product, or None if it no longer exists."""
+        cursor.execute("SELECT category_id FROM tbl_products WHERE products_id = %s", (products_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return row['category_id'] if isinstance(row, dict) else row[0]
+
+    @staticmethod
+    def rebuild(cursor):
+        """Recomputes every counter and tbl_bin flag from tbl_order. The caller commits."""
+        cursor.execute("DELETE FROM tbl_bin_counter")
+        cursor.execute("""
+            INSERT INTO tbl_bin_counter (store_id, category_id, disposed_units)
+            SELECT o.store_id, p.category_id, SUM(o.disquantity)
+            FROM tbl_order o
+            JOIN tbl_products p ON o.products_id = p.products_id
+            WHERE o.disquantity > 0 AND o.store_id IS NOT NULL AND p.category_id IS NOT NULL
+            GROUP BY o.store_id, p.category_id
+        """)
+        cursor.execute("""
+            UPDATE tbl_bin b
+            LEFT JOIN tbl_bin_counter c ON c.store_id = b.store_id AND c.category_id = b.category_id
+            SET b.value = IF(IFNULL(c.disposed_units, 0) > 0, 1, 0)
+        """)
+
+    @staticmethod
+    def verify(cursor):
+        """
+        Compares the stored counters with a from-scratch recount.
+        Returns a list of (store_id, category_id, stored, actual) mismatches.
+        """
+        cursor.execute("""
+            SELECT o.store_id, p.category_id, SUM(o.disquantity)
+            FROM tbl_order o
+            JOIN tbl_products p ON o.products_id = p.products_id
+            WHERE o.disquantity > 0 AND o.store_id IS NOT NULL AND p.category_id IS NOT NULL
+            GROUP BY o.store_id, p.category_id
+        """)
+        actual = {(row[0], row[1]): int(row[2]) for row in cursor.fetchall()}
+        cursor.execute("SELECT store_id, category_id, disposed_units FROM tbl_bin_counter")
+        stored = {(row[0], row[1]): int(row[2]) for row in cursor.fetchall()}
+        mismatches = []
+        for key in sorted(set(actual) | set(stored)):
+            if actual.get(key, 0) != stored.get(key, 0):
+                mismatches.append((key[0], key[1], stored.get(key, 0), actual.get(key, 0)))
+        return mismatches
+
+
+if __name__ == "__main__":
+    import mysql.connector
+    from db_pool import DB_CONFIG
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    try:
+        if command == 'rebuild':
+            BinCounters.rebuild(cursor)
+            conn.commit()
+            print("Bin counters rebuilt.")
+        elif command == 'verify':
+            mismatches = BinCounters.verify(cursor)
+            for store_id, category_id, stored, actual in mismatches:
+                print(f"store {store_id} category {category_id}: stored {stored}, actual {actual}")
+            print("OK" if not mismatches else f"{len(mismatches)} mismatch(es); run 'python bin_counters.py rebuild'")
+            sys.exit(1 if mismatches else 0)
+        else:
+            print(f"Unknown command: {command}")
+            sys.exit(1)
+    finally:
+        cursor.close()
+        conn.close()
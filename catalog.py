@@ -0,0 +1,96 @@
+# Product Catalog Sync
+# Project Bin - แคตตาล็อกสินค้าแบบมีเวอร์ชันสำหรับหน้า cart (รองรับ ETag และการดึงเฉพาะส่วนที่เปลี่ยน)
+#
+# เวอร์ชันของแคตตาล็อกคือเวลา (ไมโครวินาที) ของการเปลี่ยนแปลงล่าสุดในร้านนั้น ได้จาก
+# tbl_products.updated_at (MySQL อัปเดตให้อัตโนมัติทุกครั้งที่แถวเปลี่ยน รวมถึงสต็อก)
+# และ tbl_catalog_tombstone.deleted_at สำหรับสินค้าที่ถูกลบ
+#
+# การดึงแบบ delta (since=<version>) จะย้อนหลังเพิ่ม DELTA_OVERLAP วินาที เพื่อไม่ให้พลาดแถวจาก
+# transaction ที่เริ่มก่อนแต่ commit ทีหลัง ฝั่ง client รวมข้อมูลตาม products_id จึงรับซ้ำได้โดยไม่มีผลเสีย
+
+from decimal import Decimal
+
+DELTA_OVERLAP = 5  # seconds
+
+
+def _to_version(unix_ts):
+    return int(Decimal(unix_ts) * 1000000) if unix_ts is not None else 0
+
+
+def _to_unix(version):
+    return Decimal(version) / 1000000
+
+
+class ProductCatalog:
+    """Reads versioned, store-scoped product catalogs. Products with store_id NULL are shared by every store."""
+
+    @staticmethod
+    def _store_filter(store_id, alias='p'):
+        if store_id:
+            return f" WHERE ({alias}.store_id = %s OR {alias}.store_id IS NULL)", [store_id]
+        return " WHERE 1 = 1", []
+
+    @staticmethod
+    def version(cursor, store_id):
+        """Returns the current catalog version of a store (0 for an empty catalog)."""
+        where, params = ProductCatalog._store_filter(store_id)
+        cursor.execute(f"SELECT UNIX_TIMESTAMP(MAX(p.updated_at)) AS v FROM tbl_products p{where}", tuple(params))
+        row = cursor.fetchone()
+        products_version = _to_version(row['v'] if isinstance(row, dict) else row[0])
+
+        where, params = ProductCatalog._store_filter(store_id, 't')
+        cursor.execute(f"SELECT UNIX_TIMESTAMP(MAX(t.deleted_at)) AS v FROM tbl_catalog_tombstone t{where}", tuple(params))
+        row = cursor.fetchone()
+        deleted_version = _to_version(row['v'] if isinstance(row, dict) else row[0])
+        return max(products_version, deleted_version)
+
+    @staticmethod
+    def etag(store_id, version):
+        return f"catalog-{store_id or 'all'}-{version}"
+
+    @staticmethod
+    def snapshot(cursor, store_id, since=None, version=None):
+        """
+        Returns the catalog as a JSON-ready dict. With `since` only products changed
+        after that version (minus DELTA_OVERLAP) and the ids deleted since then are
+        included, and 'full' is False.
+        """
+        if version is None:
+            version = ProductCatalog.version(cursor, store_id)
+        where, params = ProductCatalog._store_filter(store_id)
+        query = f"SELECT p.products_id, p.products_name, p.stock_quantity AS stock, p.price, p.barcode_id FROM tbl_products p{where}"
+        deleted = []
+        if since:
+            query += " AND p.updated_at > FROM_UNIXTIME(%s) - INTERVAL %s SECOND"
+            params.extend([str(_to_unix(since)), DELTA_OVERLAP])
+
+            t_where, t_params = ProductCatalog._store_filter(store_id, 't')
+            t_params.extend([str(_to_unix(since)), DELTA_OVERLAP])
+            cursor.execute(f"SELECT t.products_id FROM tbl_catalog_tombstone t{t_where} AND t.deleted_at > FROM_UNIXTIME(%s) - INTERVAL %s SECOND",
+                           tuple(t_params))
+            deleted = [str(row['products_id'] if isinstance(row, dict) else row[0]) for row in cursor.fetchall()]
+        query += " ORDER BY p.products_id"
+        cursor.execute(query, tuple(params))
+        products = []
+        for row in cursor.fetchall():
+            products.append({
+                'products_id': str(row['products_id']),
+                'products_name': row['products_name'],
+                'stock': row['stock'],
+                'price': str(row['price']),
+                'barcode_id': row['barcode_id'] or '',
+            })
+        return {
+            'version': version,
+            'full': not since,
+            'products': products,
+            'deleted': deleted,
+        }
+
+    @staticmethod
+    def record_deletion(cursor, products_id, store_id):
+        """Leaves a tombstone so delta clients drop a deleted product. Call in the deleting transaction."""
+        cursor.execute("""
+            INSERT INTO tbl_catalog_tombstone (products_id, store_id, deleted_at) VALUES (%s, %s, CURRENT_TIMESTAMP(6))
+            ON DUPLICATE KEY UPDATE store_id = VALUES(store_id), deleted_at = CURRENT_TIMESTAMP(6)
+        """, (products_id, store_id))
@@ -0,0 +1,359 @@
+# Coin Dispenser Queue
+# Project Bin - คิวคำสั่งจ่ายเหรียญคืนบรรจุภัณฑ์ (1 บาทต่อชิ้น) และบัญชีการจ่าย (tbl_payout)
+#
+# - หน้า bin บันทึกงานจ่ายเหรียญลง tbl_payout ใน transaction เดียวกับการเพิ่ม disquantity
+#   (ถ้า rollback งานจ่ายก็หายไปด้วย จึงไม่มีการจ่ายซ้ำหรือตกหล่น) แล้วปลุก DispenseWorker
+# - DispenseWorker เป็น thread แยกที่สั่งเครื่องจ่ายเหรียญ request จึงไม่ต้องรอกลไกของเครื่อง
+# - การจองงานใช้ UPDATE ... LIMIT แบบ atomic พร้อม claimed_by หลาย process จึงไม่หยิบงานเดียวกัน
+# - จ่ายไม่ครบ (เหรียญติด/หมด) บันทึก coins_paid แล้วลองจ่ายส่วนที่เหลือใหม่ จนครบ max_attempts จึงเป็น failed
+# - งานที่ค้างสถานะ dispensing เกิน STALE_CLAIM_SECONDS (process หยุดกลางคัน) ถูกตั้งเป็น failed
+#   ไม่ลองใหม่อัตโนมัติ เพราะไม่รู้ว่าเครื่องจ่ายไปแล้วเท่าไร ให้ผู้ดูแลตรวจสอบ
+# - การแก้ disquantity ให้น้อยลงไม่เรียกเหรียญคืน
+#
+# ตัวแปร environment:
+#   COIN_DISPENSER             'simulated' = SimulatedDispenser, ว่าง = ไม่จ่ายเหรียญ
+#   COIN_DISPENSER_STORE_ID    จ่ายเฉพาะงานของร้านนี้ (ตู้หนึ่งตู้ต่อร้าน) ว่าง = ทุกร้าน
+#   COINS_PER_PACKAGE          จำนวนเหรียญต่อบรรจุภัณฑ์ที่คืน
+#   COIN_SIM_LATENCY_MS        เวลาจ่ายต่อเหรียญของเครื่องจำลอง
+#   COIN_SIM_FAULT_RATE        โอกาสที่เครื่องจำลองจะติดระหว่างจ่ายแต่ละเหรียญ (0-1)
+#
+# การใช้งาน:
+#   python coin_dispenser.py bench [payouts] [latency_ms] [fault_rate]    วัด throughput ด้วยเครื่องจำลองบนฐานข้อมูล bench
+#   python coin_dispenser.py status                                       สรุปบัญชีการจ่ายตามสถานะ
+
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+COIN_DISPENSER = os.environ.get('COIN_DISPENSER', '')
+COIN_DISPENSER_STORE_ID = os.environ.get('COIN_DISPENSER_STORE_ID', '')
+COINS_PER_PACKAGE = int(os.environ.get('COINS_PER_PACKAGE', '1'))
+COIN_SIM_LATENCY_MS = float(os.environ.get('COIN_SIM_LATENCY_MS', '150'))
+COIN_SIM_FAULT_RATE = float(os.environ.get('COIN_SIM_FAULT_RATE', '0'))
+STALE_CLAIM_SECONDS = 300
+
+
+class DispenserError(Exception):
+    """Raised by a dispenser that stopped early; `dispensed` coins were paid before the fault."""
+
+    def __init__(self, message, dispensed=0):
+        super().__init__(message)
+        self.dispensed = dispensed
+
+
+class SimulatedDispenser:
+    """
+    Stand-in for the 24V coin hopper: takes `latency` seconds per coin and
+    jams on each coin with probability `fault_rate`.
+    """
+
+    def __init__(self, latency=COIN_SIM_LATENCY_MS / 1000, fault_rate=COIN_SIM_FAULT_RATE, seed=None):
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self._random = random.Random(seed)
+        self.dispensed = 0
+
+    def dispense(self, coins):
+        """Pays out `coins` coins. Returns the number paid or raises DispenserError."""
+        for paid in range(coins):
+            if self.latency:
+                time.sleep(self.latency)
+            if self.fault_rate and self._random.random() < self.fault_rate:
+                raise DispenserError("simulated coin jam", dispensed=paid)
+            self.dispensed += 1
+        return coins
+
+
+class PayoutLedger:
+    """SQL for tbl_payout; every method runs on the caller's cursor and transaction."""
+
+    @staticmethod
+    def enqueue(cursor, store_id, order_line_id, email, packages):
+        """Records a pending payout for `packages` returned packages. Call in the bin update's transaction."""
+        coins = packages * COINS_PER_PACKAGE
+        if coins <= 0:
+            return None
+        cursor.execute("""
+            INSERT INTO tbl_payout (store_id, order_line_id, email, coins) VALUES (%s, %s, %s, %s)
+        """, (store_id, order_line_id, email, coins))
+        return cursor.lastrowid
+
+    @staticmethod
+    def claim(cursor, limit, store_id=None):
+        """
+        Atomically marks up to `limit` pending payouts as dispensing and returns
+        them. Each call claims under a fresh token, so rows left dispensing by an
+        earlier claim (e.g. a payout whose record() failed) are never returned again.
+        """
+        token = uuid.uuid4().hex
+        query = """
+            UPDATE tbl_payout SET status = 'dispensing', claimed_by = %s, claimed_at = NOW()
+            WHERE status = 'pending'
+        """
+        params = [token]
+        if store_id is not None:
+            query += " AND store_id = %s"
+            params.append(store_id)
+        cursor.execute(query + " ORDER BY payout_id LIMIT %s", (*params, limit))
+        if not cursor.rowcount:
+            return []
+        cursor.execute("""
+            SELECT payout_id, store_id, order_line_id, coins, coins_paid, attempts FROM tbl_payout
+            WHERE claimed_by = %s AND status = 'dispensing' ORDER BY payout_id
+        """, (token,))
+        columns = ('payout_id', 'store_id', 'order_line_id', 'coins', 'coins_paid', 'attempts')
+        return [row if isinstance(row, dict) else dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    @staticmethod
+    def record(cursor, payout_id, coins_paid, attempts, status, error=None):
+        cursor.execute("""
+            UPDATE tbl_payout
+            SET coins_paid = %s, attempts = %s, status = %s, error = %s, claimed_by = NULL,
+                completed_at = IF(%s IN ('done', 'failed'), NOW(), NULL)
+            WHERE payout_id = %s
+        """, (coins_paid, attempts, status, error[:255] if error else None, status, payout_id))
+
+    @staticmethod
+    def fail_stale(cursor, older_than=STALE_CLAIM_SECONDS):
+        """Fails payouts left dispensing by a stopped worker. Returns how many were failed."""
+        cursor.execute("""
+            UPDATE tbl_payout SET status = 'failed', claimed_by = NULL, completed_at = NOW(),
+                error = 'interrupted while dispensing; check the hopper before retrying'
+            WHERE status = 'dispensing' AND claimed_at < NOW() - INTERVAL %s SECOND
+        """, (older_than,))
+        return cursor.rowcount
+
+    @staticmethod
+    def summary(cursor, store_id=None):
+        """Payout count and coins owed/paid per status."""
+        query = "SELECT status, COUNT(*), COALESCE(SUM(coins), 0), COALESCE(SUM(coins_paid), 0) FROM tbl_payout"
+        params = ()
+        if store_id is not None:
+            query += " WHERE store_id = %s"
+            params = (store_id,)
+        cursor.execute(query + " GROUP BY status", params)
+        rows = [row.values() if isinstance(row, dict) else row for row in cursor.fetchall()]
+        return {status: {'payouts': int(count), 'coins': int(coins), 'coins_paid': int(paid)}
+                for status, count, coins, paid in rows}
+
+
+class DispenseWorker:
+    """
+    Background thread that drives one dispenser from the payout queue.
+    `connect` must return a connection the worker may commit on and close.
+    `after_record(payout, status, coins_paid, error)` runs after each payout result is committed.
+    """
+
+    def __init__(self, connect, dispenser, store_id=None, batch_size=20, poll_interval=5.0, max_attempts=3,
+                 after_record=None):
+        self.connect = connect
+        self.dispenser = dispenser
+        self.store_id = store_id
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.after_record = after_record
+        self._unrecorded = []   # (payout, coins_paid, attempts, status, error) paid but not yet in tbl_payout
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._stats = {'done': 0, 'retried': 0, 'failed': 0, 'coins_paid': 0, 'dispense_time': 0.0, 'errors': 0}
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='coin-dispenser', daemon=True)
+        self._thread.start()
+        return self
+
+    def notify(self):
+        """Wakes the worker after a payout was committed, instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            self._transaction(PayoutLedger.fail_stale)
+        except Exception as e:
+            print(f"Coin dispenser: could not check stale payouts: {e}")
+        while not self._stopping:
+            self._wakeup.clear()
+            self._retry_records()
+            try:
+                payouts = self._transaction(PayoutLedger.claim, self.batch_size, self.store_id)
+            except Exception as e:
+                print(f"Coin dispenser: could not claim payouts: {e}")
+                with self._lock:
+                    self._stats['errors'] += 1
+                payouts = []
+            for payout in payouts:
+                self._dispense(payout)
+            if not payouts or self._unrecorded:
+                self._wakeup.wait(self.poll_interval)
+        self._retry_records()
+
+    def _transaction(self, operation, *args):
+        conn = self.connect()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            result = operation(cursor, *args)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _dispense(self, payout):
+        remaining = payout['coins'] - payout['coins_paid']
+        attempts = payout['attempts'] + 1
+        started = time.perf_counter()
+        try:
+            paid = self.dispenser.dispense(remaining)
+            error = None
+        except DispenserError as e:
+            paid = e.dispensed
+            error = str(e)
+        elapsed = time.perf_counter() - started
+
+        coins_paid = payout['coins_paid'] + paid
+        if error is None:
+            status = 'done'
+        else:
+            status = 'pending' if attempts < self.max_attempts else 'failed'
+        with self._lock:
+            self._stats['coins_paid'] += paid
+            self._stats['dispense_time'] += elapsed
+            self._stats[{'done': 'done', 'pending': 'retried', 'failed': 'failed'}[status]] += 1
+        # บันทึกทันทีหลังจ่าย ถ้าบันทึกไม่สำเร็จ งานยังค้างเป็น dispensing (การ claim ครั้งถัดไปใช้ token ใหม่
+        # จึงไม่หยิบงานนี้ไปจ่ายซ้ำ) และเก็บผลไว้ในหน่วยความจำเพื่อลองบันทึกใหม่อย่างเดียว ไม่สั่งจ่ายอีก
+        # ถ้า process หยุดก่อนบันทึกได้ fail_stale จะตั้งงานเป็น failed ให้ผู้ดูแลตรวจสอบ
+        self._record(payout, coins_paid, attempts, status, error)
+
+    def _record(self, payout, coins_paid, attempts, status, error):
+        try:
+            self._transaction(PayoutLedger.record, payout['payout_id'], coins_paid, attempts, status, error)
+        except Exception as e:
+            print(f"Coin dispenser: payout {payout['payout_id']} paid {coins_paid} coin(s) but was not recorded "
+                  f"(will retry the record only): {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            self._unrecorded.append((payout, coins_paid, attempts, status, error))
+            return False
+        if self.after_record:
+            self.after_record(payout, status, coins_paid, error)
+        return True
+
+    def _retry_records(self):
+        """Retries recording payouts that were dispensed but whose record() failed; never dispenses again."""
+        unrecorded, self._unrecorded = self._unrecorded, []
+        for i, result in enumerate(unrecorded):
+            if not self._record(*result):
+                self._unrecorded.extend(unrecorded[i + 1:])
+                break
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['dispense_time'] = round(stats['dispense_time'], 3)
+        stats['running'] = bool(self._thread and self._thread.is_alive())
+        stats['unrecorded'] = len(self._unrecorded)
+        return stats
+
+
+def create_dispense_worker(connect, dispenser=COIN_DISPENSER, store_id=COIN_DISPENSER_STORE_ID, after_record=None):
+    """Started worker for COIN_DISPENSER, or None when coin payouts are disabled."""
+    if not dispenser:
+        return None
+    if dispenser != 'simulated':
+        raise ValueError(f"Unknown COIN_DISPENSER: {dispenser}")
+    return DispenseWorker(connect, SimulatedDispenser(), store_id=int(store_id) if store_id else None,
+                          after_record=after_record).start()
+
+
+# --- Benchmark ---
+def bench(payouts=500, latency_ms=5.0, fault_rate=0.01):
+    """
+    Queues `payouts` payouts in the bench schema and drains them with the
+    simulated dispenser, then checks the ledger: every coin owed by a payout
+    marked done must have been paid exactly once.
+    """
+    import mysql.connector
+    from db_migrations import BENCH_DATABASE, _m010_payout_ledger
+    from db_pool import DB_CONFIG
+
+    config = dict(DB_CONFIG, database=BENCH_DATABASE)
+    setup = mysql.connector.connect(**{k: v for k, v in DB_CONFIG.items() if k != 'database'})
+    cursor = setup.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{BENCH_DATABASE}`")
+    cursor.execute(f"USE `{BENCH_DATABASE}`")
+    cursor.execute("DROP TABLE IF EXISTS tbl_payout")
+    _m010_payout_ledger(cursor)
+    setup.commit()
+
+    rnd = random.Random(42)
+    started = time.perf_counter()
+    for i in range(payouts):
+        PayoutLedger.enqueue(cursor, 1, i + 1, 'bench@example.com', rnd.randint(1, 3))
+        setup.commit()
+    enqueue_ms = (time.perf_counter() - started) / payouts * 1000
+
+    dispenser = SimulatedDispenser(latency=latency_ms / 1000, fault_rate=fault_rate, seed=7)
+    worker = DispenseWorker(lambda: mysql.connector.connect(**config), dispenser, poll_interval=0.2)
+    started = time.perf_counter()
+    worker.start()
+    while True:
+        setup.commit()  # snapshot ใหม่
+        totals = PayoutLedger.summary(cursor)
+        if not totals.get('pending') and not totals.get('dispensing'):
+            break
+        time.sleep(0.2)
+    elapsed = time.perf_counter() - started
+    worker.stop()
+
+    done = totals.get('done', {'payouts': 0, 'coins': 0, 'coins_paid': 0})
+    failed = totals.get('failed', {'payouts': 0, 'coins': 0, 'coins_paid': 0})
+    paid = done['coins_paid'] + failed['coins_paid']
+    print(f"enqueue (request side): {enqueue_ms:.2f} ms per payout")
+    print(f"{payouts} payouts in {elapsed:.1f}s ({payouts / elapsed:.1f} payouts/s, {paid / elapsed:.1f} coins/s), "
+          f"done={done['payouts']} failed={failed['payouts']} retried={worker.stats()['retried']}")
+    ok = done['coins'] == done['coins_paid'] and paid == dispenser.dispensed
+    print("OK" if ok else f"FAILED: ledger paid {paid} coin(s), dispenser paid {dispenser.dispensed}")
+    cursor.close()
+    setup.close()
+    return ok
+
+
+def _status():
+    import mysql.connector
+    from db_pool import DB_CONFIG
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    try:
+        for status, totals in sorted(PayoutLedger.summary(cursor).items()):
+            print(f"{status:<12}{totals['payouts']:>8} payout(s){totals['coins']:>10} coin(s) owed{totals['coins_paid']:>10} paid")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if command == 'bench':
+        args = sys.argv[2:5]
+        sys.exit(0 if bench(int(args[0]) if args else 500, *(float(a) for a in args[1:])) else 1)
+    elif command == 'status':
+        _status()
+    else:
+        print("Usage: python coin_dispenser.py bench [payouts] [latency_ms] [fault_rate] | status")
+        sys.exit(1)
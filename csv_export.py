@@ -0,0 +1,150 @@
+# Streaming CSV Export
+# Project Bin - ส่งออก CSV แบบ streaming ใช้หน่วยความจำคงที่ไม่ว่าข้อมูลจะมีกี่แถว
+#
+# ใช้ cursor แบบ unbuffered (แถวถูกอ่านจาก socket ตอน fetch) และดึงทีละ EXPORT_CHUNK_SIZE แถว
+# แต่ละช่วงถูกเขียนเป็น CSV แล้วส่งให้ client ทันที ไม่มีการเก็บผลลัพธ์ทั้งหมดไว้ในหน่วยความจำ
+# การ export ใช้การเชื่อมต่อแยกของตัวเอง (ไม่ยืมจาก pool) เพราะอาจใช้เวลานานตามความเร็วของ client
+# cursor ถูกห่อด้วย cursor_wrapper เดียวกับของ pool (แอปส่ง wrap_cursor) เวลา query/fetch จึงถูกนับใน metrics และ profiler
+#
+# การใช้งาน:
+#   python csv_export.py bench [rows]    เทียบ peak RSS ระหว่างแบบเดิม (fetchall + StringIO) กับแบบ streaming
+
+import csv
+import os
+import subprocess
+import sys
+from io import StringIO
+
+import mysql.connector
+
+from db_pool import DB_CONFIG
+
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '1000'))
+
+
+def export_connection():
+    """Dedicated connection for one export; the stream closes it when it ends."""
+    return mysql.connector.connect(**DB_CONFIG)
+
+
+class CsvExport:
+    """Turns a query into a generator of CSV text chunks."""
+
+    @staticmethod
+    def stream(query, params=(), header=None, connect=export_connection, chunk_size=EXPORT_CHUNK_SIZE,
+               cursor_wrapper=None):
+        """
+        Yields the CSV header first (after the query has started, so SQL errors
+        surface on the first next()) and then one chunk of text per
+        `chunk_size` rows. Without `header` the column names are used.
+        `cursor_wrapper(cursor)`, when given, wraps the export's cursor (as
+        ConnectionPool.cursor_wrapper does).
+        """
+        conn = connect()
+        cursor = None
+        finished = False
+        try:
+            cursor = conn.cursor()
+            if cursor_wrapper:
+                cursor = cursor_wrapper(cursor)
+            cursor.execute(query, tuple(params))
+            buffer = StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(header or [column[0] for column in cursor.description])
+            yield buffer.getvalue()
+
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                buffer.seek(0)
+                buffer.truncate(0)
+                writer.writerows(rows)
+                yield buffer.getvalue()
+            finished = True
+        finally:
+            # ถ้า client ยกเลิกกลางทาง ยังมีแถวค้างอยู่ใน socket: ปิดการเชื่อมต่อทิ้งแทนการอ่านให้หมด
+            try:
+                if finished and cursor is not None:
+                    cursor.close()
+            finally:
+                conn.close()
+
+
+# --- Benchmark ---
+_BENCH_QUERY = """
+    SELECT o.id, o.order_id, o.products_id, o.products_name, o.quantity, o.disquantity, o.email,
+           o.order_date, o.barcode_id, p.category_id, o.price_per_unit AS price, o.store_id
+    FROM tbl_order o
+    LEFT JOIN tbl_products p ON o.products_id = p.products_id
+    ORDER BY o.order_date DESC
+    LIMIT %s
+"""
+
+
+def _measure(mode, rows):
+    """Runs one export in this process and prints the peak RSS in MB."""
+    import resource
+    from db_migrations import BENCH_DATABASE
+
+    config = dict(DB_CONFIG, database=BENCH_DATABASE)
+    connect = lambda: mysql.connector.connect(**config)
+    size = 0
+    if mode == 'buffered':
+        # แบบเดิมของ export_orders_csv(): fetchall() ทั้งหมดแล้วเขียนลง StringIO ก้อนเดียว
+        conn = connect()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(_BENCH_QUERY, (rows,))
+        orders = cursor.fetchall()
+        si = StringIO()
+        cw = csv.writer(si)
+        if orders:
+            cw.writerow(orders[0].keys())
+        for order in orders:
+            cw.writerow(order.values())
+        size = len(si.getvalue())
+        cursor.close()
+        conn.close()
+    else:
+        for chunk in CsvExport.stream(_BENCH_QUERY, (rows,), connect=connect):
+            size += len(chunk)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{peak_kb / 1024:.1f} {size}")
+
+
+def bench(rows=500000):
+    """
+    Seeds the throw-away `<database>_bench` schema and exports growing slices of
+    it in fresh processes, printing the peak RSS of the buffered and streaming
+    implementations side by side.
+    """
+    from db_migrations import BENCH_DATABASE, _seed_bench_database
+
+    config = {k: v for k, v in DB_CONFIG.items() if k != 'database'}
+    conn = mysql.connector.connect(**config)
+    try:
+        print(f"Seeding {rows} orders into {BENCH_DATABASE} ...")
+        _seed_bench_database(conn, rows)
+    finally:
+        conn.close()
+
+    print(f"{'rows':>10}{'CSV (MB)':>12}{'buffered RSS (MB)':>20}{'streaming RSS (MB)':>21}")
+    for limit in (rows // 8, rows // 4, rows // 2, rows):
+        results = {}
+        for mode in ('buffered', 'streaming'):
+            output = subprocess.run([sys.executable, __file__, '_measure', mode, str(limit)],
+                                    check=True, capture_output=True, text=True).stdout.split()
+            results[mode] = (float(output[0]), int(output[1]))
+        print(f"{limit:>10}{results['streaming'][1] / 1048576:>12.1f}"
+              f"{results['buffered'][0]:>20.1f}{results['streaming'][0]:>21.1f}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if command == 'bench':
+        bench(int(sys.argv[2]) if len(sys.argv) > 2 else 500000)
+    elif command == '_measure':
+        _measure(sys.argv[2], int(sys.argv[3]))
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
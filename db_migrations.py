@@ -0,0 +1,420 @@
+# Schema Migrations
+# Project Bin - ระบบปรับปรุงโครงสร้างฐานข้อมูลแบบมีเวอร์ชัน
+#
+# การใช้งาน:
+#   python db_migrations.py status            แสดงเวอร์ชันที่ติดตั้งแล้ว/ยังไม่ติดตั้ง
+#   python db_migrations.py upgrade           ติดตั้ง migration ที่ยังไม่ได้ติดตั้งทั้งหมด
+#   python db_migrations.py bench [rows]      วัดเวลา query ก่อน/หลังเพิ่ม index บนฐานข้อมูลทดสอบแยกต่างหาก
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+from bin_counters import BinCounters
+from db_pool import DB_CONFIG
+
+SCHEMA_VERSION_TABLE = 'schema_version'
+
+
+# --- Helpers (ทุก migration ต้องรันซ้ำได้โดยไม่เกิดข้อผิดพลาด) ---
+def index_exists(cursor, table, columns):
+    """
+    Returns True if `table` already has an index whose leading columns are exactly
+    `columns` (in order), regardless of the index name. This also catches the
+    unique keys that some installations created by hand.
+    """
+    cursor.execute("""
+        SELECT index_name, seq_in_index, column_name
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+        ORDER BY index_name, seq_in_index
+    """, (table,))
+    indexes = {}
+    for index_name, _, column_name in cursor.fetchall():
+        indexes.setdefault(index_name, []).append(column_name.lower())
+    wanted = [c.lower() for c in columns]
+    return any(cols[:len(wanted)] == wanted for cols in indexes.values())
+
+
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def add_index(cursor, table, index_name, columns):
+    if index_exists(cursor, table, columns):
+        return
+    column_list = ', '.join(f'`{c}`' for c in columns)
+    cursor.execute(f"ALTER TABLE `{table}` ADD INDEX `{index_name}` ({column_list})")
+
+
+# --- Migrations ---
+# แต่ละรายการคือ (version, description, function(cursor)) เรียงตาม version
+# ห้ามแก้ไข migration ที่ปล่อยออกไปแล้ว ให้เพิ่มรายการใหม่ต่อท้ายแทน
+
+def _m001_order_store_order_email(cursor):
+    # cart, complete_order: WHERE o.order_id = %s AND o.store_id = %s AND o.email = %s
+    add_index(cursor, 'tbl_order', 'idx_order_store_order_email', ['store_id', 'order_id', 'email'])
+
+
+def _m002_order_store_barcode(cursor):
+    # bin, add_disquantity: WHERE o.barcode_id = %s AND o.store_id = %s
+    add_index(cursor, 'tbl_order', 'idx_order_store_barcode', ['store_id', 'barcode_id'])
+
+
+def _m003_order_store_date(cursor):
+    # export_orders_csv / export_orders_pdf: WHERE o.store_id = %s ORDER BY o.order_date DESC
+    add_index(cursor, 'tbl_order', 'idx_order_store_date', ['store_id', 'order_date'])
+
+
+def _m004_products_barcode_store(cursor):
+    # cart scan: WHERE barcode_id = %s AND (store_id = %s OR store_id IS NULL)
+    add_index(cursor, 'tbl_products', 'idx_products_barcode_store', ['barcode_id', 'store_id'])
+
+
+def _m005_order_sequence(cursor):
+    # ตัวนับเลขที่คำสั่งซื้อของแต่ละร้าน (ดู order_sequence.py) เริ่มต่อจากเลขสูงสุดที่มีอยู่
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `tbl_order_sequence` (
+            `store_id` int(11) NOT NULL,
+            `next_value` bigint(20) NOT NULL,
+            PRIMARY KEY (`store_id`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+    # store_id = 0 ใช้กับผู้ใช้ที่ไม่มีร้าน ซึ่งเดิมนับต่อจากเลขสูงสุดของทุกร้าน
+    cursor.execute("""
+        INSERT IGNORE INTO tbl_order_sequence (store_id, next_value)
+        SELECT 0, GREATEST(IFNULL(MAX(CAST(order_id AS UNSIGNED)), 0), 100000)
+        FROM tbl_order WHERE order_id REGEXP '^[0-9]+$'
+    """)
+    cursor.execute("""
+        INSERT IGNORE INTO tbl_order_sequence (store_id, next_value)
+        SELECT store_id, GREATEST(MAX(CAST(order_id AS UNSIGNED)), 100000)
+        FROM tbl_order WHERE order_id REGEXP '^[0-9]+$' AND store_id IS NOT NULL
+        GROUP BY store_id
+    """)
+
+
+def _m006_bin_counter(cursor):
+    # ตัวนับบรรจุภัณฑ์ที่ทิ้งแล้วต่อ (ร้านค้า, หมวดหมู่) แทนการ COUNT(*) JOIN ทุกครั้ง (ดู bin_counters.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `tbl_bin_counter` (
+            `store_id` int(11) NOT NULL,
+            `category_id` int(11) NOT NULL,
+            `disposed_units` bigint(20) NOT NULL DEFAULT 0,
+            PRIMARY KEY (`store_id`, `category_id`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+    BinCounters.rebuild(cursor)
+
+
+def _m007_catalog_versioning(cursor):
+    # เวอร์ชันแคตตาล็อกสินค้าต่อร้าน (ดู catalog.py)
+    if not column_exists(cursor, 'tbl_products', 'updated_at'):
+        cursor.execute("""
+            ALTER TABLE `tbl_products`
+            ADD COLUMN `updated_at` timestamp(6) NOT NULL DEFAULT current_timestamp(6) ON UPDATE current_timestamp(6)
+        """)
+    add_index(cursor, 'tbl_products', 'idx_products_store_updated', ['store_id', 'updated_at'])
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `tbl_catalog_tombstone` (
+            `products_id` varchar(255) NOT NULL,
+            `store_id` int(11) DEFAULT NULL,
+            `deleted_at` timestamp(6) NOT NULL DEFAULT current_timestamp(6),
+            PRIMARY KEY (`products_id`),
+            KEY `idx_tombstone_store_deleted` (`store_id`, `deleted_at`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+
+
+def _m008_session_store(cursor):
+    # session ฝั่งเซิร์ฟเวอร์สำหรับ SESSION_BACKEND=mysql (ดู server_session.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `tbl_session` (
+            `session_id` char(43) NOT NULL,
+            `data` mediumblob NOT NULL,
+            `expires_at` double NOT NULL,
+            PRIMARY KEY (`session_id`),
+            KEY `idx_session_expires` (`expires_at`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+
+
+def _m009_order_updated_at(cursor):
+    # watermark ของแคชรายงาน PDF: การแก้ไขแถว tbl_order ต้องเปลี่ยน MAX(updated_at) (ดู report_cache.py)
+    if not column_exists(cursor, 'tbl_order', 'updated_at'):
+        cursor.execute("""
+            ALTER TABLE `tbl_order`
+            ADD COLUMN `updated_at` timestamp(6) NOT NULL DEFAULT current_timestamp(6) ON UPDATE current_timestamp(6)
+        """)
+    add_index(cursor, 'tbl_order', 'idx_order_store_updated', ['store_id', 'updated_at'])
+
+
+def _m010_payout_ledger(cursor):
+    # คิวและบัญชีการจ่ายเหรียญคืนบรรจุภัณฑ์ (ดู coin_dispenser.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `tbl_payout` (
+            `payout_id` bigint(20) NOT NULL AUTO_INCREMENT,
+            `store_id` int(11) DEFAULT NULL,
+            `order_line_id` int(11) DEFAULT NULL,
+            `email` varchar(255) DEFAULT NULL,
+            `coins` int(11) NOT NULL,
+            `coins_paid` int(11) NOT NULL DEFAULT 0,
+            `status` enum('pending','dispensing','done','failed') NOT NULL DEFAULT 'pending',
+            `attempts` int(11) NOT NULL DEFAULT 0,
+            `claimed_by` char(32) DEFAULT NULL,
+            `claimed_at` timestamp NULL DEFAULT NULL,
+            `error` varchar(255) DEFAULT NULL,
+            `created_at` timestamp NOT NULL DEFAULT current_timestamp(),
+            `completed_at` timestamp NULL DEFAULT NULL,
+            PRIMARY KEY (`payout_id`),
+            KEY `idx_payout_status_store` (`status`, `store_id`, `payout_id`),
+            KEY `idx_payout_claim` (`claimed_by`, `status`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+
+
+def _m011_sync_applied(cursor):
+    # รายการจาก journal ของตู้ที่นำเข้าแล้ว ใช้กันการนำเข้าซ้ำ (ดู offline_journal.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `tbl_sync_applied` (
+            `entry_id` char(32) NOT NULL,
+            `kiosk_id` varchar(64) NOT NULL,
+            `kind` varchar(32) NOT NULL,
+            `status` enum('applied','conflict') NOT NULL DEFAULT 'applied',
+            `error` varchar(255) DEFAULT NULL,
+            `applied_at` timestamp NOT NULL DEFAULT current_timestamp(),
+            PRIMARY KEY (`entry_id`),
+            KEY `idx_sync_kiosk_status` (`kiosk_id`, `status`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+
+
+MIGRATIONS = [
+    (1, 'tbl_order index (store_id, order_id, email)', _m001_order_store_order_email),
+    (2, 'tbl_order index (store_id, barcode_id)', _m002_order_store_barcode),
+    (3, 'tbl_order index (store_id, order_date)', _m003_order_store_date),
+    (4, 'tbl_products index (barcode_id, store_id)', _m004_products_barcode_store),
+    (5, 'tbl_order_sequence per-store order number counter', _m005_order_sequence),
+    (6, 'tbl_bin_counter per-(store, category) disposal counters', _m006_bin_counter),
+    (7, 'tbl_products.updated_at and tbl_catalog_tombstone for catalog sync', _m007_catalog_versioning),
+    (8, 'tbl_session server-side session store', _m008_session_store),
+    (9, 'tbl_order.updated_at for report cache watermarks', _m009_order_updated_at),
+    (10, 'tbl_payout coin dispenser queue and payout ledger', _m010_payout_ledger),
+    (11, 'tbl_sync_applied offline kiosk journal replay log', _m011_sync_applied),
+]
+
+
+# --- Runner ---
+def ensure_version_table(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS `{SCHEMA_VERSION_TABLE}` (
+            `version` int(11) NOT NULL,
+            `description` varchar(255) NOT NULL,
+            `applied_at` timestamp NOT NULL DEFAULT current_timestamp(),
+            PRIMARY KEY (`version`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+
+
+def applied_versions(cursor):
+    ensure_version_table(cursor)
+    cursor.execute(f"SELECT version FROM `{SCHEMA_VERSION_TABLE}`")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def pending_migrations(cursor):
+    done = applied_versions(cursor)
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+
+def upgrade(conn, verbose=True):
+    """
+    Applies every pending migration in version order and records each one in
+    schema_version. DDL in MySQL commits implicitly, so each migration is made
+    idempotent instead of relying on a transaction.
+    Returns the list of versions that were applied.
+    """
+    cursor = conn.cursor()
+    applied = []
+    try:
+        for version, description, migrate in pending_migrations(cursor):
+            if verbose:
+                print(f"Applying migration {version:03d}: {description}")
+            migrate(cursor)
+            cursor.execute(f"INSERT INTO `{SCHEMA_VERSION_TABLE}` (version, description) VALUES (%s, %s)",
+                           (version, description))
+            conn.commit()
+            applied.append(version)
+    finally:
+        cursor.close()
+    return applied
+
+
+def status(conn):
+    cursor = conn.cursor()
+    try:
+        done = applied_versions(cursor)
+    finally:
+        cursor.close()
+    for version, description, _ in MIGRATIONS:
+        mark = 'x' if version in done else ' '
+        print(f"[{mark}] {version:03d} {description}")
+
+
+# --- Benchmark ---
+BENCH_DATABASE = DB_CONFIG['database'] + '_bench'
+
+BENCH_QUERIES = [
+    ('cart items', "SELECT * FROM tbl_order WHERE order_id = %s AND store_id = %s AND email = %s",
+     lambda r: (str(r.randint(100001, 100000 + r.randint(1, 5000))), r.randint(1, 10), f"user{r.randint(1, 500)}@example.com")),
+    ('bin lookup', "SELECT * FROM tbl_order WHERE barcode_id = %s AND store_id = %s",
+     lambda r: (str(r.randint(1, 50000)).zfill(13), r.randint(1, 10))),
+    ('export page', "SELECT * FROM tbl_order WHERE store_id = %s ORDER BY order_date DESC LIMIT 100",
+     lambda r: (r.randint(1, 10),)),
+    ('scan product', "SELECT * FROM tbl_products WHERE barcode_id = %s AND (store_id = %s OR store_id IS NULL)",
+     lambda r: (str(r.randint(1, 5000)).zfill(13), r.randint(1, 10))),
+]
+
+
+def _seed_bench_database(conn, rows):
+    cursor = conn.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{BENCH_DATABASE}`")
+    cursor.execute(f"CREATE DATABASE `{BENCH_DATABASE}`")
+    cursor.execute(f"USE `{BENCH_DATABASE}`")
+    # โครงสร้างเดียวกับ project_bin.sql แต่มีเพียง primary key
+    cursor.execute("""
+        CREATE TABLE tbl_order (
+            id int(11) NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            order_id varchar(255) NOT NULL,
+            products_id varchar(255) DEFAULT NULL,
+            products_name varchar(255) NOT NULL,
+            quantity int(11) NOT NULL,
+            disquantity int(11) NOT NULL DEFAULT 0,
+            email varchar(255) DEFAULT NULL,
+            order_date timestamp NOT NULL DEFAULT current_timestamp(),
+            barcode_id varchar(255) DEFAULT NULL,
+            store_id int(11) DEFAULT NULL,
+            price_per_unit decimal(10,2) DEFAULT NULL
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute("""
+        CREATE TABLE tbl_products (
+            products_id int(11) NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            products_name varchar(255) NOT NULL,
+            price decimal(10,2) NOT NULL,
+            stock_quantity int(11) NOT NULL,
+            category_id int(11) DEFAULT NULL,
+            barcode_id varchar(255) DEFAULT NULL,
+            store_id int(11) DEFAULT NULL
+        ) ENGINE=InnoDB
+    """)
+    # tbl_category/tbl_bin ใช้โดย _m006_bin_counter (BinCounters.rebuild) หมวดหมู่ 1-5 ต่อร้าน 1-10
+    cursor.execute("""
+        CREATE TABLE tbl_category (
+            id int(11) NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            category_id int(11) NOT NULL,
+            category_name varchar(255) NOT NULL,
+            store_id int(11) DEFAULT NULL
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute("""
+        CREATE TABLE tbl_bin (
+            id int(11) NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            category_id int(11) NOT NULL,
+            store_id int(11) DEFAULT NULL,
+            value int(11) DEFAULT 0
+        ) ENGINE=InnoDB
+    """)
+    cursor.executemany("INSERT INTO tbl_category (category_id, category_name, store_id) VALUES (%s, %s, %s)",
+                       [(category_id, f"Category {category_id}", store_id)
+                        for store_id in range(1, 11) for category_id in range(1, 6)])
+    cursor.executemany("INSERT INTO tbl_bin (category_id, store_id, value) VALUES (%s, %s, 0)",
+                       [(category_id, store_id) for store_id in range(1, 11) for category_id in range(1, 6)])
+    rnd = random.Random(42)
+    cursor.executemany(
+        "INSERT INTO tbl_products (products_name, price, stock_quantity, category_id, barcode_id, store_id) VALUES (%s, %s, %s, %s, %s, %s)",
+        [(f"Product {i}", 10, 1000, rnd.randint(1, 5), str(i).zfill(13), (i % 10) + 1) for i in range(1, 5001)])
+    start_date = datetime.now() - timedelta(days=365)
+    batch = []
+    for i in range(rows):
+        batch.append((str(100001 + i // 5), str(rnd.randint(1, 5000)), 'Product', rnd.randint(1, 5), 0,
+                      f"user{rnd.randint(1, 500)}@example.com", start_date + timedelta(seconds=i * 30),
+                      str(rnd.randint(1, 50000)).zfill(13), rnd.randint(1, 10), 10))
+        if len(batch) == 5000:
+            cursor.executemany("""
+                INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, order_date, barcode_id, store_id, price_per_unit)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, batch)
+            batch = []
+    if batch:
+        cursor.executemany("""
+            INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, order_date, barcode_id, store_id, price_per_unit)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, batch)
+    conn.commit()
+    cursor.execute("ANALYZE TABLE tbl_order, tbl_products")
+    cursor.fetchall()
+    cursor.close()
+
+
+def _time_queries(conn, iterations):
+    cursor = conn.cursor()
+    results = {}
+    for name, sql, make_params in BENCH_QUERIES:
+        rnd = random.Random(7)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            cursor.execute(sql, make_params(rnd))
+            cursor.fetchall()
+        results[name] = (time.perf_counter() - started) / iterations * 1000
+    cursor.close()
+    return results
+
+
+def bench(rows=200000, iterations=50):
+    """
+    Seeds a throw-away `<database>_bench` schema with `rows` orders, times the
+    hot-path queries, applies the migrations and times them again.
+    The application database is never touched.
+    """
+    config = {k: v for k, v in DB_CONFIG.items() if k != 'database'}
+    conn = mysql.connector.connect(**config)
+    try:
+        print(f"Seeding {rows} orders into {BENCH_DATABASE} ...")
+        _seed_bench_database(conn, rows)
+        before = _time_queries(conn, iterations)
+        upgrade(conn, verbose=False)
+        after = _time_queries(conn, iterations)
+        print(f"{'query':<14}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+        for name, _, _ in BENCH_QUERIES:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            print(f"{name:<14}{before[name]:>14.3f}{after[name]:>14.3f}{speedup:>9.1f}x")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if command == 'bench':
+        bench(int(sys.argv[2]) if len(sys.argv) > 2 else 200000)
+        sys.exit(0)
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        if command == 'upgrade':
+            applied = upgrade(conn)
+            print(f"Applied {len(applied)} migration(s).")
+        elif command == 'status':
+            status(conn)
+        else:
+            print(f"Unknown command: {command}")
+            sys.exit(1)
+    finally:
+        conn.close()
@@ -0,0 +1,191 @@
+# Database Connection Pool
+# Project Bin - ระบบ pool การเชื่อมต่อฐานข้อมูล (ยืมหนึ่งการเชื่อมต่อต่อหนึ่ง request)
+
+import os
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import pooling
+from flask import g, has_app_context
+
+# ค่าตั้งต้นเหมือนเดิม แต่สามารถกำหนดผ่าน environment ได้
+DB_CONFIG = {
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASSWORD', ''),
+    'database': os.environ.get('DB_NAME', 'project2'),
+}
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+# งานเบื้องหลังและงานนอก request (เลขคำสั่งซื้อ, เครื่องจ่ายเหรียญ, offline sync) ใช้ pool แยกขนาดนี้
+# เพื่อไม่แย่ง slot ของ request (request ที่ถือการเชื่อมต่ออยู่แล้วขอเพิ่มอีกตัวอาจรอกันเองจนหมดเวลา)
+DB_BACKGROUND_POOL_SIZE = int(os.environ.get('DB_BACKGROUND_POOL_SIZE', '2'))
+# SESSION_BACKEND=mysql: session ถูกบันทึกตอนท้าย request ขณะที่ request ยังถือการเชื่อมต่อของตัวเองอยู่ จึงใช้ pool แยก
+DB_SESSION_POOL_SIZE = int(os.environ.get('DB_SESSION_POOL_SIZE', str(DB_POOL_SIZE)))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') != '0'
+
+
+class PooledConnection:
+    """
+    Thin proxy around a connection borrowed from ConnectionPool.
+    Every attribute is forwarded to the real connection; only close() differs:
+    a request-scoped connection is released at app-context teardown, so the
+    existing `finally: conn.close()` blocks in the routes become no-ops.
+    cursor() passes new cursors through the pool's cursor_wrapper, if any.
+    """
+
+    def __init__(self, pool, conn, request_scoped=False):
+        self._pool = pool
+        self._conn = conn
+        self._request_scoped = request_scoped
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._conn.cursor(*args, **kwargs)
+        wrapper = self._pool.cursor_wrapper
+        return wrapper(cursor) if wrapper else cursor
+
+    def close(self):
+        if self._request_scoped:
+            return
+        self._pool.release(self)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of MySQL connections built on mysql.connector.pooling.
+    Callers that find the pool exhausted wait (up to `timeout` seconds) instead
+    of failing immediately, and every wait is recorded in the statistics.
+    `cursor_wrapper(cursor)`, when given, wraps every cursor of a borrowed
+    connection (used for query metrics).
+    """
+
+    def __init__(self, pool_size=DB_POOL_SIZE, pool_name='project_bin', timeout=DB_POOL_TIMEOUT,
+                 pre_ping=DB_POOL_PRE_PING, cursor_wrapper=None, **db_config):
+        self.pool_size = pool_size
+        self.cursor_wrapper = cursor_wrapper
+        self.pool_name = pool_name
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self.db_config = db_config or dict(DB_CONFIG)
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._stats = {
+            'in_use': 0,
+            'max_in_use': 0,
+            'acquired': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'stale_reconnects': 0,
+            'errors': 0,
+        }
+
+    def _get_pool(self):
+        # สร้าง pool เมื่อใช้งานครั้งแรก เพื่อให้ import app ได้แม้ฐานข้อมูลยังไม่พร้อม
+        with self._lock:
+            if self._pool is None:
+                self._pool = pooling.MySQLConnectionPool(pool_name=self.pool_name,
+                                                         pool_size=self.pool_size,
+                                                         pool_reset_session=True,
+                                                         **self.db_config)
+            return self._pool
+
+    def acquire(self, request_scoped=False):
+        """
+        Borrows a connection from the pool, waiting for a free slot if necessary.
+        Raises mysql.connector.errors.PoolError when no slot frees up in time.
+        """
+        if not self._slots.acquire(blocking=False):
+            started = time.perf_counter()
+            got_slot = self._slots.acquire(timeout=self.timeout)
+            waited = time.perf_counter() - started
+            with self._lock:
+                self._stats['waits'] += 1
+                self._stats['wait_time_total'] += waited
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+                if not got_slot:
+                    self._stats['timeouts'] += 1
+            if not got_slot:
+                raise mysql.connector.errors.PoolError(
+                    f"No connection available in pool '{self.pool_name}' after {self.timeout}s")
+
+        try:
+            conn = self._get_pool().get_connection()
+            if self.pre_ping and not self._ping(conn):
+                with self._lock:
+                    self._stats['stale_reconnects'] += 1
+        except Exception:
+            with self._lock:
+                self._stats['errors'] += 1
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['in_use'] += 1
+            self._stats['max_in_use'] = max(self._stats['max_in_use'], self._stats['in_use'])
+        return PooledConnection(self, conn, request_scoped=request_scoped)
+
+    @staticmethod
+    def _ping(conn):
+        """Returns False if the connection had gone stale and was re-established."""
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            conn.ping(reconnect=True, attempts=2, delay=0)
+            return False
+
+    def release(self, pooled):
+        """Returns a borrowed connection to the pool, rolling back any open transaction."""
+        conn = pooled._conn
+        if conn is None:
+            return
+        pooled._conn = None
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except mysql.connector.Error:
+            pass
+        finally:
+            try:
+                conn.close()
+            finally:
+                with self._lock:
+                    self._stats['in_use'] -= 1
+                self._slots.release()
+
+    def request_connection(self):
+        """
+        Returns the connection lent to the current Flask request, borrowing one on
+        first use. Outside an app context a standalone connection is returned and
+        the caller must close() it.
+        """
+        if not has_app_context():
+            return self.acquire()
+        if 'db_conn' not in g:
+            g.db_conn = self.acquire(request_scoped=True)
+        return g.db_conn
+
+    def teardown(self, exc=None):
+        pooled = g.pop('db_conn', None)
+        if pooled is not None:
+            self.release(pooled)
+
+    def init_app(self, app):
+        app.teardown_appcontext(self.teardown)
+
+    def stats(self):
+        """Snapshot of pool statistics for ops dashboards."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pool_size'] = self.pool_size
+        stats['available'] = self.pool_size - stats['in_use']
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['waits'] if stats['waits'] else 0.0
+        return stats
@@ -0,0 +1,199 @@
+# EAN-13 Encoder
+# Project Bin - สร้างบาร์โค้ด EAN-13 ที่เครื่องสแกนอ่านได้จริง (SVG และ PNG)
+#
+# ตารางรูปแบบ L/G/R ของแต่ละหลักถูกคำนวณไว้ล่วงหน้า การเข้ารหัสจึงเป็นเพียงการต่อสตริงของ module
+# (95 module: guard 3 + ซ้าย 6 หลัก x 7 + guard กลาง 5 + ขวา 6 หลัก x 7 + guard 3)
+# หลักแรกไม่ถูกวาดเป็นแท่ง แต่กำหนดรูปแบบ parity (L/G) ของ 6 หลักฝั่งซ้าย
+#
+# การใช้งาน:
+#   python ean13.py 885000000001            แสดงรหัส 13 หลัก (คำนวณ check digit) และ module
+#   python ean13.py bench                   วัดเวลาเรนเดอร์และขนาดไฟล์
+
+import sys
+from functools import lru_cache
+from io import BytesIO
+
+L_CODES = ('0001101', '0011001', '0010011', '0111101', '0100011',
+           '0110001', '0101111', '0111011', '0110111', '0001011')
+R_CODES = tuple(''.join('1' if bit == '0' else '0' for bit in code) for code in L_CODES)
+G_CODES = tuple(code[::-1] for code in R_CODES)
+PARITY = ('LLLLLL', 'LLGLGG', 'LLGGLG', 'LLGGGL', 'LGLLGG',
+          'LGGLLG', 'LGGGLL', 'LGLGLG', 'LGLGGL', 'LGGLGL')
+_LEFT_CODES = {'L': L_CODES, 'G': G_CODES}
+
+START_GUARD = END_GUARD = '101'
+CENTER_GUARD = '01010'
+MODULE_COUNT = 95
+QUIET_LEFT = 11
+QUIET_RIGHT = 7
+# module ที่เป็น guard (แท่งยาวลงมาในแถวตัวเลข)
+GUARD_MODULES = frozenset(list(range(0, 3)) + list(range(45, 50)) + list(range(92, 95)))
+
+
+def check_digit(digits12):
+    """Check digit for the first 12 digits: weights 1,3,1,3,... from the left."""
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits12))
+    return (10 - total % 10) % 10
+
+
+def normalize(code):
+    """
+    Returns the 13-digit code for `code`. 12 digits get their check digit
+    appended; 13 digits must carry the correct one. Raises ValueError otherwise.
+    """
+    code = str(code).strip()
+    if not code.isdigit() or len(code) not in (12, 13):
+        raise ValueError(f"EAN-13 ต้องเป็นตัวเลข 12 หรือ 13 หลัก: {code!r}")
+    expected = check_digit(code[:12])
+    if len(code) == 12:
+        return code + str(expected)
+    if int(code[12]) != expected:
+        raise ValueError(f"check digit ของ {code} ไม่ถูกต้อง (ควรเป็น {code[:12]}{expected})")
+    return code
+
+
+def is_valid(code):
+    try:
+        normalize(code)
+        return True
+    except ValueError:
+        return False
+
+
+@lru_cache(maxsize=4096)
+def modules(code):
+    """The 95-module bit string of a 13-digit code."""
+    code = normalize(code)
+    parity = PARITY[int(code[0])]
+    left = ''.join(_LEFT_CODES[p][int(d)] for p, d in zip(parity, code[1:7]))
+    right = ''.join(R_CODES[int(d)] for d in code[7:13])
+    return START_GUARD + left + CENTER_GUARD + right + END_GUARD
+
+
+@lru_cache(maxsize=4096)
+def bars(code):
+    """Runs of dark modules as (start_module, width, is_guard) tuples."""
+    bits = modules(code)
+    runs = []
+    start = None
+    for i, bit in enumerate(bits + '0'):
+        if bit == '1' and start is None:
+            start = i
+        elif bit == '0' and start is not None:
+            runs.append((start, i - start, start in GUARD_MODULES))
+            start = None
+    return tuple(runs)
+
+
+def _text_positions(module_width):
+    """x centres (in px, including the quiet zone) of the three digit groups."""
+    first = QUIET_LEFT * module_width / 2
+    left = (QUIET_LEFT + 3 + 21) * module_width
+    right = (QUIET_LEFT + 50 + 21) * module_width
+    return first, left, right
+
+
+def render_svg(code, module_width=2, bar_height=60, text=True):
+    """
+    Compact SVG: the bars are vertical strokes, one path per bar width (1-4
+    modules) using relative moves, plus the human-readable digits.
+    """
+    code = normalize(code)
+    text_height = 12 * module_width // 2 + 4 if text else 0
+    guard_height = bar_height + (text_height // 2 if text else 0)
+    width = (QUIET_LEFT + MODULE_COUNT + QUIET_RIGHT) * module_width
+    height = bar_height + text_height
+    groups = {}  # (stroke width, bar length) -> x centres
+    for start, run, guard in bars(code):
+        x = (QUIET_LEFT + start + run / 2) * module_width
+        groups.setdefault((run * module_width, guard_height if guard else bar_height), []).append(x)
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">',
+             f'<rect width="{width}" height="{height}" fill="#fff"/>']
+    for (stroke, length), xs in sorted(groups.items()):
+        d = f"M{xs[0]:g} 0v{length}" + ''.join(f"m{x - prev:g}-{length}v{length}" for prev, x in zip(xs, xs[1:]))
+        parts.append(f'<path stroke="#000" stroke-width="{stroke}" d="{d}"/>')
+    if text:
+        first, left, right = _text_positions(module_width)
+        parts.append(f'<g font-family="monospace" font-size="{6 * module_width}" text-anchor="middle">'
+                     f'<text x="{first:g}" y="{height - 2}">{code[0]}</text>'
+                     f'<text x="{left:g}" y="{height - 2}">{code[1:7]}</text>'
+                     f'<text x="{right:g}" y="{height - 2}">{code[7:]}</text></g>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def render_png(code, module_width=2, bar_height=60, text=True, font=None):
+    """
+    PNG rasterised from a single pixel row: the module bits are expanded into
+    one 8-bit row buffer which is stretched to the bar height, then the digits
+    are drawn underneath with `font` (a PIL font).
+    """
+    from PIL import Image, ImageDraw
+
+    code = normalize(code)
+    bits = modules(code)
+    dark, light = b'\x00' * module_width, b'\xff' * module_width
+    row = (light * QUIET_LEFT + b''.join(dark if bit == '1' else light for bit in bits) + light * QUIET_RIGHT)
+    width = len(row)
+    text_height = 12 * module_width // 2 + 4 if text else 0
+    image = Image.new('L', (width, bar_height + text_height), 255)
+    image.paste(Image.frombytes('L', (width, 1), row).resize((width, bar_height), Image.NEAREST), (0, 0))
+
+    if text:
+        guard_extra = text_height // 2
+        guard_row = bytearray(b'\xff' * width)
+        for start, run, guard in bars(code):
+            if guard:
+                offset = (QUIET_LEFT + start) * module_width
+                guard_row[offset:offset + run * module_width] = b'\x00' * (run * module_width)
+        image.paste(Image.frombytes('L', (width, 1), bytes(guard_row)).resize((width, guard_extra), Image.NEAREST),
+                    (0, bar_height))
+        draw = ImageDraw.Draw(image)
+        for x, digits in zip(_text_positions(module_width), (code[0], code[1:7], code[7:])):
+            left, top, right, bottom = draw.textbbox((0, 0), digits, font=font)
+            draw.text((x - (right - left) / 2, bar_height + text_height - bottom - 1), digits, fill=0, font=font)
+
+    output = BytesIO()
+    image.save(output, 'PNG', optimize=False)
+    return output.getvalue()
+
+
+def bench(iterations=10000):
+    import time
+
+    codes = [str(885000000000 + i) for i in range(iterations)]
+    started = time.perf_counter()
+    for code in codes:
+        modules(code)
+    encode_us = (time.perf_counter() - started) / iterations * 1e6
+
+    modules.cache_clear()
+    bars.cache_clear()
+    started = time.perf_counter()
+    for code in codes:
+        svg = render_svg(code)
+    svg_us = (time.perf_counter() - started) / iterations * 1e6
+
+    png_iterations = min(iterations, 1000)
+    started = time.perf_counter()
+    for code in codes[:png_iterations]:
+        png = render_png(code, text=False)
+    png_us = (time.perf_counter() - started) / png_iterations * 1e6
+
+    print(f"encode modules : {encode_us:8.1f} us")
+    print(f"render SVG     : {svg_us:8.1f} us  ({len(svg.encode('utf-8'))} bytes)")
+    print(f"render PNG     : {png_us:8.1f} us  ({len(png)} bytes, without digits)")
+
+
+if __name__ == "__main__":
+    argument = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if argument == 'bench':
+        bench()
+    else:
+        try:
+            full_code = normalize(argument)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        print(full_code)
+        print(modules(full_code))
@@ -0,0 +1,196 @@
+# ESC/POS Receipts
+# Project Bin - สร้างใบเสร็จเป็นคำสั่ง ESC/POS สำหรับเครื่องพิมพ์ความร้อน 58 มม. โดยตรง (ไม่ผ่าน HTML/เบราว์เซอร์)
+#
+# - ข้อความพิมพ์ด้วยฟอนต์ของเครื่องพิมพ์ (Font A, 32 ตัวอักษรต่อบรรทัด) เข้ารหัสด้วย code page ภาษาไทย
+# - โลโก้และบาร์โค้ดเป็นภาพ 1 บิต (GS v 0) บาร์โค้ดสร้างจาก module ของ ean13.py โดยตรง ไม่ต้องใช้ PIL
+# - ส่วนหัว (init, code page, โลโก้, ชื่อร้าน) ถูกเข้ารหัสครั้งเดียวแล้วเก็บไว้ ใบเสร็จแต่ละใบจึงต่อเพียงรายการสินค้า
+#
+# ตัวแปร environment:
+#   RECEIPT_LOGO            ไฟล์ภาพโลโก้ (ต้องมี Pillow) ว่าง = ไม่พิมพ์โลโก้
+#   RECEIPT_HEADER          ข้อความส่วนหัว (ขึ้นบรรทัดใหม่ด้วย |)
+#   ESCPOS_ENCODING         codec ของ Python สำหรับข้อความ (ค่าเริ่มต้น cp874)
+#   ESCPOS_CODEPAGE         หมายเลขตาราง ESC t ของเครื่องพิมพ์สำหรับ code page นั้น (ดูคู่มือเครื่องพิมพ์)
+#
+# การใช้งาน:
+#   python escpos_receipt.py sample <file>    เขียนใบเสร็จตัวอย่างเป็นไฟล์ .bin (ส่งเข้าเครื่องพิมพ์ด้วย cat file > /dev/usb/lp0)
+#   python escpos_receipt.py bench [n]        วัดเวลาสร้างใบเสร็จ
+
+import os
+import sys
+import time
+import unicodedata
+from decimal import Decimal
+from functools import lru_cache
+
+import ean13
+
+PAPER_DOTS = 384  # ความกว้างพิมพ์ของกระดาษ 58 มม. (203 dpi)
+LINE_CHARS = 32
+RASTER_BAND_ROWS = 255  # เครื่องพิมพ์ราคาถูกหลายรุ่นรับภาพได้ไม่เกินนี้ต่อคำสั่ง
+BARCODE_MODULE_DOTS = 3
+BARCODE_HEIGHT_DOTS = 80
+
+RECEIPT_LOGO = os.environ.get('RECEIPT_LOGO', '')
+RECEIPT_HEADER = os.environ.get('RECEIPT_HEADER', 'Project Bin')
+ESCPOS_ENCODING = os.environ.get('ESCPOS_ENCODING', 'cp874')
+ESCPOS_CODEPAGE = int(os.environ.get('ESCPOS_CODEPAGE', '21'))
+
+ESC = b'\x1b'
+GS = b'\x1d'
+INIT = ESC + b'@'
+ALIGN_LEFT = ESC + b'a\x00'
+ALIGN_CENTER = ESC + b'a\x01'
+BOLD_ON = ESC + b'E\x01'
+BOLD_OFF = ESC + b'E\x00'
+DOUBLE_ON = GS + b'!\x11'
+DOUBLE_OFF = GS + b'!\x00'
+CUT = GS + b'V\x42\x00'  # feed แล้วตัดกระดาษบางส่วน
+RULE = '-' * LINE_CHARS
+
+
+def text_width(text):
+    """Printed columns of `text`: Thai vowel and tone marks stack on the previous character."""
+    return sum(1 for ch in text if unicodedata.category(ch) != 'Mn')
+
+
+def encode_text(text):
+    return text.encode(ESCPOS_ENCODING, errors='replace')
+
+
+def line(text=''):
+    return encode_text(text) + b'\n'
+
+
+def columns(left, right, width=LINE_CHARS):
+    """One line with `left` left-aligned and `right` right-aligned; `left` is cut to fit."""
+    room = width - text_width(right) - 1
+    kept = []
+    used = 0
+    for ch in left:
+        step = 0 if unicodedata.category(ch) == 'Mn' else 1
+        if used + step > room:
+            break
+        kept.append(ch)
+        used += step
+    left = ''.join(kept)
+    return line(left + ' ' * (width - used - text_width(right)) + right)
+
+
+def raster(rows, width_dots):
+    """
+    GS v 0 commands for a 1-bit image given as packed rows (bytes of
+    ceil(width_dots / 8) each, 1 = black), split into bands of RASTER_BAND_ROWS.
+    """
+    row_bytes = (width_dots + 7) // 8
+    output = bytearray()
+    for start in range(0, len(rows), RASTER_BAND_ROWS):
+        band = rows[start:start + RASTER_BAND_ROWS]
+        output += GS + b'v0\x00' + row_bytes.to_bytes(2, 'little') + len(band).to_bytes(2, 'little')
+        output += b''.join(band)
+    return bytes(output)
+
+
+def barcode_raster(code, module_dots=BARCODE_MODULE_DOTS, height=BARCODE_HEIGHT_DOTS):
+    """EAN-13 bars as a centred full-width raster, built from the module bits without any imaging library."""
+    bits = ''.join(bit * module_dots for bit in ean13.modules(code))
+    pad = (PAPER_DOTS - len(bits)) // 2
+    row = int(('0' * pad + bits).ljust(PAPER_DOTS, '0'), 2).to_bytes(PAPER_DOTS // 8, 'big')
+    return raster([row] * height, PAPER_DOTS)
+
+
+@lru_cache(maxsize=8)
+def logo_raster(path):
+    """The logo scaled to the paper width and dithered to 1 bit. Empty when unset or unreadable."""
+    if not path:
+        return b''
+    try:
+        from PIL import Image
+        image = Image.open(path).convert('L')
+    except (ImportError, OSError) as e:
+        print(f"Warning: receipt logo {path} not loaded: {e}")
+        return b''
+    if image.width > PAPER_DOTS:
+        image = image.resize((PAPER_DOTS, max(1, image.height * PAPER_DOTS // image.width)), Image.LANCZOS)
+    width = (image.width + 7) // 8 * 8
+    canvas = Image.new('L', (width, image.height), 255)
+    canvas.paste(image, (0, 0))
+    # PIL โหมด '1' ใช้บิต 1 = ขาว แต่ ESC/POS ใช้ 1 = ดำ จึงกลับบิต
+    data = bytes(b ^ 0xFF for b in canvas.convert('1').tobytes())
+    row_bytes = width // 8
+    rows = [data[i:i + row_bytes] for i in range(0, len(data), row_bytes)]
+    return ALIGN_CENTER + raster(rows, width) + ALIGN_LEFT
+
+
+@lru_cache(maxsize=8)
+def header_bytes(header=RECEIPT_HEADER, logo=RECEIPT_LOGO):
+    """Printer init, code page, logo and store header, encoded once per process."""
+    parts = [INIT, ESC + b't' + bytes([ESCPOS_CODEPAGE]), logo_raster(logo), ALIGN_CENTER, BOLD_ON, DOUBLE_ON]
+    parts.extend(line(text) for text in header.split('|') if text)
+    parts.extend([DOUBLE_OFF, BOLD_OFF, ALIGN_LEFT])
+    return b''.join(parts)
+
+
+def _money(value):
+    return f"{Decimal(str(value)):,.2f}"
+
+
+def build_receipt(receipt_data, printed_at=None):
+    """
+    ESC/POS bytes for a completed order. `receipt_data` is the dict stored in
+    session['receipt_data'] by cart(): orders, barcode_id, total_quantity,
+    total_price and current_order_id.
+    """
+    parts = [header_bytes(),
+             line(f"Order {receipt_data['current_order_id']}"),
+             line((printed_at or time.strftime('%d/%m/%Y %H:%M'))),
+             line(RULE)]
+    for item in receipt_data['orders']:
+        quantity = item['quantity']
+        price = item.get('price_per_unit', item.get('price'))
+        parts.append(columns(f"{quantity} {item['products_name']}", _money(quantity * Decimal(str(price)))))
+        if quantity > 1:
+            parts.append(line(f"   @{_money(price)}"))
+    parts.extend([line(RULE),
+                  BOLD_ON, columns(f"Total ({receipt_data['total_quantity']})", _money(receipt_data['total_price'])),
+                  BOLD_OFF, b'\n'])
+
+    code = receipt_data.get('barcode_id')
+    if code and ean13.is_valid(code):
+        code = ean13.normalize(code)
+        parts.extend([barcode_raster(code), ALIGN_CENTER, line(code), ALIGN_LEFT])
+    parts.extend([b'\n\n\n', CUT])
+    return b''.join(parts)
+
+
+def _sample_receipt(lines=8):
+    orders = [{'products_name': f'ขวดพลาสติก PET {i}', 'quantity': i % 3 + 1, 'price_per_unit': Decimal('2.50')}
+              for i in range(lines)]
+    return {
+        'orders': orders,
+        'barcode_id': ean13.normalize('885000000001'),
+        'total_quantity': sum(o['quantity'] for o in orders),
+        'total_price': sum(o['quantity'] * o['price_per_unit'] for o in orders),
+        'current_order_id': 100001,
+    }
+
+
+def bench(iterations=2000):
+    receipt = _sample_receipt()
+    header_bytes()  # ไม่นับเวลาเข้ารหัสส่วนหัวครั้งแรก
+    started = time.perf_counter()
+    for _ in range(iterations):
+        data = build_receipt(receipt, printed_at='bench')
+    elapsed = (time.perf_counter() - started) / iterations
+    print(f"build_receipt: {elapsed * 1e6:.0f} us per receipt ({len(data)} bytes, {len(receipt['orders'])} lines)")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if command == 'bench':
+        bench(int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
+    elif command == 'sample' and len(sys.argv) > 2:
+        with open(sys.argv[2], 'wb') as output:
+            output.write(build_receipt(_sample_receipt()))
+    else:
+        print("Usage: python escpos_receipt.py sample <file> | bench [n]")
+        sys.exit(1)
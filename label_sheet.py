@@ -0,0 +1,157 @@
+# Barcode Label Sheets
+# Project Bin - สร้างแผ่นป้ายบาร์โค้ดสินค้าหลายรายการในครั้งเดียว (PDF หลายหน้า หรือ PNG หนึ่งหน้า)
+#
+# ป้ายแต่ละใบ (ชื่อสินค้า ราคา และบาร์โค้ด EAN-13) ถูกเรนเดอร์ขนานกันใน process pool เดียวกับ pdf_render.py
+# แล้วนำมาจัดวางตาม layout:
+#   a4      กระดาษ A4 3 คอลัมน์ x 8 แถว (24 ป้ายต่อหน้า)
+#   roll58  กระดาษม้วน 58 มม. ป้ายละหนึ่งหน้า (58 x 30 มม.) สำหรับเครื่องพิมพ์ความร้อน
+# ชื่อสินค้าภาษาไทยต้องใช้ฟอนต์ที่รองรับภาษาไทย ตั้งค่าด้วย BARCODE_FONT (เช่น THSarabunNew.ttf)
+#
+# การใช้งาน:
+#   python label_sheet.py bench [labels]    วัดเวลาสร้างแผ่นป้าย PDF เทียบจำนวน worker
+
+import os
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+import ean13
+from barcode_images import load_font
+from pdf_render import PDF_RENDER_WORKERS, get_executor
+
+LAYOUTS = {
+    'a4': {'page_mm': (210, 297), 'columns': 3, 'rows': 8, 'margin_mm': 8, 'gap_mm': 2},
+    'roll58': {'page_mm': (58, 30), 'columns': 1, 'rows': 1, 'margin_mm': 2, 'gap_mm': 0},
+}
+LABEL_SHEET_MAX = int(os.environ.get('LABEL_SHEET_MAX', '2000'))
+PARALLEL_MIN_LABELS = 64  # แผ่นเล็กกว่านี้เรนเดอร์ใน process ปัจจุบัน (เร็วกว่าส่งงานข้าม process)
+PNG_DPI = 150
+MM_PER_INCH = 25.4
+
+
+def render_label(label):
+    """
+    Renders one label from (name, price, code) to PNG bytes. Runs in a worker
+    process; fonts and EAN-13 patterns are cached per process.
+    """
+    name, price, code = label
+    barcode = Image.open(BytesIO(ean13.render_png(code, module_width=3, bar_height=90, font=load_font(18))))
+    font = load_font(22)
+    text = f"{name[:28]}  {price}" if price is not None else name[:28]
+    image = Image.new('L', (barcode.width, barcode.height + 32), 255)
+    draw = ImageDraw.Draw(image)
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    draw.text(((barcode.width - (right - left)) / 2, 28 - bottom), text, fill=0, font=font)
+    image.paste(barcode, (0, 32))
+    output = BytesIO()
+    image.save(output, 'PNG')
+    return output.getvalue()
+
+
+def render_labels(labels, workers=PDF_RENDER_WORKERS):
+    """Renders every label, in parallel for large sheets. Order is preserved."""
+    if len(labels) < PARALLEL_MIN_LABELS or workers <= 1:
+        return [render_label(label) for label in labels]
+    chunksize = max(1, len(labels) // (workers * 4))
+    return list(get_executor(workers).map(render_label, labels, chunksize=chunksize))
+
+
+def _cells(layout, unit_per_mm):
+    """Yields (x, y, width, height) of each label cell on a page, top-left origin, row by row."""
+    spec = LAYOUTS[layout]
+    page_w, page_h = spec['page_mm']
+    margin, gap = spec['margin_mm'], spec['gap_mm']
+    cell_w = (page_w - 2 * margin - (spec['columns'] - 1) * gap) / spec['columns']
+    cell_h = (page_h - 2 * margin - (spec['rows'] - 1) * gap) / spec['rows']
+    for row in range(spec['rows']):
+        for column in range(spec['columns']):
+            yield ((margin + column * (cell_w + gap)) * unit_per_mm, (margin + row * (cell_h + gap)) * unit_per_mm,
+                   cell_w * unit_per_mm, cell_h * unit_per_mm)
+
+
+def _fit(image_w, image_h, cell_w, cell_h):
+    scale = min(cell_w / image_w, cell_h / image_h)
+    return image_w * scale, image_h * scale
+
+
+def labels_per_page(layout):
+    return LAYOUTS[layout]['columns'] * LAYOUTS[layout]['rows']
+
+
+def build_pdf(label_pngs, layout='a4'):
+    """Places the rendered labels on as many pages as needed."""
+    from reportlab.lib.units import mm
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    page_w, page_h = LAYOUTS[layout]['page_mm']
+    output = BytesIO()
+    pdf = canvas.Canvas(output, pagesize=(page_w * mm, page_h * mm))
+    cells = list(_cells(layout, mm))
+    for index, png in enumerate(label_pngs):
+        if index and index % len(cells) == 0:
+            pdf.showPage()
+        x, y, cell_w, cell_h = cells[index % len(cells)]
+        image = ImageReader(BytesIO(png))
+        w, h = _fit(*image.getSize(), cell_w, cell_h)
+        # reportlab วัดแกน y จากขอบล่าง
+        pdf.drawImage(image, x + (cell_w - w) / 2, page_h * mm - y - cell_h + (cell_h - h) / 2, w, h)
+    pdf.showPage()
+    pdf.save()
+    return output.getvalue()
+
+
+def build_png(label_pngs, layout='a4'):
+    """Places up to one page of labels on a single PNG sheet at PNG_DPI."""
+    px_per_mm = PNG_DPI / MM_PER_INCH
+    page_w, page_h = LAYOUTS[layout]['page_mm']
+    sheet = Image.new('L', (round(page_w * px_per_mm), round(page_h * px_per_mm)), 255)
+    for png, (x, y, cell_w, cell_h) in zip(label_pngs, _cells(layout, px_per_mm)):
+        label = Image.open(BytesIO(png))
+        w, h = _fit(label.width, label.height, cell_w, cell_h)
+        label = label.resize((max(1, round(w)), max(1, round(h))), Image.LANCZOS)
+        sheet.paste(label, (round(x + (cell_w - w) / 2), round(y + (cell_h - h) / 2)))
+    output = BytesIO()
+    sheet.save(output, 'PNG')
+    return output.getvalue()
+
+
+def printable_labels(products):
+    """
+    Splits product rows (dicts with products_name, price, barcode_id) into
+    (name, price, code) labels and the names of products without a valid EAN-13.
+    """
+    labels, skipped = [], []
+    for product in products:
+        code = product.get('barcode_id')
+        if code and ean13.is_valid(code):
+            labels.append((product['products_name'], str(product['price']) if product.get('price') is not None else None,
+                           ean13.normalize(code)))
+        else:
+            skipped.append(product['products_name'])
+    return labels, skipped
+
+
+def bench(count=1000):
+    labels = [(f"Product {i}", '10.00', ean13.normalize(str(885000000000 + i))) for i in range(count)]
+    cpu_count = os.cpu_count() or 1
+    for workers in sorted({1, 2, 4, cpu_count} & set(range(1, cpu_count + 1))):
+        if workers > 1:
+            list(get_executor(workers).map(abs, range(workers)))  # ไม่นับเวลาสร้าง process
+        started = time.perf_counter()
+        pngs = render_labels(labels, workers=workers)
+        rendered = time.perf_counter() - started
+        pdf = build_pdf(pngs, 'a4')
+        total = time.perf_counter() - started
+        print(f"{count} labels, {workers} worker(s): render {rendered:.2f}s, total {total:.2f}s, PDF {len(pdf) / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if command == 'bench':
+        bench(int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
@@ -0,0 +1,247 @@
+# Live Events (Server-Sent Events)
+# Project Bin - ช่องทาง push แบบ SSE ต่อร้านค้า สำหรับตู้และจอ LCD (ธง bin, รายการในตะกร้า, สถานะการจ่ายเหรียญ)
+#
+# - โค้ดที่เขียนฐานข้อมูลเรียก stage() ระหว่าง transaction แล้วเรียก commit() หลัง conn.commit()
+#   เหตุการณ์จึงถูกส่งเฉพาะเมื่อข้อมูลถูก commit แล้ว ถ้า rollback ให้เรียก discard()
+#   (แอปเรียก discard() ตอน teardown ของทุก request อยู่แล้ว) รายการที่ stage แยกตาม thread
+# - publish() สร้างเฟรม SSE ครั้งเดียวแล้วแจกให้ผู้รับทุกคนของร้านนั้น ไม่มีการอ่าน MySQL เพื่อส่งเหตุการณ์
+# - ผู้รับแต่ละคนมีบัฟเฟอร์จำกัด (LIVE_EVENTS_BUFFER) ถ้าผู้รับช้าจนบัฟเฟอร์เต็ม เหตุการณ์ที่ค้างจะถูกทิ้ง
+#   แล้วส่ง event 'resync' แทน ให้อุปกรณ์โหลดสถานะใหม่ (ผู้รับช้าไม่ทำให้ผู้ส่งหรือผู้รับอื่นช้าลง)
+# - เหตุการณ์ล่าสุดของแต่ละร้านถูกเก็บไว้ (ขนาดเท่าบัฟเฟอร์) อุปกรณ์ที่เชื่อมต่อใหม่พร้อม Last-Event-ID
+#   จะได้รับเหตุการณ์ที่พลาดไป หรือ 'resync' ถ้าเก่าเกินกว่าที่เก็บไว้
+# - แต่ละการเชื่อมต่อ SSE ใช้หนึ่ง thread ของ server ตลอดเวลาที่เปิดอยู่ ควรรันด้วย server แบบ threaded
+#
+# ตัวแปร environment:
+#   LIVE_EVENTS_BUFFER           จำนวนเหตุการณ์ที่ค้างได้ต่อผู้รับ (และที่เก็บไว้ต่อร้านสำหรับ Last-Event-ID)
+#   LIVE_EVENTS_HEARTBEAT        วินาทีระหว่าง keepalive เมื่อไม่มีเหตุการณ์
+#   LIVE_EVENTS_MAX_SUBSCRIBERS  จำนวนการเชื่อมต่อพร้อมกันสูงสุดทั้ง process
+#
+# การใช้งาน:
+#   python live_events.py bench [subscribers] [events]    วัดเวลาตั้งแต่ publish จนผู้รับได้รับ (p50/p99)
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+LIVE_EVENTS_BUFFER = int(os.environ.get('LIVE_EVENTS_BUFFER', '256'))
+LIVE_EVENTS_HEARTBEAT = float(os.environ.get('LIVE_EVENTS_HEARTBEAT', '15'))
+LIVE_EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('LIVE_EVENTS_MAX_SUBSCRIBERS', '100'))
+RETRY_MS = 3000
+
+RESYNC_FRAME = "event: resync\ndata: {}\n\n"
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    """One SSE client of a store: a bounded buffer of ready-made frames."""
+
+    def __init__(self, store_id, buffer):
+        self.store_id = store_id
+        self.buffer = buffer
+        self.dropped = 0
+        self.closed = False
+        self._frames = deque()
+        self._ready = threading.Condition()
+
+    def put(self, frame):
+        with self._ready:
+            if len(self._frames) >= self.buffer:
+                # ผู้รับตามไม่ทัน: ทิ้งที่ค้างทั้งหมดแล้วให้โหลดสถานะใหม่ แทนการส่งสถานะที่ขาดหาย
+                self.dropped += len(self._frames)
+                self._frames.clear()
+                self._frames.append(RESYNC_FRAME)
+            self._frames.append(frame)
+            self._ready.notify()
+
+    def get(self, timeout):
+        """Returns every buffered frame, waiting up to `timeout` seconds; [] on timeout or close."""
+        with self._ready:
+            if not self._frames and not self.closed:
+                self._ready.wait(timeout)
+            frames = list(self._frames)
+            self._frames.clear()
+        return frames
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify()
+
+
+class LiveEvents:
+    """In-process pub/sub of committed changes, fanned out per store."""
+
+    def __init__(self, buffer=LIVE_EVENTS_BUFFER, max_subscribers=LIVE_EVENTS_MAX_SUBSCRIBERS):
+        self.buffer = buffer
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = {}   # store_id -> set of Subscription
+        self._recent = {}        # store_id -> deque of (event_id, frame)
+        self._evicted = {}       # store_id -> id of the newest event dropped from _recent
+        self._last_id = 0
+        self._staged = threading.local()
+        self._stats = {'published': 0, 'delivered': 0, 'discarded': 0, 'rejected': 0}
+
+    # --- Publishing ---
+    def publish(self, store_id, event, data):
+        """Sends one event to the store's subscribers now. Use stage()/commit() inside a transaction."""
+        if store_id is None:
+            return
+        with self._lock:
+            self._last_id += 1
+            event_id = self._last_id
+            frame = f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+            recent = self._recent.get(store_id)
+            if recent is None:
+                recent = self._recent[store_id] = deque(maxlen=self.buffer)
+            elif len(recent) == self.buffer:
+                self._evicted[store_id] = recent[0][0]
+            recent.append((event_id, frame))
+            subscribers = list(self._subscribers.get(store_id, ()))
+            self._stats['published'] += 1
+            self._stats['delivered'] += len(subscribers)
+        for subscription in subscribers:
+            subscription.put(frame)
+
+    def stage(self, store_id, event, data):
+        """Holds an event until commit() in this thread (call after the database commit)."""
+        staged = getattr(self._staged, 'events', None)
+        if staged is None:
+            staged = self._staged.events = []
+        staged.append((store_id, event, data))
+
+    def commit(self):
+        """Publishes the events staged by this thread, in order."""
+        staged = getattr(self._staged, 'events', None)
+        self._staged.events = None
+        for store_id, event, data in staged or ():
+            self.publish(store_id, event, data)
+
+    def discard(self, exc=None):
+        """Drops the events staged by this thread (rollback). Usable as a teardown function."""
+        staged = getattr(self._staged, 'events', None)
+        self._staged.events = None
+        if staged:
+            with self._lock:
+                self._stats['discarded'] += len(staged)
+
+    # --- Subscribing ---
+    def subscribe(self, store_id, last_event_id=None):
+        """
+        Registers a subscriber for one store. With `last_event_id` (the SSE
+        Last-Event-ID header) the missed events are queued first, or 'resync'
+        when they are no longer kept. Raises TooManySubscribers at the limit.
+        """
+        subscription = Subscription(store_id, self.buffer)
+        with self._lock:
+            if sum(len(subscribers) for subscribers in self._subscribers.values()) >= self.max_subscribers:
+                self._stats['rejected'] += 1
+                raise TooManySubscribers(f"live event subscriber limit reached ({self.max_subscribers})")
+            self._subscribers.setdefault(store_id, set()).add(subscription)
+            if last_event_id is not None:
+                if last_event_id < self._evicted.get(store_id, 0) or last_event_id > self._last_id:
+                    # พลาดเหตุการณ์ที่ไม่ได้เก็บไว้แล้ว หรือ id มาจาก process ก่อนรีสตาร์ต
+                    missed = [RESYNC_FRAME]
+                else:
+                    missed = [frame for event_id, frame in self._recent.get(store_id, ()) if event_id > last_event_id]
+                for frame in missed:
+                    subscription.put(frame)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.store_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.store_id]
+
+    def stream(self, subscription, heartbeat=LIVE_EVENTS_HEARTBEAT, initial=()):
+        """
+        Generator of SSE text for a Flask Response. `initial` frames (see
+        frame()) are sent first, e.g. a state snapshot. Unsubscribes when the
+        client disconnects.
+        """
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            for frame in initial:
+                yield frame
+            while not subscription.closed:
+                frames = subscription.get(heartbeat)
+                yield ''.join(frames) if frames else ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    @staticmethod
+    def frame(event, data):
+        """An SSE frame without an id (does not move the client's Last-Event-ID)."""
+        return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['subscribers'] = {store_id: len(subscribers) for store_id, subscribers in self._subscribers.items()}
+            stats['last_event_id'] = self._last_id
+            stats['dropped'] = sum(subscription.dropped for subscribers in self._subscribers.values()
+                                   for subscription in subscribers)
+        return stats
+
+
+def parse_last_event_id(value):
+    """The Last-Event-ID header as an int, or None when missing or malformed."""
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+# --- Benchmark ---
+def bench(subscribers=50, events=2000, interval=0.001):
+    """Publishes timestamped events to `subscribers` threads and reports delivery latency."""
+    bus = LiveEvents(buffer=max(events, LIVE_EVENTS_BUFFER), max_subscribers=subscribers)
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def consume(subscription):
+        received = 0
+        local = []
+        while received < events:
+            for frame in subscription.get(1.0):
+                if frame.startswith('id:'):
+                    data = json.loads(frame.split('data: ', 1)[1])
+                    local.append(time.perf_counter() - data['t'])
+                    received += 1
+        with latencies_lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=consume, args=(bus.subscribe(1),)) for _ in range(subscribers)]
+    for thread in threads:
+        thread.start()
+    published = 0.0
+    for i in range(events):
+        started = time.perf_counter()
+        bus.publish(1, 'bin_flag', {'category_id': i % 5, 'value': i % 2, 't': started})
+        published += time.perf_counter() - started
+        time.sleep(interval)  # การเขียนทยอยเข้ามา ไม่ใช่ burst ทีเดียว
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    print(f"{events} events x {subscribers} subscribers: publish {published / events * 1e6:.0f} us each, "
+          f"delivery p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms, max {latencies[-1] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if command == 'bench':
+        bench(int(sys.argv[2]) if len(sys.argv) > 2 else 50, int(sys.argv[3]) if len(sys.argv) > 3 else 2000)
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
@@ -0,0 +1,530 @@
+# Offline Kiosk Journal
+# Project Bin - โหมดออฟไลน์ของตู้: ค้นหาสินค้าจากแคตตาล็อกในเครื่อง และบันทึกการสแกน/คืนบรรจุภัณฑ์ลง SQLite
+#
+# เมื่อเชื่อมต่อฐานข้อมูลกลางไม่ได้ หน้า cart และ bin จะบันทึกรายการลง journal (SQLite, synchronous=FULL
+# จึงไม่หายแม้ไฟดับ) แทนการแสดงข้อผิดพลาด แล้ว OfflineSyncer (thread เบื้องหลัง) นำเข้าฐานข้อมูลกลาง
+# - นำเข้าเป็นชุด ชุดละหนึ่ง transaction รายการแต่ละรายการมี entry_id ที่ไม่ซ้ำ และถูกบันทึกใน tbl_sync_applied
+#   ใน transaction เดียวกัน การนำเข้าซ้ำ (เช่น ไฟดับหลัง commit แต่ก่อนบันทึกผลในเครื่อง) จึงไม่มีผลซ้ำ
+# - รายการที่นำเข้าไม่ได้ เช่น สต็อกหมดระหว่างออฟไลน์ หรือไม่พบรายการสั่งซื้อที่จะคืน ถูกบันทึกเป็น conflict
+#   (ไม่ลองใหม่) ดูได้ที่ /offline_status หรือ python offline_journal.py conflicts
+# - การเชื่อมต่อหลุด (InterfaceError/OperationalError) หรือ deadlock/lock wait timeout ระหว่างนำเข้าทำให้ rollback
+#   ทั้งชุดแล้วลองใหม่ภายหลัง ข้อผิดพลาดอื่นของรายการใด ๆ (เช่น ข้อมูลผิดรูปแบบ) ถูก rollback เฉพาะรายการนั้น
+#   และบันทึกเป็น conflict เพื่อไม่ให้รายการเดียวขวางทั้ง journal
+# - แคตตาล็อกในเครื่องถูกโหลดใหม่เมื่อเวอร์ชันของร้านเปลี่ยน (ดู catalog.py) สต็อกในเครื่องหักรายการที่ยังไม่นำเข้า
+# - ระหว่างออฟไลน์ยังปิดคำสั่งซื้อและจ่ายเหรียญไม่ได้ งานจ่ายเหรียญถูกสร้างตอนนำเข้ารายการคืนบรรจุภัณฑ์
+#
+# ตัวแปร environment:
+#   OFFLINE_JOURNAL            ไฟล์ SQLite ของ journal ว่าง = ปิดโหมดออฟไลน์
+#   KIOSK_ID                   รหัสตู้ (ค่าเริ่มต้นคือชื่อเครื่อง)
+#   OFFLINE_STORE_ID           ร้านของตู้ ใช้เลือกแคตตาล็อกที่เก็บในเครื่อง
+#   OFFLINE_SYNC_BATCH         จำนวนรายการต่อ transaction
+#   OFFLINE_CATALOG_REFRESH    ช่วงเวลา (วินาที) ตรวจเวอร์ชันแคตตาล็อก
+#
+# การใช้งาน:
+#   python offline_journal.py status                 จำนวนรายการตามสถานะใน journal
+#   python offline_journal.py conflicts              รายการที่นำเข้าไม่ได้
+#   python offline_journal.py outage [scans]         จำลองฐานข้อมูลล่มบนฐานข้อมูล bench แล้วตรวจว่าไม่มีการสแกนหาย
+
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from catalog import ProductCatalog
+
+OFFLINE_JOURNAL = os.environ.get('OFFLINE_JOURNAL', '')
+KIOSK_ID = os.environ.get('KIOSK_ID', socket.gethostname())[:64]
+OFFLINE_STORE_ID = os.environ.get('OFFLINE_STORE_ID', '')
+OFFLINE_SYNC_BATCH = int(os.environ.get('OFFLINE_SYNC_BATCH', '100'))
+OFFLINE_CATALOG_REFRESH = float(os.environ.get('OFFLINE_CATALOG_REFRESH', '60'))
+RETRY_MAX_SECONDS = 30
+TRANSIENT_ERRNOS = (1205, 1213)  # lock wait timeout, deadlock: ลองทั้งชุดใหม่ ไม่ใช่ conflict
+
+
+def aborts_batch(error):
+    """True for errors that should roll back the whole batch and retry it later instead of failing one entry."""
+    import mysql.connector
+    return (isinstance(error, (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError))
+            or getattr(error, 'errno', None) in TRANSIENT_ERRNOS)
+
+
+class OfflineRejected(Exception):
+    """A scan that cannot be accepted even offline (unknown barcode, no local stock)."""
+
+
+class OfflineJournal:
+    """Local product catalog and append-only journal of offline writes, in one SQLite file."""
+
+    def __init__(self, path=OFFLINE_JOURNAL, kiosk_id=KIOSK_ID):
+        self.path = path
+        self.kiosk_id = kiosk_id
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS catalog (
+                products_id TEXT PRIMARY KEY,
+                products_name TEXT NOT NULL,
+                price TEXT NOT NULL,
+                stock INTEGER NOT NULL,
+                barcode_id TEXT,
+                store_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_catalog_barcode ON catalog (barcode_id);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                entry_id TEXT NOT NULL UNIQUE,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                products_id TEXT,
+                quantity INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                synced_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_journal_status ON journal (status, seq);
+        """)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")  # commit ถึงดิสก์ก่อนตอบ request
+            self._local.conn = conn
+        return conn
+
+    # --- Catalog ---
+    def catalog_version(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()
+        return int(row[0]) if row else None
+
+    def load_catalog(self, products, version):
+        """
+        Replaces the local catalog. Stock is the central stock minus the
+        quantities of cart scans that are still waiting to be synced.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM catalog")
+            conn.executemany("""
+                INSERT INTO catalog (products_id, products_name, price, stock, barcode_id, store_id) VALUES (?, ?, ?, ?, ?, ?)
+            """, [(str(p['products_id']), p['products_name'], str(p['price']), int(p['stock']), p['barcode_id'] or None,
+                   p['store_id']) for p in products])
+            conn.execute("""
+                UPDATE catalog SET stock = stock - (
+                    SELECT COALESCE(SUM(j.quantity), 0) FROM journal j
+                    WHERE j.status = 'pending' AND j.kind = 'cart_scan' AND j.products_id = catalog.products_id
+                )
+            """)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('catalog_version', ?)", (str(version),))
+
+    def lookup(self, barcode, store_id):
+        """Resolves a barcode from the local catalog, preferring the store's own product. Returns a dict or None."""
+        row = self._conn().execute("""
+            SELECT products_id, products_name, price, stock, store_id FROM catalog
+            WHERE barcode_id = ? AND (store_id = ? OR store_id IS NULL)
+            ORDER BY store_id IS NULL LIMIT 1
+        """, (barcode, store_id)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('products_id', 'products_name', 'price', 'stock', 'store_id'), row))
+
+    # --- Journal ---
+    def provisional_order_id(self):
+        """Order number for a cart opened offline; unique per kiosk without the central sequence."""
+        return f"{self.kiosk_id}-{uuid.uuid4().hex[:10]}"
+
+    def append(self, kind, payload, products_id=None, quantity=0):
+        entry_id = uuid.uuid4().hex
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT INTO journal (entry_id, kind, payload, products_id, quantity, created_at) VALUES (?, ?, ?, ?, ?, ?)
+            """, (entry_id, kind, json.dumps(payload), products_id, quantity, time.time()))
+        return entry_id
+
+    def record_cart_scan(self, barcode, order_id, email, store_id, quantity=1):
+        """
+        Journals a cart scan resolved against the local catalog and takes the
+        quantity off the local stock. Raises OfflineRejected when the barcode is
+        unknown or the local stock is short. Returns the product dict.
+        """
+        product = self.lookup(barcode, store_id)
+        if product is None:
+            raise OfflineRejected("ไม่พบสินค้าด้วยรหัสบาร์โค้ดนี้ในแคตตาล็อกของตู้!")
+        conn = self._conn()
+        with conn:
+            updated = conn.execute("UPDATE catalog SET stock = stock - ? WHERE products_id = ? AND stock >= ?",
+                                   (quantity, product['products_id'], quantity)).rowcount
+            if not updated:
+                raise OfflineRejected(f"สินค้า {product['products_name']} มีสต็อกไม่พอ. มีในสต็อก: {product['stock']} ชิ้น")
+            payload = {'barcode': barcode, 'order_id': order_id, 'email': email, 'store_id': store_id, 'quantity': quantity}
+            conn.execute("""
+                INSERT INTO journal (entry_id, kind, payload, products_id, quantity, created_at) VALUES (?, 'cart_scan', ?, ?, ?, ?)
+            """, (uuid.uuid4().hex, json.dumps(payload), product['products_id'], quantity, time.time()))
+        product['stock'] -= quantity
+        return product
+
+    def record_bin_return(self, barcode_id, products_id, store_id, email=None):
+        """Journals one returned package; the order line is checked when the entry is synced."""
+        payload = {'barcode_id': barcode_id, 'products_id': products_id, 'store_id': store_id, 'email': email}
+        return self.append('bin_return', payload, products_id=str(products_id))
+
+    def pending(self, limit):
+        rows = self._conn().execute("""
+            SELECT entry_id, kind, payload FROM journal WHERE status = 'pending' ORDER BY seq LIMIT ?
+        """, (limit,)).fetchall()
+        return [{'entry_id': entry_id, 'kind': kind, 'payload': json.loads(payload)} for entry_id, kind, payload in rows]
+
+    def mark(self, outcomes):
+        """Stores sync outcomes: a list of (entry_id, status, error) with status 'synced' or 'conflict'."""
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.executemany("UPDATE journal SET status = ?, error = ?, synced_at = ? WHERE entry_id = ?",
+                             [(status, error, now, entry_id) for entry_id, status, error in outcomes])
+
+    def counts(self):
+        return dict(self._conn().execute("SELECT status, COUNT(*) FROM journal GROUP BY status").fetchall())
+
+    def conflicts(self, limit=100):
+        rows = self._conn().execute("""
+            SELECT entry_id, kind, payload, error, created_at FROM journal WHERE status = 'conflict' ORDER BY seq DESC LIMIT ?
+        """, (limit,)).fetchall()
+        return [{'entry_id': entry_id, 'kind': kind, 'payload': json.loads(payload), 'error': error,
+                 'created_at': created_at} for entry_id, kind, payload, error, created_at in rows]
+
+
+class OfflineSyncer:
+    """
+    Replays the journal into the central database and keeps the local catalog
+    fresh. `handlers` maps an entry kind to handler(cursor, payload), which
+    applies the entry on a dictionary cursor and returns None, or an error
+    message for a conflict. Database errors roll the batch back for a retry.
+    `after_batch(outcomes)` runs after each committed batch, `after_rollback()`
+    after a batch was rolled back.
+    """
+
+    def __init__(self, journal, connect, handlers, store_id=None, batch_size=OFFLINE_SYNC_BATCH,
+                 catalog_refresh=OFFLINE_CATALOG_REFRESH, after_batch=None, after_rollback=None):
+        self.journal = journal
+        self.connect = connect
+        self.handlers = handlers
+        self.store_id = store_id
+        self.batch_size = batch_size
+        self.catalog_refresh = catalog_refresh
+        self.after_batch = after_batch
+        self.after_rollback = after_rollback
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._stats = {'synced': 0, 'conflicts': 0, 'duplicates': 0, 'batches': 0, 'failures': 0,
+                       'catalog_loads': 0, 'online': None, 'last_error': None}
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='offline-syncer', daemon=True)
+        self._thread.start()
+        return self
+
+    def notify(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        delay = 1.0
+        next_refresh = 0
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                if time.monotonic() >= next_refresh:
+                    self.refresh_catalog()
+                    next_refresh = time.monotonic() + self.catalog_refresh
+                while self.sync_batch():
+                    pass
+                delay = 1.0
+                self._set_online(True)
+                self._wakeup.wait(self.catalog_refresh)
+            except Exception as e:
+                with self._lock:
+                    self._stats['failures'] += 1
+                self._set_online(False, str(e))
+                self._wakeup.wait(delay)
+                delay = min(delay * 2, RETRY_MAX_SECONDS)
+
+    def _set_online(self, online, error=None):
+        with self._lock:
+            if self._stats['online'] is not online:
+                print(f"Offline syncer: central database {'reachable' if online else f'unreachable ({error})'}")
+            self._stats['online'] = online
+            self._stats['last_error'] = error
+
+    def refresh_catalog(self):
+        """Reloads the local catalog when the store's catalog version changed."""
+        conn = self.connect()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            version = ProductCatalog.version(cursor, self.store_id)
+            if version == self.journal.catalog_version():
+                return False
+            query = "SELECT products_id, products_name, price, stock_quantity AS stock, barcode_id, store_id FROM tbl_products"
+            params = ()
+            if self.store_id:
+                query += " WHERE store_id = %s OR store_id IS NULL"
+                params = (self.store_id,)
+            cursor.execute(query, params)
+            self.journal.load_catalog(cursor.fetchall(), version)
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        with self._lock:
+            self._stats['catalog_loads'] += 1
+        return True
+
+    def sync_batch(self):
+        """Replays one batch of pending entries in one transaction. Returns the number of entries handled."""
+        entries = self.journal.pending(self.batch_size)
+        if not entries:
+            return 0
+        conn = self.connect()
+        cursor = conn.cursor(dictionary=True)
+        outcomes = []
+        duplicates = 0
+        try:
+            for entry in entries:
+                cursor.execute("""
+                    INSERT IGNORE INTO tbl_sync_applied (entry_id, kiosk_id, kind) VALUES (%s, %s, %s)
+                """, (entry['entry_id'], self.journal.kiosk_id, entry['kind']))
+                if cursor.rowcount == 0:
+                    # นำเข้าไปแล้วในรอบก่อน ใช้ผลเดิม
+                    cursor.execute("SELECT status, error FROM tbl_sync_applied WHERE entry_id = %s", (entry['entry_id'],))
+                    row = cursor.fetchone()
+                    outcomes.append((entry['entry_id'], 'synced' if row['status'] == 'applied' else 'conflict', row['error']))
+                    duplicates += 1
+                    continue
+
+                handler = self.handlers.get(entry['kind'])
+                cursor.execute("SAVEPOINT sync_entry")
+                try:
+                    error = handler(cursor, entry['payload']) if handler else f"unknown journal entry kind {entry['kind']}"
+                except Exception as e:
+                    if aborts_batch(e):
+                        raise
+                    print(f"Offline sync: entry {entry['entry_id']} failed: {e!r}")
+                    error = f"{type(e).__name__}: {e}"
+                if error:
+                    cursor.execute("ROLLBACK TO SAVEPOINT sync_entry")
+                    cursor.execute("UPDATE tbl_sync_applied SET status = 'conflict', error = %s WHERE entry_id = %s",
+                                   (error[:255], entry['entry_id']))
+                    outcomes.append((entry['entry_id'], 'conflict', error))
+                else:
+                    outcomes.append((entry['entry_id'], 'synced', None))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if self.after_rollback:
+                self.after_rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+        self.journal.mark(outcomes)
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['duplicates'] += duplicates
+            self._stats['synced'] += sum(1 for _, status, _ in outcomes if status == 'synced')
+            self._stats['conflicts'] += sum(1 for _, status, _ in outcomes if status == 'conflict')
+        if self.after_batch:
+            self.after_batch(outcomes)
+        return len(entries)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['journal'] = self.journal.counts()
+        return stats
+
+
+def create_offline_journal(path=OFFLINE_JOURNAL):
+    """OfflineJournal at OFFLINE_JOURNAL, or None when offline mode is disabled."""
+    return OfflineJournal(path) if path else None
+
+
+# --- Outage test ---
+class SimulatedOutage:
+    """Wraps a connect function; while `down` is set every connection attempt fails like a lost uplink."""
+
+    def __init__(self, connect):
+        self._connect = connect
+        self.down = False
+
+    def connect(self):
+        import mysql.connector
+
+        if self.down:
+            raise mysql.connector.errors.InterfaceError("simulated outage: can't connect to MySQL server")
+        return self._connect()
+
+
+def _bench_cart_scan(cursor, payload):
+    """Minimal cart-scan handler for the bench schema (the app's handler also maintains order lines and caches)."""
+    from stock_service import StockService
+
+    cursor.execute("SELECT products_id FROM tbl_products WHERE barcode_id = %s", (payload['barcode'],))
+    row = cursor.fetchone()
+    if row is None:
+        return "unknown barcode"
+    if not StockService.reserve(cursor, row['products_id'], payload['quantity']):
+        return "out of stock"
+    cursor.execute("""
+        INSERT INTO tbl_order (order_id, products_id, products_name, quantity, email, barcode_id, store_id)
+        VALUES (%s, %s, 'Product', %s, %s, %s, %s)
+    """, (payload['order_id'], row['products_id'], payload['quantity'], payload['email'], payload['barcode'], payload['store_id']))
+    return None
+
+
+def outage_test(scans=500):
+    """
+    Takes the bench database "down", journals `scans` scans (some against
+    products that run out centrally meanwhile), brings it back and waits for
+    the syncer. Every scan must end up applied or reported as a conflict, and
+    replaying the whole journal again must change nothing.
+    """
+    import random
+    import tempfile
+    import mysql.connector
+    from db_migrations import BENCH_DATABASE, _m007_catalog_versioning, _m011_sync_applied
+    from db_pool import DB_CONFIG
+
+    config = dict(DB_CONFIG, database=BENCH_DATABASE)
+    setup = mysql.connector.connect(**{k: v for k, v in DB_CONFIG.items() if k != 'database'})
+    cursor = setup.cursor(dictionary=True)
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{BENCH_DATABASE}`")
+    cursor.execute(f"USE `{BENCH_DATABASE}`")
+    for table in ('tbl_order', 'tbl_products', 'tbl_catalog_tombstone', 'tbl_sync_applied'):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute("""
+        CREATE TABLE tbl_products (
+            products_id int(11) NOT NULL PRIMARY KEY,
+            products_name varchar(255) NOT NULL,
+            price decimal(10,2) NOT NULL,
+            stock_quantity int(11) NOT NULL,
+            barcode_id varchar(255) DEFAULT NULL,
+            store_id int(11) DEFAULT NULL
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute("""
+        CREATE TABLE tbl_order (
+            id int(11) NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            order_id varchar(255) NOT NULL,
+            products_id varchar(255) DEFAULT NULL,
+            products_name varchar(255) NOT NULL,
+            quantity int(11) NOT NULL,
+            email varchar(255) DEFAULT NULL,
+            barcode_id varchar(255) DEFAULT NULL,
+            store_id int(11) DEFAULT NULL
+        ) ENGINE=InnoDB
+    """)
+    ddl = setup.cursor()  # ฟังก์ชัน migration ใช้ cursor แบบ tuple
+    _m007_catalog_versioning(ddl)
+    _m011_sync_applied(ddl)
+    ddl.close()
+    cursor.executemany("INSERT INTO tbl_products VALUES (%s, %s, 10, %s, %s, 1)",
+                       [(i, f"Product {i}", 1000, str(i).zfill(13)) for i in range(1, 51)])
+    setup.commit()
+
+    outage = SimulatedOutage(lambda: mysql.connector.connect(**config))
+    with tempfile.TemporaryDirectory() as directory:
+        journal = OfflineJournal(os.path.join(directory, 'journal.sqlite3'), kiosk_id='bench')
+        syncer = OfflineSyncer(journal, outage.connect, {'cart_scan': _bench_cart_scan}, store_id=1,
+                               batch_size=50, catalog_refresh=0.5).start()
+        while journal.catalog_version() is None:
+            time.sleep(0.05)
+
+        outage.down = True
+        rnd = random.Random(42)
+        accepted = 0
+        for i in range(scans):
+            try:
+                journal.record_cart_scan(str(rnd.randint(1, 50)).zfill(13), f"bench-{i // 5}", 'kiosk@example.com', 1)
+                accepted += 1
+            except OfflineRejected:
+                pass
+        # ระหว่างออฟไลน์ อีกเครื่องหนึ่งขายสินค้า 1-5 จนหมด: รายการสแกนของสินค้าเหล่านี้ต้องเป็น conflict
+        cursor.execute("UPDATE tbl_products SET stock_quantity = 0 WHERE products_id <= 5")
+        setup.commit()
+        time.sleep(1.5)
+        cursor.execute("SELECT COUNT(*) AS n FROM tbl_order")
+        during = cursor.fetchone()['n']
+        setup.commit()
+
+        outage.down = False
+        syncer.notify()
+        started = time.perf_counter()
+        while journal.counts().get('pending'):
+            time.sleep(0.05)
+        drained = time.perf_counter() - started
+        syncer.stop()
+
+        counts = journal.counts()
+        cursor.execute("SELECT COUNT(*) AS n, COALESCE(SUM(quantity), 0) AS q FROM tbl_order")
+        orders = cursor.fetchone()
+        cursor.execute("SELECT status, COUNT(*) AS n FROM tbl_sync_applied GROUP BY status")
+        applied = {row['status']: row['n'] for row in cursor.fetchall()}
+        setup.commit()
+
+        # ทำเหมือนผลในเครื่องหายหลัง commit: นำเข้าทั้ง journal ซ้ำ ต้องไม่มีแถวเพิ่ม
+        journal._conn().execute("UPDATE journal SET status = 'pending'")
+        journal._conn().commit()
+        replay = OfflineSyncer(journal, outage.connect, {'cart_scan': _bench_cart_scan}, store_id=1, batch_size=50)
+        while replay.sync_batch():
+            pass
+        cursor.execute("SELECT COUNT(*) AS n FROM tbl_order")
+        after_replay = cursor.fetchone()['n']
+        setup.commit()
+
+    print(f"{accepted}/{scans} scans journaled offline, {during} reached MySQL during the outage")
+    print(f"drained in {drained:.2f}s: synced={counts.get('synced', 0)} conflicts={counts.get('conflict', 0)}; "
+          f"central applied={applied.get('applied', 0)} conflict={applied.get('conflict', 0)} order rows={orders['n']}")
+    print(f"replay of all {accepted} entries: {replay.stats()['duplicates']} duplicate(s) skipped, order rows {after_replay}")
+    ok = (during == 0 and counts.get('synced', 0) + counts.get('conflict', 0) == accepted
+          and applied.get('applied', 0) == counts.get('synced', 0) == orders['n'] == after_replay
+          and applied.get('conflict', 0) == counts.get('conflict', 0))
+    print("OK" if ok else "FAILED: scans were lost or applied twice")
+    cursor.close()
+    setup.close()
+    return ok
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if command == 'outage':
+        sys.exit(0 if outage_test(int(sys.argv[2]) if len(sys.argv) > 2 else 500) else 1)
+    if not OFFLINE_JOURNAL:
+        print("OFFLINE_JOURNAL is not set")
+        sys.exit(1)
+    journal = OfflineJournal()
+    if command == 'status':
+        for status, count in sorted(journal.counts().items()):
+            print(f"{status:<10}{count:>8}")
+    elif command == 'conflicts':
+        for conflict in journal.conflicts():
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(conflict['created_at']))}  {conflict['kind']:<11}"
+                  f"{conflict['error']}  {json.dumps(conflict['payload'], ensure_ascii=False)}")
+    else:
+        print("Usage: python offline_journal.py status | conflicts | outage [scans]")
+        sys.exit(1)
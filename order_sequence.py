@@ -0,0 +1,67 @@
+# Order Number Sequence
+# Project Bin - ระบบออกเลขที่คำสั่งซื้อแยกตามร้านค้า
+#
+# ตาราง tbl_order_sequence เก็บเลขล่าสุดที่ถูกจองไปแล้วของแต่ละร้าน (store_id = 0 สำหรับผู้ใช้ที่ไม่มีร้าน)
+# แต่ละ worker จองเลขเป็นช่วง (block) ด้วยคำสั่งเดียวแบบ atomic ผ่าน LAST_INSERT_ID(expr)
+# แล้วแจกเลขในช่วงนั้นจากหน่วยความจำโดยไม่ต้องติดต่อฐานข้อมูล
+# หมายเหตุ: เลขที่จองไว้แต่ยังไม่ได้ใช้จะหายไปเมื่อ worker หยุดทำงาน (เลขอาจไม่ต่อเนื่อง แต่ไม่ซ้ำกัน)
+
+import threading
+
+FIRST_ORDER_ID = 100001
+NO_STORE_KEY = 0
+
+
+class OrderSequence:
+    """
+    Hands out unique, increasing order numbers per store.
+    `connect` must return a connection the sequence may commit on and close;
+    the block reservation is committed straight away so the counter row is
+    never held locked by a longer request transaction.
+    """
+
+    def __init__(self, connect, block_size=20):
+        self.connect = connect
+        self.block_size = block_size
+        self._blocks = {}  # store key -> [next_value, last_value]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def reserve_block(cursor, store_key, count):
+        """
+        Atomically advances the store's counter by `count` and returns the last
+        value of the reserved range [last - count + 1, last].
+        """
+        cursor.execute("""
+            INSERT INTO tbl_order_sequence (store_id, next_value) VALUES (%s, LAST_INSERT_ID(%s))
+            ON DUPLICATE KEY UPDATE next_value = LAST_INSERT_ID(next_value + %s)
+        """, (store_key, FIRST_ORDER_ID - 1 + count, count))
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        row = cursor.fetchone()
+        return int(row['LAST_INSERT_ID()'] if isinstance(row, dict) else row[0])
+
+    def _fetch_block(self, store_key):
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            last = self.reserve_block(cursor, store_key, self.block_size)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+        return [last - self.block_size + 1, last]
+
+    def next_id(self, store_id):
+        """Returns the next order number for `store_id` as a string."""
+        store_key = store_id if store_id is not None else NO_STORE_KEY
+        with self._lock:
+            block = self._blocks.get(store_key)
+            if block is None or block[0] > block[1]:
+                block = self._fetch_block(store_key)
+                self._blocks[store_key] = block
+            value = block[0]
+            block[0] += 1
+        return str(value)
@@ -0,0 +1,171 @@
+# Parallel PDF Rendering
+# Project Bin - เรนเดอร์รายงาน PDF ขนาดใหญ่แบบแบ่งช่วงและทำงานขนานด้วยหลาย process
+#
+# xhtml2pdf ทำงานใน thread เดียวและช้ามากกับตารางขนาดใหญ่ จึงแบ่งคำสั่งซื้อเป็นช่วงละ PDF_CHUNK_ROWS แถว
+# เรนเดอร์แต่ละช่วงใน ProcessPoolExecutor แล้วรวมไฟล์ตามลำดับด้วย pypdf
+# - ส่วนหัวอยู่ในช่วงแรก ส่วนสรุปอยู่ในช่วงสุดท้าย ยอดรวมคำนวณจากข้อมูลทั้งหมดก่อนแบ่ง
+# - เลขหน้า (หน้า/จำนวนหน้าทั้งหมด) ประทับหลังรวมไฟล์แล้ว จึงต่อเนื่องทั้งเล่ม
+# - แต่ละช่วงขึ้นหน้าใหม่ หน้าสุดท้ายของช่วงอาจไม่เต็มหน้า
+# - รายงานที่มีไม่เกินหนึ่งช่วงจะเรนเดอร์ใน process ปัจจุบันโดยไม่ผ่าน pool
+#
+# การใช้งาน:
+#   python pdf_render.py bench [rows ...]    วัดเวลาเทียบจำนวน worker (ค่าเริ่มต้น 10000 และ 100000 แถว)
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from pypdf import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+from xhtml2pdf import pisa
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+ORDERS_TEMPLATE = 'pdf_template.html'
+PDF_CHUNK_ROWS = int(os.environ.get('PDF_CHUNK_ROWS', '500'))
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', str(os.cpu_count() or 1)))
+
+_environment = None
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+class PdfRenderError(Exception):
+    pass
+
+
+def _get_environment():
+    # แต่ละ process สร้าง Environment ของตัวเองครั้งเดียว (template ถูก compile แล้วเก็บไว้)
+    global _environment
+    if _environment is None:
+        _environment = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(['html']))
+    return _environment
+
+
+def render_chunk(template_name, context):
+    """Renders one template chunk to PDF bytes. Runs in a worker process."""
+    html = _get_environment().get_template(template_name).render(**context)
+    buffer = BytesIO()
+    status = pisa.CreatePDF(html, dest=buffer)
+    if status.err:
+        raise PdfRenderError(f"xhtml2pdf reported {status.err} error(s)")
+    return buffer.getvalue()
+
+
+def get_executor(workers=PDF_RENDER_WORKERS):
+    """Process pool shared by the CPU-heavy renderers (PDF chunks, label sheets)."""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            _executor_workers = workers
+        return _executor
+
+
+def _stamp_page_numbers(pdf_bytes):
+    """Adds a 'page / total' footer to every page of the merged report."""
+    reader = PdfReader(BytesIO(pdf_bytes))
+    total = len(reader.pages)
+    overlay_buffer = BytesIO()
+    overlay = canvas.Canvas(overlay_buffer)
+    for number, page in enumerate(reader.pages, start=1):
+        width, height = float(page.mediabox.width), float(page.mediabox.height)
+        overlay.setPageSize((width, height))
+        overlay.setFont('Helvetica', 8)
+        overlay.drawCentredString(width / 2, 15, f"{number} / {total}")
+        overlay.showPage()
+    overlay.save()
+    overlay_pages = PdfReader(BytesIO(overlay_buffer.getvalue())).pages
+
+    writer = PdfWriter()
+    for page, stamp in zip(reader.pages, overlay_pages):
+        page.merge_page(stamp)
+        writer.add_page(page)
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def _merge(chunks):
+    writer = PdfWriter()
+    for chunk in chunks:
+        for page in PdfReader(BytesIO(chunk)).pages:
+            writer.add_page(page)
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def render_orders_pdf(orders, current_date, chunk_rows=PDF_CHUNK_ROWS, workers=PDF_RENDER_WORKERS):
+    """
+    Renders the orders report (templates/pdf_template.html) to PDF bytes.
+    Reports larger than `chunk_rows` are rendered in parallel chunks and merged;
+    totals are computed over all `orders` and pages are numbered across chunks.
+    """
+    totals = {
+        'total_orders': len(orders),
+        'total_quantity': sum(order['quantity'] for order in orders),
+        'current_date': current_date,
+    }
+    slices = [orders[i:i + chunk_rows] for i in range(0, len(orders), chunk_rows)] or [[]]
+    contexts = []
+    for index, chunk in enumerate(slices):
+        context = dict(totals, orders=chunk, show_header=index == 0, show_summary=index == len(slices) - 1)
+        contexts.append(context)
+
+    if len(contexts) == 1 or workers <= 1:
+        chunks = [render_chunk(ORDERS_TEMPLATE, context) for context in contexts]
+    else:
+        executor = get_executor(workers)
+        chunks = list(executor.map(render_chunk, [ORDERS_TEMPLATE] * len(contexts), contexts))
+    return _stamp_page_numbers(_merge(chunks) if len(chunks) > 1 else chunks[0])
+
+
+# --- Benchmark ---
+def _sample_orders(rows):
+    import random
+    from datetime import datetime, timedelta
+    from decimal import Decimal
+
+    rnd = random.Random(42)
+    start = datetime.now() - timedelta(days=365)
+    return [{
+        'id': i + 1, 'order_id': str(100001 + i // 5), 'products_id': str(rnd.randint(1, 5000)),
+        'products_name': f'ขวดพลาสติก PET {rnd.randint(1, 5000)}', 'quantity': rnd.randint(1, 5),
+        'disquantity': 0, 'email': f'user{rnd.randint(1, 500)}@example.com',
+        'order_date': start + timedelta(seconds=i * 30), 'barcode_id': str(rnd.randint(1, 50000)).zfill(13),
+        'category_id': rnd.randint(1, 5), 'price': Decimal('10.00'), 'store_id': 1, 'store_name': 'Store 1',
+    } for i in range(rows)]
+
+
+def bench(sizes=(10000, 100000)):
+    cpu_count = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, cpu_count} & set(range(1, cpu_count + 1)))
+    print(f"{'rows':>8}{'workers':>9}{'seconds':>10}{'speedup':>9}{'pages':>8}")
+    for rows in sizes:
+        orders = _sample_orders(rows)
+        baseline = None
+        for workers in worker_counts:
+            if workers > 1:
+                list(get_executor(workers).map(abs, range(workers)))  # ไม่นับเวลาสร้าง process
+            started = time.perf_counter()
+            pdf = render_orders_pdf(orders, 'bench', workers=workers)
+            elapsed = time.perf_counter() - started
+            baseline = baseline or elapsed
+            pages = len(PdfReader(BytesIO(pdf)).pages)
+            print(f"{rows:>8}{workers:>9}{elapsed:>10.1f}{baseline / elapsed:>8.1f}x{pages:>8}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if command == 'bench':
+        bench([int(arg) for arg in sys.argv[2:]] or (10000, 100000))
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
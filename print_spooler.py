@@ -0,0 +1,219 @@
+# Print Spooler
+# Project Bin - คิวงานพิมพ์เบื้องหลังสำหรับเครื่องพิมพ์ใบเสร็จ request ไม่ต้องรอเครื่องพิมพ์
+#
+# งานพิมพ์ (bytes ESC/POS จาก escpos_receipt.py) ถูกใส่คิวแล้ว thread เบื้องหลังรวมงานที่รออยู่
+# (สูงสุด PRINTER_BATCH_MAX งาน) เขียนลง device ในครั้งเดียว หากเขียนไม่สำเร็จ (กระดาษหมด, สายหลุด)
+# จะลองใหม่แบบรอเพิ่มขึ้นเรื่อย ๆ โดยไม่ทิ้งงาน คิวมีขนาดจำกัด งานที่เกินจะถูกปฏิเสธทันที
+# การลองใหม่เขียนต่อจาก byte ที่เครื่องพิมพ์รับไปแล้ว (OSError.written) ใบเสร็จที่พิมพ์ไปแล้วจึงไม่ถูกพิมพ์ซ้ำ
+#
+# ตัวแปร environment:
+#   RECEIPT_PRINTER        device ของเครื่องพิมพ์ เช่น /dev/usb/lp0, 'fake' = FakePrinter, ว่าง = ปิดการพิมพ์
+#   PRINTER_QUEUE_MAX      จำนวนงานที่รอในคิวได้สูงสุด
+#   PRINTER_BATCH_MAX      จำนวนงานสูงสุดต่อการเขียนหนึ่งครั้ง
+#
+# การใช้งาน:
+#   python print_spooler.py bench [jobs]    ส่งใบเสร็จเข้า FakePrinter แล้ววัดเวลา submit และเวลาพิมพ์ทั้งหมด
+
+import os
+import queue
+import sys
+import threading
+import time
+
+RECEIPT_PRINTER = os.environ.get('RECEIPT_PRINTER', '')
+PRINTER_QUEUE_MAX = int(os.environ.get('PRINTER_QUEUE_MAX', '200'))
+PRINTER_BATCH_MAX = int(os.environ.get('PRINTER_BATCH_MAX', '16'))
+RETRY_MAX_SECONDS = 30
+
+
+class SpoolerFull(Exception):
+    pass
+
+
+class DevicePrinter:
+    """
+    Writes to a printer device file (e.g. /dev/usb/lp0), reopened for every batch.
+    An OSError raised by write() carries `written`, the bytes accepted before the failure.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, data):
+        written = 0
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | getattr(os, 'O_NOCTTY', 0))
+            try:
+                view = memoryview(data)
+                while written < len(view):
+                    written += os.write(fd, view[written:])
+            finally:
+                os.close(fd)
+        except OSError as e:
+            e.written = written
+            raise
+
+
+class FakePrinter:
+    """
+    Stand-in for the real printer: keeps every write in memory (optionally
+    also appending to `path`) and simulates the link speed in bytes/second.
+    `fail_next` makes the next writes raise OSError, like a printer out of paper,
+    after accepting the first `fail_after` bytes of each failing write.
+    """
+
+    def __init__(self, path=None, bytes_per_second=0):
+        self.path = path
+        self.bytes_per_second = bytes_per_second
+        self.writes = []
+        self.fail_next = 0
+        self.fail_after = 0
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        with self._lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                accepted = bytes(data[:self.fail_after])
+                if accepted:
+                    self.writes.append(accepted)
+                error = OSError("fake printer: out of paper")
+                error.written = len(accepted)
+                raise error
+        if self.bytes_per_second:
+            time.sleep(len(data) / self.bytes_per_second)
+        if self.path:
+            with open(self.path, 'ab') as output:
+                output.write(data)
+        with self._lock:
+            self.writes.append(bytes(data))
+
+    @property
+    def data(self):
+        with self._lock:
+            return b''.join(self.writes)
+
+
+class PrintSpooler:
+    """Background queue that batches print jobs onto one printer."""
+
+    def __init__(self, printer, queue_max=PRINTER_QUEUE_MAX, batch_max=PRINTER_BATCH_MAX):
+        self.printer = printer
+        self.batch_max = batch_max
+        self._queue = queue.Queue(maxsize=queue_max)
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'printed': 0, 'batches': 0, 'bytes': 0, 'errors': 0, 'rejected': 0}
+        self._last_error = None
+        self._thread = threading.Thread(target=self._run, name='print-spooler', daemon=True)
+        self._thread.start()
+
+    def submit(self, data):
+        """Queues one job and returns immediately. Raises SpoolerFull when the queue is full."""
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise SpoolerFull("คิวงานพิมพ์เต็ม")
+        with self._lock:
+            self._stats['submitted'] += 1
+
+    def _next_batch(self):
+        jobs = [self._queue.get()]
+        while len(jobs) < self.batch_max and jobs[-1] is not None:
+            try:
+                jobs.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._next_batch()
+            if jobs[-1] is None:  # close()
+                jobs.pop()
+                if jobs:
+                    self._write(jobs)
+                return
+            self._write(jobs)
+
+    def _write(self, jobs):
+        data = b''.join(jobs)
+        offset = 0
+        delay = 0.5
+        while True:
+            try:
+                self.printer.write(memoryview(data)[offset:])
+                break
+            except OSError as e:
+                # ส่วนที่เครื่องพิมพ์รับไปแล้วไม่ส่งซ้ำ ลองใหม่ต่อจากตำแหน่งนั้น
+                offset += getattr(e, 'written', 0)
+                with self._lock:
+                    self._stats['errors'] += 1
+                    self._last_error = str(e)
+                print(f"Print spooler: write failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_SECONDS)
+        with self._lock:
+            self._stats['printed'] += len(jobs)
+            self._stats['batches'] += 1
+            self._stats['bytes'] += len(data)
+            self._last_error = None
+
+    def join(self, timeout=None):
+        """Waits until every job submitted so far has been written (for tests and benchmarks)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self._stats['printed'] >= self._stats['submitted']:
+                    return True
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+
+    def close(self, timeout=None):
+        """Stops the worker after the queued jobs are written."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queued'] = self._queue.qsize()
+            stats['last_error'] = self._last_error
+        return stats
+
+
+def create_print_spooler(device=RECEIPT_PRINTER):
+    """Spooler for RECEIPT_PRINTER, or None when receipt printing is disabled."""
+    if not device:
+        return None
+    printer = FakePrinter() if device == 'fake' else DevicePrinter(device)
+    return PrintSpooler(printer)
+
+
+def bench(jobs=200):
+    from escpos_receipt import _sample_receipt, build_receipt
+
+    printer = FakePrinter(bytes_per_second=20000)  # ประมาณความเร็วเครื่องพิมพ์ความร้อน USB ทั่วไป
+    spooler = PrintSpooler(printer, queue_max=jobs)
+    receipt = _sample_receipt()
+    started = time.perf_counter()
+    for _ in range(jobs):
+        spooler.submit(build_receipt(receipt, printed_at='bench'))
+    submitted = time.perf_counter() - started
+    spooler.join()
+    printed = time.perf_counter() - started
+    stats = spooler.stats()
+    spooler.close()
+    print(f"{jobs} receipts: build+submit {submitted / jobs * 1e6:.0f} us each (request thread), "
+          f"printed in {printed:.1f}s over {stats['batches']} batch(es), {stats['bytes'] / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if command == 'bench':
+        bench(int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
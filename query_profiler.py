@@ -0,0 +1,425 @@
+# Query Profiler
+# Project Bin - บันทึกทุก SQL ต่อ request (เวลา, จำนวนแถว, จุดที่เรียก) สำหรับ development/staging
+#
+# - cursor ของ connection pool ถูกห่อด้วย ProfiledCursor (ConnectionPool.cursor_wrapper) เมื่อเปิด QUERY_PROFILER
+# - หลังจบ request รายงานจะ flag
+#     repeated     คำสั่งเดียวกันถูกเรียกซ้ำ >= QUERY_PROFILER_REPEAT ครั้ง
+#                  (identical = ค่า params เหมือนกันทุกครั้ง, n_plus_one = ต่างกัน เช่น query ในลูป)
+#     slow         คำสั่งที่ใช้เวลาเกิน QUERY_PROFILER_SLOW_MS
+#     full_scan    SELECT ที่ EXPLAIN มี type = ALL (อ่านทั้งตาราง) หรือ index (อ่านทั้ง index)
+#   EXPLAIN รันใน thread แยกของ profiler บนการเชื่อมต่อของตัวเอง ไม่อยู่ในเส้นทางตอบกลับของ request
+#   ผลถูกเก็บต่อข้อความ SQL (รันครั้งเดียวต่อคำสั่ง) คำสั่งใหม่จึงถูก flag full_scan ตั้งแต่ request ถัดไป
+# - ค่า params ไม่ถูกเก็บในรายงานหรือ log (อาจมีอีเมล/ข้อมูลลูกค้า) เก็บเพียง hash ไว้แยก identical กับ n_plus_one
+#   ตั้ง QUERY_PROFILER_PARAMS=1 เพื่อเก็บค่าจริงบนเครื่อง development
+# - รายงานล่าสุดดูได้ที่ /query_profile (root_admin, administrator) และถูกเขียนต่อท้าย QUERY_PROFILER_LOG
+#   เป็น JSON หนึ่งบรรทัดต่อ request สำหรับวิเคราะห์ภายหลัง
+# - มี overhead ต่อ query (เก็บ call stack) ไม่ควรเปิดใน production
+#
+# ตัวแปร environment:
+#   QUERY_PROFILER            '1' = เปิด, ว่าง = ปิด
+#   QUERY_PROFILER_SLOW_MS    เกณฑ์ของคำสั่งที่ช้า (มิลลิวินาที)
+#   QUERY_PROFILER_REPEAT     จำนวนครั้งที่เรียกซ้ำแล้วถือว่าเป็น N+1
+#   QUERY_PROFILER_EXPLAIN    '0' = ไม่รัน EXPLAIN
+#   QUERY_PROFILER_PARAMS     '1' = เก็บค่า params จริงในรายงานและ log, ว่าง = เก็บเพียง hash
+#   QUERY_PROFILER_LOG        ไฟล์ JSON lines ของรายงาน ว่าง = ไม่เขียนไฟล์
+#   QUERY_PROFILER_KEEP       จำนวนรายงานล่าสุดที่เก็บในหน่วยความจำสำหรับหน้า /query_profile
+#
+# การใช้งาน:
+#   python query_profiler.py summary [log] [top]    สรุปจาก log: คำสั่งที่ใช้เวลารวมมากสุด, N+1, full scan แยกตาม endpoint
+
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+QUERY_PROFILER = os.environ.get('QUERY_PROFILER', '')
+QUERY_PROFILER_SLOW_MS = float(os.environ.get('QUERY_PROFILER_SLOW_MS', '100'))
+QUERY_PROFILER_REPEAT = int(os.environ.get('QUERY_PROFILER_REPEAT', '3'))
+QUERY_PROFILER_EXPLAIN = os.environ.get('QUERY_PROFILER_EXPLAIN', '1') != '0'
+QUERY_PROFILER_PARAMS = os.environ.get('QUERY_PROFILER_PARAMS', '') not in ('', '0')
+QUERY_PROFILER_LOG = os.environ.get('QUERY_PROFILER_LOG', 'query_profile.jsonl')
+QUERY_PROFILER_KEEP = int(os.environ.get('QUERY_PROFILER_KEEP', '100'))
+
+SQL_MAX_CHARS = 2000
+CALL_SITE_DEPTH = 3
+# เฟรมของชั้นเชื่อมต่อฐานข้อมูล ไม่ใช่จุดที่เรียก query จริง
+_INFRASTRUCTURE_FILES = ('query_profiler.py', 'request_metrics.py', 'db_pool.py')
+FULL_SCAN_TYPES = ('ALL', 'index')
+EXPLAIN_QUEUE_SIZE = 100
+# hash ของ params ใช้เทียบกันภายใน process เท่านั้น จึงใส่ key สุ่มไว้ ไม่ให้เดาค่าจาก hash ใน log ได้
+_PARAMS_KEY = os.urandom(16)
+
+
+def params_hash(params):
+    """Keyed digest of statement params: equal within this process for equal params, not reversible."""
+    if params is None:
+        return None
+    return hashlib.blake2b(repr(params).encode('utf-8', 'replace'), digest_size=8, key=_PARAMS_KEY).hexdigest()
+
+
+def normalize_sql(sql):
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode('utf-8', 'replace')
+    return ' '.join(str(sql).split())
+
+
+def _call_site():
+    """The innermost application frames that led to the query, e.g. 'app.py:1245 tbl_users'."""
+    frame = sys._getframe(2)
+    sites = []
+    while frame is not None and len(sites) < CALL_SITE_DEPTH:
+        filename = frame.f_code.co_filename
+        if not (filename.endswith(_INFRASTRUCTURE_FILES) or os.sep + 'mysql' + os.sep in filename
+                or os.sep + 'flask' + os.sep in filename or os.sep + 'werkzeug' + os.sep in filename):
+            sites.append(f"{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}")
+        frame = frame.f_back
+    return ' < '.join(sites)
+
+
+def explain_connection():
+    """Dedicated connection for EXPLAIN, outside the pool so it is neither profiled nor counted."""
+    import mysql.connector
+    from db_pool import DB_CONFIG
+    return mysql.connector.connect(**DB_CONFIG)
+
+
+class ProfiledCursor:
+    """Cursor proxy that records every statement with its timing, row count and call site."""
+
+    __slots__ = ('_cursor', '_profiler', '_entry')
+
+    def __init__(self, cursor, profiler):
+        self._cursor = cursor
+        self._profiler = profiler
+        self._entry = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._entry = self._profiler.record(operation, params, time.perf_counter() - started,
+                                                self._cursor.rowcount)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        seq_params = list(seq_params)
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._entry = self._profiler.record(operation, seq_params[0] if seq_params else None,
+                                                time.perf_counter() - started, self._cursor.rowcount,
+                                                batch=len(seq_params))
+
+    def _fetched(self, started, rows):
+        if self._entry is not None:
+            self._entry['fetch_ms'] += (time.perf_counter() - started) * 1000
+            self._entry['fetched'] += rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(started, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+
+class QueryProfiler:
+    """Captures the statements of each request and flags repeated, slow and full-scan queries."""
+
+    def __init__(self, slow_ms=QUERY_PROFILER_SLOW_MS, repeat=QUERY_PROFILER_REPEAT, explain=QUERY_PROFILER_EXPLAIN,
+                 log_path=QUERY_PROFILER_LOG, keep=QUERY_PROFILER_KEEP, connect=explain_connection,
+                 keep_params=QUERY_PROFILER_PARAMS):
+        self.slow_ms = slow_ms
+        self.repeat = repeat
+        self.explain = explain
+        self.keep_params = keep_params
+        self.log_path = log_path
+        self.connect = connect
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reports = deque(maxlen=keep)
+        self._plans = {}  # normalized SQL -> EXPLAIN summary
+        self._explain_conn = None
+        self._explain_queue = queue.Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+        self._explain_pending = set()
+        self._explain_thread = None
+
+    # --- Recording ---
+    def wrap_cursor(self, cursor):
+        return ProfiledCursor(cursor, self)
+
+    def start_request(self):
+        self._local.statements = []
+        self._local.started = time.perf_counter()
+
+    def record(self, sql, params, seconds, rowcount, batch=None):
+        statements = getattr(self._local, 'statements', None)
+        if statements is None:
+            return None
+        entry = {
+            'sql': normalize_sql(sql)[:SQL_MAX_CHARS],
+            'params': params,
+            'ms': seconds * 1000,
+            'fetch_ms': 0.0,
+            'rows': rowcount if rowcount is not None else -1,
+            'fetched': 0,
+            'site': _call_site(),
+        }
+        if batch is not None:
+            entry['batch'] = batch
+        statements.append(entry)
+        return entry
+
+    def finish_request(self, method, path, endpoint, status):
+        """Analyses the statements of the request, keeps the report and logs it. Returns the report."""
+        statements = getattr(self._local, 'statements', None)
+        if statements is None:
+            return None
+        self._local.statements = None
+        elapsed_ms = (time.perf_counter() - self._local.started) * 1000
+        report = self.analyse(statements)
+        report.update({
+            'id': uuid.uuid4().hex[:12],
+            'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'method': method,
+            'path': path,
+            'endpoint': endpoint,
+            'status': status,
+            'request_ms': round(elapsed_ms, 3),
+        })
+        with self._lock:
+            self._reports.append(report)
+        self._log(report)
+        return report
+
+    # --- Analysis ---
+    def analyse(self, statements):
+        groups = {}
+        for index, entry in enumerate(statements):
+            entry['index'] = index
+            entry['flags'] = []
+            entry['params_hash'] = params_hash(entry['params'])
+            group = groups.setdefault(entry['sql'], {'sql': entry['sql'], 'count': 0, 'ms': 0.0,
+                                                     'params': set(), 'sites': set(), 'first_params': entry['params']})
+            group['count'] += 1
+            group['ms'] += entry['ms'] + entry['fetch_ms']
+            group['params'].add(entry['params_hash'])
+            group['sites'].add(entry['site'])
+            if entry['ms'] + entry['fetch_ms'] >= self.slow_ms:
+                entry['flags'].append('slow')
+
+        findings = []
+        for group in groups.values():
+            if group['count'] >= self.repeat:
+                kind = 'identical' if len(group['params']) == 1 else 'n_plus_one'
+                findings.append({'flag': 'repeated', 'kind': kind, 'sql': group['sql'], 'count': group['count'],
+                                 'ms': round(group['ms'], 3), 'sites': sorted(group['sites'])})
+                for entry in statements:
+                    if entry['sql'] == group['sql']:
+                        entry['flags'].append(kind)
+            if self.explain and group['sql'][:6].upper() == 'SELECT':
+                plan = self.plan(group['sql'], group['first_params'])
+                if plan and plan.get('full_scan'):
+                    findings.append({'flag': 'full_scan', 'sql': group['sql'], 'count': group['count'],
+                                     'ms': round(group['ms'], 3), 'tables': plan['full_scan'],
+                                     'sites': sorted(group['sites'])})
+                    for entry in statements:
+                        if entry['sql'] == group['sql']:
+                            entry['flags'].append('full_scan')
+        for entry in statements:
+            if 'slow' in entry['flags']:
+                findings.append({'flag': 'slow', 'sql': entry['sql'], 'count': 1,
+                                 'ms': round(entry['ms'] + entry['fetch_ms'], 3), 'sites': [entry['site']]})
+
+        for entry in statements:
+            # rowcount ของ cursor แบบ unbuffered เป็น -1 จนกว่าจะ fetch ใช้จำนวนที่ fetch ได้แทน
+            fetched = entry.pop('fetched')
+            if fetched:
+                entry['rows'] = fetched
+            entry['ms'] = round(entry['ms'], 3)
+            entry['fetch_ms'] = round(entry['fetch_ms'], 3)
+            if self.keep_params and entry['params'] is not None:
+                entry['params'] = repr(entry['params'])[:500]
+            else:
+                del entry['params']
+        return {
+            'queries': len(statements),
+            'distinct': len(groups),
+            'db_ms': round(sum(entry['ms'] + entry['fetch_ms'] for entry in statements), 3),
+            'findings': findings,
+            'statements': statements,
+        }
+
+    def plan(self, sql, params):
+        """
+        Cached EXPLAIN summary for a statement ({'rows': [...], 'full_scan': [table, ...]}),
+        or None when it is not known yet; unknown statements are queued for the EXPLAIN thread.
+        """
+        with self._lock:
+            cached = self._plans.get(sql)
+            if cached is not None or sql in self._explain_pending:
+                return cached
+            try:
+                self._explain_queue.put_nowait((sql, params))
+            except queue.Full:
+                return None  # คิวเต็ม: ลองใหม่ใน request ถัดไปที่ใช้คำสั่งนี้
+            self._explain_pending.add(sql)
+            if self._explain_thread is None:
+                self._explain_thread = threading.Thread(target=self._explain_worker, name='query-profiler-explain',
+                                                        daemon=True)
+                self._explain_thread.start()
+        return None
+
+    def _explain_worker(self):
+        while True:
+            sql, params = self._explain_queue.get()
+            plan = self._explain(sql, params)
+            with self._lock:
+                self._explain_pending.discard(sql)
+                if plan is not None:
+                    self._plans[sql] = plan
+
+    def _explain(self, sql, params):
+        cursor = None
+        try:
+            if self._explain_conn is None:
+                self._explain_conn = self.connect()
+            cursor = self._explain_conn.cursor(dictionary=True)
+            cursor.execute("EXPLAIN " + sql, params)
+            rows = cursor.fetchall()
+            return {
+                'rows': [{key: row.get(key) for key in ('table', 'type', 'key', 'rows', 'Extra')} for row in rows],
+                'full_scan': [f"{row.get('table')} ({row.get('type')})" for row in rows
+                              if row.get('type') in FULL_SCAN_TYPES],
+            }
+        except Exception as e:
+            # ปิดการเชื่อมต่อทิ้ง ครั้งหน้าจะเชื่อมต่อใหม่ และไม่ cache ผลที่ล้มเหลว
+            print(f"Query profiler: EXPLAIN failed: {e}")
+            if self._explain_conn is not None:
+                try:
+                    self._explain_conn.close()
+                except Exception:
+                    pass
+                self._explain_conn = None
+            return None
+        finally:
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+    # --- Output ---
+    def _log(self, report):
+        if not self.log_path:
+            return
+        line = json.dumps(report, default=str, ensure_ascii=False)
+        try:
+            with self._lock:
+                with open(self.log_path, 'a', encoding='utf-8') as log:
+                    log.write(line + '\n')
+        except OSError as e:
+            print(f"Query profiler: could not write {self.log_path}: {e}")
+
+    def recent(self):
+        """Summaries of the kept reports, newest first."""
+        with self._lock:
+            reports = list(self._reports)
+        keys = ('id', 'at', 'method', 'path', 'endpoint', 'status', 'request_ms', 'queries', 'distinct', 'db_ms')
+        return [dict({key: report[key] for key in keys}, findings=len(report['findings'])) for report in reversed(reports)]
+
+    def report(self, report_id):
+        with self._lock:
+            for report in self._reports:
+                if report['id'] == report_id:
+                    return report
+        return None
+
+    # --- Flask ---
+    def init_app(self, app, skip_endpoints=('static',)):
+        from flask import request
+
+        def before_request():
+            if request.endpoint not in skip_endpoints:
+                self.start_request()
+
+        def after_request(response):
+            endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+            report = self.finish_request(request.method, request.full_path.rstrip('?'), endpoint, response.status_code)
+            if report is not None:
+                response.headers['X-Query-Profile'] = f"{report['id']} queries={report['queries']} findings={len(report['findings'])}"
+            return response
+
+        app.before_request(before_request)
+        app.after_request(after_request)
+
+
+def create_query_profiler(enabled=QUERY_PROFILER):
+    """Profiler when QUERY_PROFILER is set, otherwise None."""
+    return QueryProfiler() if enabled and enabled != '0' else None
+
+
+# --- Offline analysis ---
+def summary(log_path=QUERY_PROFILER_LOG, top=15):
+    """Aggregates a profiler log: statements by total time, and repeated/full-scan findings per endpoint."""
+    by_sql = {}
+    findings = {}
+    requests = {}
+    with open(log_path, encoding='utf-8') as log:
+        for line in log:
+            report = json.loads(line)
+            stats = requests.setdefault(report['endpoint'], [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += report['queries']
+            stats[2] += report['db_ms']
+            for entry in report['statements']:
+                total = by_sql.setdefault(entry['sql'], [0, 0.0, set()])
+                total[0] += 1
+                total[1] += entry['ms'] + entry['fetch_ms']
+                total[2].add(entry['site'].split(' < ')[0])
+            for finding in report['findings']:
+                key = (report['endpoint'], finding['flag'], finding.get('kind', ''), finding['sql'])
+                findings[key] = findings.get(key, 0) + 1
+
+    print(f"{'endpoint':<28}{'requests':>10}{'queries/req':>13}{'db ms/req':>11}")
+    for endpoint, (count, queries, db_ms) in sorted(requests.items(), key=lambda item: -item[1][1] / item[1][0]):
+        print(f"{endpoint:<28}{count:>10}{queries / count:>13.1f}{db_ms / count:>11.2f}")
+    print(f"\nTop {top} statements by total time:")
+    for sql, (count, ms, sites) in sorted(by_sql.items(), key=lambda item: -item[1][1])[:top]:
+        print(f"  {ms:>10.1f} ms {count:>7}x  {sql[:100]}\n{'':>23}{', '.join(sorted(sites))[:100]}")
+    print("\nFindings (requests affected):")
+    for (endpoint, flag, kind, sql), count in sorted(findings.items(), key=lambda item: -item[1])[:top * 2]:
+        print(f"  {count:>6}  {endpoint:<24} {flag + (':' + kind if kind else ''):<22} {sql[:80]}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'summary'
+    if command == 'summary':
+        summary(sys.argv[2] if len(sys.argv) > 2 else QUERY_PROFILER_LOG, int(sys.argv[3]) if len(sys.argv) > 3 else 15)
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
@@ -0,0 +1,107 @@
+# Report Cache
+# Project Bin - แคชไฟล์รายงาน PDF บนดิสก์ ใช้ key จากขอบเขตข้อมูล ตัวกรอง และ watermark ของข้อมูล
+#
+# watermark คือสรุปสถานะของคำสั่งซื้อในขอบเขตนั้น (จำนวนแถว, id ล่าสุด, updated_at ล่าสุด)
+# การเพิ่ม/แก้ไข/ลบ tbl_order ใด ๆ ในขอบเขตจะเปลี่ยน watermark ทำให้ key เดิมไม่ถูกใช้อีก
+# ไม่ต้องสั่งล้างแคชเอง ไฟล์เก่าจะถูกลบตามลำดับการใช้งาน (LRU) เมื่อขนาดรวมเกิน max_bytes
+# ไฟล์ถูกเขียนแบบ atomic (เขียนไฟล์ชั่วคราวแล้ว rename) จึงใช้โฟลเดอร์เดียวกันได้หลาย worker
+
+import hashlib
+import os
+import tempfile
+import threading
+
+REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'report_cache'))
+REPORT_CACHE_MAX_MB = int(os.environ.get('REPORT_CACHE_MAX_MB', '200'))
+
+
+class ReportCache:
+    """Size-bounded, content-addressed file cache; last access time is the file mtime."""
+
+    def __init__(self, directory=REPORT_CACHE_DIR, max_bytes=REPORT_CACHE_MAX_MB * 1024 * 1024, suffix='.pdf'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts):
+        """Hashes the key parts (scope, filters, watermark, ...) into a file-safe key."""
+        return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        """Returns the cached bytes for `key`, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # บันทึกเวลาใช้งานล่าสุดสำหรับ LRU
+        except OSError:
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+        with self._lock:
+            self._stats['hits'] += 1
+        return data
+
+    def put(self, key, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._stats['stores'] += 1
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(self.suffix):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue  # ถูก worker อื่นลบไปแล้ว
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                with self._lock:
+                    self._stats['evictions'] += 1
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['files'] = len(entries)
+        stats['bytes'] = sum(size for _, size, _ in entries)
+        stats['max_bytes'] = self.max_bytes
+        return stats
@@ -0,0 +1,325 @@
+# Request Metrics (Prometheus)
+# Project Bin - วัดเวลาต่อ endpoint, จำนวน/เวลา query ต่อ request และเวลาเรนเดอร์ (template, PDF, ภาพ)
+#
+# - เวลา request วัดจาก before_request ถึง after_request แยกตาม endpoint, method และ status
+#   (response แบบ streaming เช่น CSV และ SSE วัดถึงตอนเริ่มส่งเท่านั้น)
+# - query นับผ่าน cursor ที่ connection pool ห่อไว้ (ConnectionPool.cursor_wrapper) เวลา fetch รวมใน DB time
+#   query นอก request (thread เบื้องหลัง, session store) ถูกนับแยกเป็น background
+# - เวลาเรนเดอร์ template มาจาก signal ของ Flask ส่วน PDF/ภาพ วัดด้วย timer() รอบจุดที่เรียก
+# - ค่าทั้งหมดเก็บในหน่วยความจำของ process (แต่ละ worker มีชุดของตัวเอง) และส่งออกเป็น Prometheus text
+#   format ที่ /metrics การบันทึกหนึ่งครั้งคือ bisect + การบวกภายใต้ lock เดียวของ histogram นั้น
+#
+# ตัวแปร environment:
+#   METRICS_TOKEN    /metrics ต้องส่ง "Authorization: Bearer <token>" ถ้าว่าง /metrics ถูกปิด
+#
+# การใช้งาน:
+#   python request_metrics.py bench [iterations]    วัด overhead ของการบันทึกและของ cursor ที่ห่อไว้
+
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+PREFIX = 'projectbin'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Prometheus histogram with fixed buckets, one series per label-value tuple."""
+
+    def __init__(self, name, help, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self, lines):
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for label_values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                bucket_labels = _labels(self.label_names, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            bucket_labels = _labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, label_values)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, label_values)} {cumulative}")
+
+
+class Counter:
+    """Prometheus counter, one value per label-value tuple."""
+
+    def __init__(self, name, help, label_names):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self, lines):
+        with self._lock:
+            snapshot = dict(self._values)
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} counter")
+        for label_values, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {value:g}")
+
+
+class TimedCursor:
+    """Cursor proxy that reports the time of every execute and fetch to RequestMetrics."""
+
+    __slots__ = ('_cursor', '_metrics')
+
+    def __init__(self, cursor, metrics):
+        self._cursor = cursor
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        finally:
+            self._metrics.record_query(time.perf_counter() - started)
+
+    def executemany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(*args, **kwargs)
+        finally:
+            self._metrics.record_query(time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return self._cursor.fetchone()
+        finally:
+            self._metrics.record_fetch(time.perf_counter() - started)
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.fetchmany(*args, **kwargs)
+        finally:
+            self._metrics.record_fetch(time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return self._cursor.fetchall()
+        finally:
+            self._metrics.record_fetch(time.perf_counter() - started)
+
+
+class RequestMetrics:
+    """Per-process request, query and render metrics with a Prometheus text exporter."""
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self.request_seconds = Histogram(f'{prefix}_request_duration_seconds', 'Request latency by endpoint.',
+                                         ('endpoint', 'method'))
+        self.requests = Counter(f'{prefix}_requests_total', 'Requests by endpoint, method and status.',
+                                ('endpoint', 'method', 'status'))
+        self.request_queries = Histogram(f'{prefix}_request_db_queries', 'DB queries executed per request.',
+                                         ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.request_db_seconds = Histogram(f'{prefix}_request_db_seconds', 'DB time (execute + fetch) per request.',
+                                            ('endpoint',))
+        self.render_seconds = Histogram(f'{prefix}_render_duration_seconds', 'Template, PDF and image render time.',
+                                        ('kind', 'name'))
+        self.background_queries = Counter(f'{prefix}_background_db_queries_total',
+                                          'DB queries executed outside a request.', ())
+        self.background_db_seconds = Counter(f'{prefix}_background_db_seconds_total',
+                                             'DB time spent outside a request.', ())
+        self._metrics = (self.request_seconds, self.requests, self.request_queries, self.request_db_seconds,
+                         self.render_seconds, self.background_queries, self.background_db_seconds)
+        self._gauge_sources = []  # (name, help, stats function)
+        self._local = threading.local()
+
+    # --- Recording ---
+    def wrap_cursor(self, cursor):
+        """ConnectionPool.cursor_wrapper: times the cursor's queries."""
+        return TimedCursor(cursor, self)
+
+    def start_request(self):
+        # [จำนวน query, เวลา DB, เวลาเริ่ม] ของ request ใน thread นี้ (None = ไม่ได้อยู่ใน request)
+        self._local.request = [0, 0.0, time.perf_counter()]
+
+    def record_query(self, seconds):
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            current[0] += 1
+            current[1] += seconds
+        else:
+            self.background_queries.inc(())
+            self.background_db_seconds.inc((), seconds)
+
+    def record_fetch(self, seconds):
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            current[1] += seconds
+        else:
+            self.background_db_seconds.inc((), seconds)
+
+    def finish_request(self, endpoint, method, status):
+        current = getattr(self._local, 'request', None)
+        if current is None:
+            return
+        self._local.request = None
+        queries, db_seconds, started = current
+        self.request_seconds.observe((endpoint, method), time.perf_counter() - started)
+        self.requests.inc((endpoint, method, str(status)))
+        self.request_queries.observe((endpoint,), queries)
+        self.request_db_seconds.observe((endpoint,), db_seconds)
+
+    @contextmanager
+    def timer(self, kind, name):
+        """Records the duration of the with-block as a render of `kind` ('pdf', 'image', ...)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.render_seconds.observe((kind, name), time.perf_counter() - started)
+
+    def add_gauges(self, name, help, stats):
+        """Exports the numeric values of `stats()` (e.g. ConnectionPool.stats) as {prefix}_{name}_{key} gauges."""
+        self._gauge_sources.append((name, help, stats))
+
+    # --- Flask ---
+    def init_app(self, app):
+        from flask import before_render_template, request, template_rendered
+
+        def before_request():
+            self.start_request()
+
+        def after_request(response):
+            # ใช้ชื่อ endpoint ไม่ใช่ path เพื่อไม่ให้จำนวน series เพิ่มตาม URL (เช่น /barcode/<code>)
+            endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+            if response.is_streamed:
+                # response แบบ streaming (เช่น export CSV) ยัง query/fetch ต่อหลังจากนี้ในขณะส่งข้อมูล
+                # จึงปิดการนับเมื่อส่งครบ (ทำงานใน thread เดียวกัน)
+                response.call_on_close(lambda status=response.status_code, method=request.method:
+                                       self.finish_request(endpoint, method, status))
+            else:
+                self.finish_request(endpoint, request.method, response.status_code)
+            return response
+
+        def template_started(sender, template, context, **extra):
+            self._local.template_started = time.perf_counter()
+
+        def template_finished(sender, template, context, **extra):
+            started = getattr(self._local, 'template_started', None)
+            if started is not None:
+                self._local.template_started = None
+                self.render_seconds.observe(('template', template.name), time.perf_counter() - started)
+
+        app.before_request(before_request)
+        app.after_request(after_request)
+        before_render_template.connect(template_started, app, weak=False)
+        template_rendered.connect(template_finished, app, weak=False)
+
+    # --- Exporting ---
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            metric.render(lines)
+        for name, help, stats in self._gauge_sources:
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"Metrics: could not read {name} stats: {e}")
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)):
+                    metric = f"{self.prefix}_{name}_{key}"
+                    lines.append(f"# HELP {metric} {help} ({key})")
+                    lines.append(f"# TYPE {metric} gauge")
+                    lines.append(f"{metric} {float(value):g}")
+        lines.append('')
+        return '\n'.join(lines)
+
+
+# --- Benchmark ---
+class _NullCursor:
+    rowcount = 0
+
+    def execute(self, query, params=()):
+        return None
+
+    def fetchall(self):
+        return []
+
+
+def bench(iterations=200000):
+    metrics = RequestMetrics()
+    raw = _NullCursor()
+    timed = metrics.wrap_cursor(raw)
+
+    def per_call(operation):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            operation()
+        return (time.perf_counter() - started) / iterations * 1e9
+
+    metrics.start_request()
+    plain = per_call(lambda: (raw.execute("SELECT 1"), raw.fetchall()))
+    wrapped = per_call(lambda: (timed.execute("SELECT 1"), timed.fetchall()))
+    request = per_call(lambda: (metrics.start_request(), metrics.finish_request('cart', 'POST', 200)))
+    observe = per_call(lambda: metrics.request_seconds.observe(('cart', 'GET'), 0.012))
+    for i in range(200):
+        metrics.request_seconds.observe((f'endpoint_{i % 40}', 'GET'), i / 1000)
+    started = time.perf_counter()
+    text = metrics.render()
+    rendered = time.perf_counter() - started
+    print(f"cursor execute+fetchall: {plain:.0f} ns plain, {wrapped:.0f} ns wrapped (+{wrapped - plain:.0f} ns per query)")
+    print(f"request start+finish: {request:.0f} ns, histogram observe: {observe:.0f} ns")
+    print(f"/metrics render: {rendered * 1000:.2f} ms for {len(text.splitlines())} lines")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if command == 'bench':
+        bench(int(sys.argv[2]) if len(sys.argv) > 2 else 200000)
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
@@ -0,0 +1,337 @@
+# Server-side Sessions
+# Project Bin - เก็บข้อมูล session ไว้ฝั่งเซิร์ฟเวอร์ cookie เหลือเพียงรหัส session แบบสุ่ม
+#
+# เดิม Flask เก็บทั้ง session (รวม receipt_data ที่มีรายการสินค้าทั้งตะกร้า) ไว้ใน cookie ที่ลงลายเซ็น
+# ทำให้ทุก request ต้องส่ง cookie ขนาดใหญ่ และตะกร้าใหญ่ ๆ อาจเกินขนาด cookie ที่ browser รับได้
+#
+# Backend (ตั้งค่าด้วย SESSION_BACKEND):
+#   sqlite  ไฟล์ SQLite ในเครื่อง (SESSION_SQLITE_PATH) เหมาะกับตู้/เครื่องเดียว
+#   mysql   ตาราง tbl_session ในฐานข้อมูลหลัก ใช้ร่วมกันได้ทุก worker/ทุกเครื่อง (ต้องรัน db_migrations.py upgrade)
+#   cookie  ใช้ cookie แบบเดิมของ Flask
+#
+# การใช้งาน:
+#   python server_session.py bench [items]    เทียบขนาด cookie/request ก่อนและหลัง สำหรับตะกร้า items รายการ
+#   python server_session.py purge            ลบ session ที่หมดอายุแล้วออกจาก backend ที่ตั้งค่าไว้
+
+import os
+import pickle
+import random
+import re
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+SESSION_SQLITE_PATH = os.environ.get('SESSION_SQLITE_PATH',
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.sqlite3'))
+SESSION_TTL = int(os.environ.get('SESSION_TTL', str(12 * 3600)))  # seconds of inactivity before a session expires
+PURGE_PROBABILITY = 0.01  # สัดส่วนของการบันทึกที่จะล้าง session หมดอายุไปด้วย
+
+_SID_RE = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict that tracks modification, backed by a store entry `sid`."""
+
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+        self.accessed = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Moves the data to a new random id; the old entry is deleted when the session is saved."""
+        if not self.new and self.replaced_sid is None:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+
+class SQLiteSessionStore:
+    """Sessions in a local SQLite file. Safe for several threads and processes on one machine."""
+
+    def __init__(self, path=SESSION_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid):
+        """Returns (data, expires_at) or None if the session is missing or expired."""
+        row = self._conn().execute("SELECT data, expires_at FROM sessions WHERE sid = ? AND expires_at > ?",
+                                   (sid, time.time())).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, sid, data, expires_at):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)", (sid, data, expires_at))
+        conn.commit()
+
+    def touch(self, sid, expires_at):
+        conn = self._conn()
+        conn.execute("UPDATE sessions SET expires_at = ? WHERE sid = ?", (expires_at, sid))
+        conn.commit()
+
+    def delete(self, sid):
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+        conn.commit()
+
+    def purge_expired(self):
+        conn = self._conn()
+        deleted = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+        conn.commit()
+        return deleted
+
+
+class MySQLSessionStore:
+    """
+    Sessions in tbl_session, shared by every worker that uses the same database.
+    `connect` must return a connection the store may commit on and close, so
+    session writes never join the request's own transaction.
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+
+    def _execute(self, query, params, fetch=False):
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            if fetch:
+                return cursor.fetchone()
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            cursor.close()
+            conn.close()
+
+    def get(self, sid):
+        row = self._execute("SELECT data, expires_at FROM tbl_session WHERE session_id = %s AND expires_at > %s",
+                            (sid, time.time()), fetch=True)
+        return (bytes(row[0]), float(row[1])) if row else None
+
+    def set(self, sid, data, expires_at):
+        self._execute("""
+            INSERT INTO tbl_session (session_id, data, expires_at) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE data = VALUES(data), expires_at = VALUES(expires_at)
+        """, (sid, data, expires_at))
+
+    def touch(self, sid, expires_at):
+        self._execute("UPDATE tbl_session SET expires_at = %s WHERE session_id = %s", (expires_at, sid))
+
+    def delete(self, sid):
+        self._execute("DELETE FROM tbl_session WHERE session_id = %s", (sid,))
+
+    def purge_expired(self):
+        return self._execute("DELETE FROM tbl_session WHERE expires_at <= %s", (time.time(),))
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Flask session interface that keeps session data in `store` and puts only
+    an opaque random id in the cookie. Data is pickled, so Decimal and datetime
+    values (e.g. receipt_data) come back with their original types.
+    Sessions expire after `ttl` seconds without activity; the expiry is pushed
+    forward at most once per half ttl so reads do not turn into writes.
+    """
+
+    def __init__(self, store, ttl=SESSION_TTL):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SID_RE.match(sid):
+            try:
+                entry = self.store.get(sid)
+            except Exception as e:
+                print(f"Session store error on read: {e}")
+                entry = None
+            if entry is not None:
+                try:
+                    return ServerSession(pickle.loads(entry[0]), sid=sid, expires_at=entry[1])
+                except Exception as e:
+                    print(f"Discarding unreadable session {sid[:8]}...: {e}")
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        # ข้อผิดพลาดของ store ตอนบันทึกไม่ทำให้ request ที่ทำงานเสร็จแล้วกลายเป็น 500 (เหมือน open_session)
+        if session.replaced_sid:
+            self._store_call('delete', session.replaced_sid)
+
+        if not session:
+            if not session.new:
+                self._store_call('delete', session.sid)
+            if session.modified or not session.new:
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        expires_at = time.time() + self.ttl
+        if session.modified or session.new:
+            if not self._store_call('set', session.sid, pickle.dumps(dict(session), pickle.HIGHEST_PROTOCOL),
+                                    expires_at):
+                return
+        elif session.expires_at is None or session.expires_at - time.time() < self.ttl / 2:
+            if not self._store_call('touch', session.sid, expires_at):
+                return
+        else:
+            return
+
+        if random.random() < PURGE_PROBABILITY:
+            try:
+                self.store.purge_expired()
+            except Exception as e:
+                print(f"Session purge failed: {e}")
+
+        response.set_cookie(name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+    def _store_call(self, method, *args):
+        """Runs a store write; returns False (and logs) when the store fails."""
+        try:
+            getattr(self.store, method)(*args)
+            return True
+        except Exception as e:
+            print(f"Session store error on {method}: {e}")
+            return False
+
+
+def regenerate_session(session):
+    """
+    Gives a server-side session a new id (call on login and logout so an id
+    seen before authentication is never reused). No-op for cookie sessions.
+    """
+    if isinstance(session, ServerSession):
+        session.regenerate()
+
+
+def create_session_store(backend=SESSION_BACKEND, connect=None):
+    """Returns the store for `backend`, or None for the plain cookie session."""
+    if backend == 'cookie':
+        return None
+    if backend == 'sqlite':
+        return SQLiteSessionStore(SESSION_SQLITE_PATH)
+    if backend == 'mysql':
+        if connect is None:
+            raise ValueError("The mysql session backend needs a connect function")
+        return MySQLSessionStore(connect)
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+
+
+# --- Benchmark ---
+def _sample_receipt(items):
+    from datetime import datetime
+    from decimal import Decimal
+    orders = []
+    for i in range(items):
+        orders.append({
+            'id': 100000 + i, 'order_id': '100123', 'products_id': 5000 + i,
+            'products_name': f'ขวดพลาสติก PET ขนาด {i % 7 + 1} ลิตร', 'quantity': 1 + i % 3, 'disquantity': 0,
+            'email': 'member@example.com', 'barcode_id': str(8850000000000 + i), 'store_id': 1,
+            'price_per_unit': Decimal('12.50'), 'price': Decimal('12.50'), 'order_date': datetime.now(),
+        })
+    return {
+        'loggedin': True, 'id': 42, 'email': 'member@example.com', 'role': 'member', 'store_id': 1,
+        'receipt_data': {'orders': orders, 'barcode_id': '1234567890123', 'total_quantity': 2 * items,
+                         'total_price': Decimal('12.50') * items, 'current_order_id': '100123'},
+    }
+
+
+def bench(items=50):
+    from flask import Flask
+    from flask.sessions import SecureCookieSessionInterface
+
+    app = Flask(__name__)
+    app.secret_key = 'bench'
+    data = _sample_receipt(items)
+    with app.test_request_context():
+        serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+        cookie_value = serializer.dumps(data)
+    sid = secrets.token_urlsafe(32)
+    store_bytes = len(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+
+    print(f"Cart with {items} item(s):")
+    print(f"  signed cookie session : {len(cookie_value):>8,} bytes per request"
+          f"{'  (exceeds the 4096 byte browser limit)' if len(cookie_value) > 4093 else ''}")
+    print(f"  server-side session   : {len(sid):>8,} bytes per request ({store_bytes:,} bytes kept in the store)")
+
+    store = SQLiteSessionStore(':memory:')
+    interface = ServerSessionInterface(store)
+    iterations = 2000
+    start = time.perf_counter()
+    for _ in range(iterations):
+        store.set(sid, pickle.dumps(data, pickle.HIGHEST_PROTOCOL), time.time() + interface.ttl)
+        pickle.loads(store.get(sid)[0])
+    elapsed = time.perf_counter() - start
+    print(f"  sqlite store round trip: {elapsed / iterations * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if command == 'bench':
+        for count in ([int(sys.argv[2])] if len(sys.argv) > 2 else [1, 10, 50, 200]):
+            bench(count)
+    elif command == 'purge':
+        connect = None
+        if SESSION_BACKEND == 'mysql':
+            import mysql.connector
+            from db_pool import DB_CONFIG
+            connect = lambda: mysql.connector.connect(**DB_CONFIG)
+        store = create_session_store(SESSION_BACKEND, connect)
+        print(f"Purged {store.purge_expired() if store else 0} expired session(s).")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
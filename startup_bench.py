@@ -0,0 +1,68 @@
+# Startup Benchmark
+# Project Bin - วัดเวลา import และหน่วยความจำเริ่มต้น (RSS) ของแอปแต่ละ profile (APP_PROFILE)
+#
+# แต่ละ profile ถูกวัดใน process ใหม่: เวลา import app.py (สร้างแอปด้วย create_app แล้ว), peak RSS,
+# จำนวน route และไลบรารีหนัก (PDF/ภาพ) ที่ถูกโหลดตอนเริ่ม จากนั้นวัดต้นทุนที่ถูกเลื่อนไปตอนใช้งานครั้งแรก
+# (import pdf_render และ label_sheet) แยกไว้อีกคอลัมน์
+# ไม่ต้องเชื่อมต่อฐานข้อมูล (connection pool ถูกสร้างเมื่อใช้งานครั้งแรก)
+#
+# การใช้งาน:
+#   python startup_bench.py [runs]    ค่ามัธยฐานจาก runs ครั้งต่อ profile (ค่าเริ่มต้น 5)
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ('xhtml2pdf', 'reportlab', 'pypdf', 'PIL')
+
+
+def _measure():
+    """Imports the app in this process and prints the measurements as JSON."""
+    import resource
+    import time
+
+    started = time.perf_counter()
+    import app
+    import_s = time.perf_counter() - started
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+    routes = sum(1 for rule in app.app.url_map.iter_rules() if rule.endpoint != 'static')
+
+    started = time.perf_counter()
+    import label_sheet  # noqa: F401 (ดึง pdf_render, PIL, reportlab ตามมาด้วย)
+    first_use_s = time.perf_counter() - started
+    first_use_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'import_s': import_s, 'rss_kb': rss_kb, 'routes': routes, 'heavy': heavy,
+                      'first_use_s': first_use_s, 'first_use_rss_kb': first_use_rss_kb}))
+
+
+def bench(runs=5):
+    from app import PROFILES
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    print(f"{'profile':<11}{'routes':>7}{'import (ms)':>13}{'RSS (MB)':>10}{'first PDF/label use (ms)':>26}"
+          f"{'RSS after (MB)':>16}  heavy modules at startup")
+    for profile in PROFILES:
+        samples = []
+        for _ in range(runs):
+            env = dict(os.environ, APP_PROFILE=profile)
+            output = subprocess.run([sys.executable, __file__, '_measure'], cwd=directory, env=env,
+                                    check=True, capture_output=True, text=True).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        median = lambda key: statistics.median(sample[key] for sample in samples)
+        print(f"{profile:<11}{samples[0]['routes']:>7}{median('import_s') * 1000:>13.0f}{median('rss_kb') / 1024:>10.1f}"
+              f"{median('first_use_s') * 1000:>26.0f}{median('first_use_rss_kb') / 1024:>16.1f}  "
+              f"{', '.join(samples[0]['heavy']) or '-'}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else '5'
+    if command == '_measure':
+        _measure()
+    elif command.isdigit():
+        bench(int(command))
+    else:
+        print("Usage: python startup_bench.py [runs]")
+        sys.exit(1)
@@ -0,0 +1,67 @@
+# Statistics Cache
+# Project Bin - แคชสถิติหน้าแรกในหน่วยความจำ (อายุสั้น + ล้างเมื่อมีการเขียนข้อมูล)
+#
+# แคชนี้อยู่ในแต่ละ process เท่านั้น worker อื่นจะเห็นค่าที่ค้างได้ไม่เกิน ttl วินาที
+
+import threading
+import time
+
+
+class StatsCache:
+    """
+    Small TTL cache keyed by (scope, store_id).
+    Scopes listed in `global_scopes` aggregate over every store, so a write to
+    any store invalidates them as well as the entries of that store.
+    """
+
+    def __init__(self, ttl=30.0, global_scopes=()):
+        self.ttl = ttl
+        self.global_scopes = set(global_scopes)
+        self._entries = {}  # (scope, store_id) -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self._misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, *store_ids):
+        """
+        Drops the entries affected by a write to `store_ids`.
+        Called without arguments (or with None) it clears the whole cache.
+        """
+        with self._lock:
+            self._invalidations += 1
+            if not store_ids or None in store_ids:
+                self._entries.clear()
+                return
+            for key in list(self._entries):
+                scope, store_id = key
+                if store_id in store_ids or store_id is None or scope in self.global_scopes:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'invalidations': self._invalidations,
+                'ttl': self.ttl,
+            }
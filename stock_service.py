@@ -0,0 +1,126 @@
+# Stock Service
+# Project Bin - ระบบปรับปรุงสต็อกสินค้าแบบ atomic
+#
+# ทุกเส้นทางที่เปลี่ยนแปลง stock_quantity ต้องเรียกผ่านคลาสนี้
+# การตัดสต็อกใช้ UPDATE แบบมีเงื่อนไขเพียงคำสั่งเดียว (ไม่มี SELECT ก่อน และไม่ล็อกแบบ FOR UPDATE)
+# จึงไม่มีทางที่ตู้หลายเครื่องสแกนพร้อมกันแล้วทำให้สต็อกติดลบได้
+#
+# ทดสอบการทำงานพร้อมกัน (ใช้ฐานข้อมูลทดสอบแยก <DB_NAME>_bench):
+#   python stock_service.py hammer [threads] [attempts_per_thread] [initial_stock]
+
+import sys
+import threading
+
+
+class StockService:
+    """Atomic stock mutations on tbl_products. The caller owns the transaction."""
+
+    @staticmethod
+    def reserve(cursor, products_id, quantity):
+        """
+        Takes `quantity` units out of stock in one guarded UPDATE.
+        Returns True on success, False if the product does not have enough stock
+        (or does not exist); nothing is changed in that case.
+        """
+        if quantity <= 0:
+            return True
+        cursor.execute("""
+            UPDATE tbl_products SET stock_quantity = stock_quantity - %s
+            WHERE products_id = %s AND stock_quantity >= %s
+        """, (quantity, products_id, quantity))
+        return cursor.rowcount == 1
+
+    @staticmethod
+    def release(cursor, products_id, quantity):
+        """Puts `quantity` units back into stock."""
+        if quantity <= 0:
+            return
+        cursor.execute("UPDATE tbl_products SET stock_quantity = stock_quantity + %s WHERE products_id = %s",
+                       (quantity, products_id))
+
+    @staticmethod
+    def adjust(cursor, products_id, delta):
+        """
+        Applies a signed stock change: negative reserves, positive releases.
+        Returns False only when a reservation could not be satisfied.
+        """
+        if delta < 0:
+            return StockService.reserve(cursor, products_id, -delta)
+        StockService.release(cursor, products_id, delta)
+        return True
+
+    @staticmethod
+    def current(cursor, products_id):
+        """Reads the current stock level; used only to build error messages."""
+        cursor.execute("SELECT stock_quantity FROM tbl_products WHERE products_id = %s", (products_id,))
+        row = cursor.fetchone()
+        if not row:
+            return 0
+        return row['stock_quantity'] if isinstance(row, dict) else row[0]
+
+
+# --- Concurrency check ---
+def hammer(threads=32, attempts=50, initial_stock=500):
+    """
+    Starts `threads` workers that each try to reserve one unit `attempts` times
+    against a single product, each on its own connection and transaction.
+    Exactly `initial_stock` reservations must succeed and the stock must end at 0.
+    """
+    import mysql.connector
+    from db_migrations import BENCH_DATABASE
+    from db_pool import DB_CONFIG
+
+    config = {k: v for k, v in DB_CONFIG.items() if k != 'database'}
+    setup = mysql.connector.connect(**config)
+    cursor = setup.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{BENCH_DATABASE}`")
+    cursor.execute(f"USE `{BENCH_DATABASE}`")
+    cursor.execute("DROP TABLE IF EXISTS tbl_products")
+    cursor.execute("""
+        CREATE TABLE tbl_products (
+            products_id int(11) NOT NULL PRIMARY KEY,
+            stock_quantity int(11) NOT NULL
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute("INSERT INTO tbl_products (products_id, stock_quantity) VALUES (1, %s)", (initial_stock,))
+    setup.commit()
+
+    successes = []
+    lock = threading.Lock()
+
+    def worker():
+        conn = mysql.connector.connect(database=BENCH_DATABASE, **config)
+        cur = conn.cursor()
+        won = 0
+        for _ in range(attempts):
+            if StockService.reserve(cur, 1, 1):
+                won += 1
+            conn.commit()
+        cur.close()
+        conn.close()
+        with lock:
+            successes.append(won)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    final_stock = StockService.current(cursor, 1)
+    cursor.close()
+    setup.close()
+
+    total = sum(successes)
+    expected = min(initial_stock, threads * attempts)
+    print(f"threads={threads} attempts={threads * attempts} reserved={total} final_stock={final_stock}")
+    ok = total == expected and final_stock == initial_stock - expected and final_stock >= 0
+    print("OK" if ok else "FAILED: stock was oversold or lost")
+    return ok
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'hammer':
+        args = [int(a) for a in sys.argv[2:5]]
+        sys.exit(0 if hammer(*args) else 1)
+    print("Usage: python stock_service.py hammer [threads] [attempts_per_thread] [initial_stock]")